@@ -4,34 +4,34 @@ GigaChat Tool Calling Agent (максимально упрощённая вер
 Рекомендуемый подход от Сбера для работы с инструментами
 """
 
-import os
+import re
+import asyncio
 import time
+import logging
 import sys
-from typing import Dict, Any
+import hashlib
+import threading
+from collections import defaultdict, deque
+from typing import Dict, Any, Deque
 from dotenv import load_dotenv
-from langchain_gigachat import GigaChat
-from langchain_core.messages import HumanMessage, SystemMessage, FunctionMessage
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
 from langchain.agents import create_tool_calling_agent, AgentExecutor
 from langchain_core.prompts import ChatPromptTemplate
 from pydantic import Field
 from langchain_gigachat.tools.giga_tool import giga_tool
+from gigachat.context import session_id_cvar
 
-from document_processor import search_documents
+from document_processor import search_documents, embeddings, start_warmup
+from semantic_cache import SemanticCache
+from llm_client import get_llm
 
 # Загрузка переменных окружения
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # Инициализация компонентов один раз при запуске
-gc_auth = os.getenv('GIGACHAT_TOKEN')
-if not gc_auth:
-    raise ValueError("Не найден токен GigaChat в переменных окружения")
-
-llm = GigaChat(
-    credentials=gc_auth,
-    model='GigaChat:latest',
-    verify_ssl_certs=False,
-    profanity_check=False
-)
+llm = get_llm()
 print("✅ GigaChat LLM инициализирован")
 
 # Конфигурация коллекций
@@ -56,6 +56,21 @@ COLLECTIONS_CONFIG = {
     }
 }
 
+# Обратный индекс ключевых слов: ключевое слово (в нижнем регистре) -> коллекция.
+# Одно регулярное выражение находит все ключевые слова запроса за один проход
+KEYWORD_TO_COLLECTION = {
+    keyword.strip().lower(): collection
+    for collection, config in COLLECTIONS_CONFIG.items()
+    for keyword in config["keywords"].split(",")
+    if keyword.strip()
+}
+KEYWORDS_RE = re.compile("|".join(map(re.escape, sorted(KEYWORD_TO_COLLECTION, key=len, reverse=True))))
+
+def route_by_keywords(user_query: str):
+    """Возвращает коллекцию, если ключевые слова запроса относятся ровно к одной коллекции, иначе None."""
+    matched = {KEYWORD_TO_COLLECTION[keyword] for keyword in KEYWORDS_RE.findall(user_query.lower())}
+    return matched.pop() if len(matched) == 1 else None
+
 # Примеры для DAMA поиска
 dama_dmbok_few_shot_examples = [
     {
@@ -110,13 +125,18 @@ def create_search_function(collection: str, collection_name: str, function_name:
     @giga_tool(few_shot_examples=globals()[f"{collection}_few_shot_examples"])
     def search_func(query: str = Field(description=f"Поисковый запрос на русском языке для поиска в {collection_name}")) -> str:
         """Универсальная функция поиска с автоматическим логированием."""
-        print(f"\n🔍 ВЫЗОВ ИНСТРУМЕНТА: {function_name}")
-        print(f"📝 Запрос: {query}")
+        logger.debug("Вызов инструмента %s, запрос: %s", function_name, query)
         result = search_documents_tool(query, collection, collection_name)
-        print(f"📄 Результат {function_name} ({len(result)} символов):")
-        print(f"---\n{result}\n---")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Результат %s (%d символов):\n---\n%s\n---", function_name, len(result), result)
         return result
     
+    async def asearch_func(query: str) -> str:
+        """Асинхронный вариант поиска: AgentExecutor.ainvoke выполняет несколько вызовов инструментов одного шага параллельно."""
+        return await asyncio.to_thread(search_func.func, query)
+    
+    search_func.coroutine = asearch_func
+    
     # Устанавливаем правильное имя функции
     search_func.__name__ = function_name
     return search_func
@@ -132,26 +152,21 @@ for collection, config in COLLECTIONS_CONFIG.items():
 def search_documents_tool(query: str, collection: str, collection_name: str) -> str:
     """Универсальная функция поиска документов."""
     try:
-        print(f"🔎 Поиск в {collection_name}: {query}")
+        logger.debug("Поиск в %s: %s", collection_name, query)
         results = search_documents(query, collection, n_results=5)
-        print(f"📊 Получено результатов: {len(results) if results else 0}")
         
         if not results:
-            print(f"⚠️ Результаты не найдены в {collection_name}")
+            logger.debug("Результаты не найдены в %s", collection_name)
             return f"Информация по данному запросу не найдена в {collection_name}."
         
-        content_parts = []
-        for i, result in enumerate(results, 1):
-            source = result['metadata'].get('source', 'Неизвестный источник')
-            score = result['score']
-            content_parts.append(f"Источник {i}: {source} (релевантность: {score:.3f})\n{result['text']}")
-            print(f"📋 Результат {i}: {source} (score: {score:.3f})")
-        
-        final_result = "\n\n---\n\n".join(content_parts)
-        print(f"✅ Финальный результат для {collection_name}: {len(final_result)} символов")
+        final_result = "\n\n---\n\n".join(
+            f"Источник {i}: {result['metadata'].get('source', 'Неизвестный источник')} (релевантность: {result['score']:.3f})\n{result['text']}"
+            for i, result in enumerate(results, 1)
+        )
+        logger.debug("Результат для %s: %d фрагментов, %d символов", collection_name, len(results), len(final_result))
         return final_result
     except Exception as e:
-        print(f"❌ Ошибка поиска в {collection_name}: {e}")
+        logger.error("Ошибка поиска в %s: %s", collection_name, e)
         return f"Ошибка при поиске в {collection_name}: {str(e)}"
 
 print("✅ Функции для GigaChat настроены")
@@ -185,9 +200,18 @@ def generate_system_prompt():
     
     return "\n".join(prompt_parts)
 
-# Создание промпта для агента
+# Системный промпт вычисляется один раз: байт-в-байт одинаковый префикс
+# позволяет GigaChat кэшировать его на стороне сервера (по заголовку X-Session-ID)
+SYSTEM_PROMPT = generate_system_prompt()
+SYSTEM_PROMPT_HASH = hashlib.sha256(SYSTEM_PROMPT.encode("utf-8")).hexdigest()[:16]
+
+# Создание промпта для агента.
+# Статичный системный промпт идёт первым, динамические части (история, запрос,
+# результаты инструментов в agent_scratchpad) - после него, за границей кэшируемого префикса.
+# Системное сообщение передаётся готовым объектом: шаблон не разбирает и не форматирует его на каждом вызове
+SYSTEM_MESSAGE = SystemMessage(content=SYSTEM_PROMPT)
 prompt = ChatPromptTemplate.from_messages([
-    ("system", generate_system_prompt()),
+    SYSTEM_MESSAGE,
     ("placeholder", "{chat_history}"),
     ("human", "{input}"),
     ("placeholder", "{agent_scratchpad}"),
@@ -203,47 +227,119 @@ agent_executor = AgentExecutor(
 )
 print("✅ Агент с create_tool_calling_agent настроен")
 
+# Системный промпт для ответа по найденному контексту, когда инструмент выбран по ключевым словам без агента
+DIRECT_ANSWER_MESSAGE = SystemMessage(content=(
+    "Ты - эксперт по управлению данными. Ответь на вопрос пользователя, опираясь на приведённый контекст из документов.\n"
+    "Дай подробный, структурированный ответ на русском языке."
+))
+
+# История диалога по thread_id: последние HISTORY_MAX_MESSAGES сообщений.
+# Ограничение держит префикс запроса коротким и стабильным между ходами диалога
+HISTORY_MAX_MESSAGES = 8
+HISTORY: Dict[str, Deque[BaseMessage]] = defaultdict(lambda: deque(maxlen=HISTORY_MAX_MESSAGES))
+_history_locks: Dict[str, threading.Lock] = defaultdict(threading.Lock)
+_history_locks_guard = threading.Lock()
+
+def get_history_lock(thread_id: str) -> threading.Lock:
+    """Возвращает блокировку истории для указанного потока."""
+    with _history_locks_guard:
+        return _history_locks[thread_id]
+
+def remember_turn(thread_id: str, user_query: str, response: str):
+    """Добавляет пару вопрос-ответ в историю потока."""
+    with get_history_lock(thread_id):
+        HISTORY[thread_id].extend([HumanMessage(content=user_query), AIMessage(content=response)])
+
+# Семантический кэш ответов (эмбеддинги те же, что и для поиска документов), отдельно для каждого потока
+response_cache = SemanticCache(embeddings)
+print("✅ Семантический кэш ответов инициализирован")
+
+# Постоянный цикл событий для вызовов агента. Клиент GigaChat создаётся один раз, и его httpx-пул
+# keep-alive соединений привязан к циклу событий: asyncio.run на каждый запрос закрывал бы цикл
+# вместе с соединениями, и каждый промах кэша снова платил бы за TLS-рукопожатие
+_agent_loop = asyncio.new_event_loop()
+threading.Thread(target=_agent_loop.run_forever, name="agent-loop", daemon=True).start()
+
+async def _ainvoke_agent(user_query: str, chat_history: list, session_id: str) -> Dict[str, Any]:
+    """Вызывает агента в постоянном цикле событий с заданным X-Session-ID."""
+    session_token = session_id_cvar.set(session_id)
+    try:
+        return await agent_executor.ainvoke({
+            "input": user_query,
+            "chat_history": chat_history
+        })
+    finally:
+        session_id_cvar.reset(session_token)
+
 def call_agent(user_query: str, thread_id: str = "default") -> str:
     try:
         print(f"\n🤖 ОБРАБОТКА ЗАПРОСА: {user_query}")
         
-        # Используем агента для обработки запроса
-        print("🎯 Используем create_tool_calling_agent...")
-        result = agent_executor.invoke({
-            "input": user_query,
-            "chat_history": []
-        })
+        with get_history_lock(thread_id):
+            chat_history = list(HISTORY[thread_id])
+        
+        # Проверяем семантический кэш до обращения к агенту. Кэшируется только первый вопрос диалога:
+        # ответ на уточнение ("а подробнее?") зависит от предыдущих реплик
+        query_embedding = None
+        if not chat_history:
+            query_embedding = response_cache.embed(user_query)
+            cached_response = response_cache.get(query_embedding, thread_id)
+            if cached_response is not None:
+                print("⚡ Ответ найден в семантическом кэше")
+                remember_turn(thread_id, user_query, cached_response)
+                return cached_response + "\n\n⚡ *(cached)*"
+        
+        routed_collection = route_by_keywords(user_query)
+        if routed_collection is not None:
+            # Ключевые слова однозначно указывают на коллекцию: ищем сразу, без шага планирования агента
+            config = COLLECTIONS_CONFIG[routed_collection]
+            print(f"🎯 Маршрут по ключевым словам: {config['function_name']}")
+            context_text = search_documents_tool(user_query, routed_collection, config["name"])
+            response = llm.invoke([
+                DIRECT_ANSWER_MESSAGE,
+                *chat_history,
+                HumanMessage(content=f"{user_query}\n\nКонтекст из {config['name']}:\n{context_text}")
+            ]).content
+            unique_tools = [config["function_name"]]
+        else:
+            # Используем агента для обработки запроса.
+            # Стабильный X-Session-ID (хэш системного промпта + поток) включает кэширование префикса в GigaChat.
+            # Асинхронный вызов агента выполняет несколько инструментов одного шага параллельно
+            print("🎯 Используем create_tool_calling_agent...")
+            result = asyncio.run_coroutine_threadsafe(
+                _ainvoke_agent(user_query, chat_history, f"{SYSTEM_PROMPT_HASH}-{thread_id}"),
+                _agent_loop
+            ).result()
+            response = result.get("output", "Не удалось получить ответ")
+            # Определяем какие инструменты были использованы (без повторов, в порядке первого вызова)
+            unique_tools = list(dict.fromkeys(action.tool for action, _ in result.get("intermediate_steps", [])))
         
-        response = result.get("output", "Не удалось получить ответ")
+        remember_turn(thread_id, user_query, response)
         print(f"💬 Ответ агента ({len(response)} символов):")
         print(f"---\n{response}\n---")
         
         # Проверяем, были ли вызваны инструменты
-        if "intermediate_steps" in result and result["intermediate_steps"]:
-            print("🔍 Инструменты были вызваны через агента")
-            # Определяем какие инструменты были использованы
-            used_tools = []
-            for step in result["intermediate_steps"]:
-                if len(step) >= 2:
-                    tool_name = step[0].tool
-                    used_tools.append(tool_name)
-            
-            if used_tools:
-                unique_tools = list(set(used_tools))
-                tools_info = f"\n\n🔍 **Источники информации:** {', '.join(unique_tools)}"
-                return response + tools_info
+        tools_info = None
+        if unique_tools:
+            print("🔍 Инструменты были вызваны")
+            tools_info = f"\n\n🔍 **Источники информации:** {', '.join(unique_tools)}"
         
-        # Если инструменты не были вызваны
-        print("💡 Инструменты не были вызваны, ответ основан на общих знаниях")
-        tools_info = "\n\n💡 **Ответ основан на общих знаниях** (без использования документов)"
-        return response + tools_info
+        if tools_info is None:
+            # Если инструменты не были вызваны
+            print("💡 Инструменты не были вызваны, ответ основан на общих знаниях")
+            tools_info = "\n\n💡 **Ответ основан на общих знаниях** (без использования документов)"
+        
+        final_response = response + tools_info
+        if query_embedding is not None:
+            response_cache.set(user_query, query_embedding, final_response, thread_id)
+        return final_response
         
     except Exception as e:
         print(f"❌ Ошибка обработки запроса: {e}")
         return f"Извините, произошла ошибка при обработке вашего запроса: {str(e)}"
 
-def get_functions_info() -> Dict[str, Any]:
-    """Получение информации о доступных функциях для бота."""
+def _build_functions_info() -> Dict[str, Any]:
+    """Собирает информацию о доступных функциях (схемы аргументов строятся один раз)."""
     return {
         "total_functions": len(functions),
         "function_names": [func.name for func in functions],
@@ -257,7 +353,25 @@ def get_functions_info() -> Dict[str, Any]:
         ]
     }
 
+# Набор функций не меняется после запуска, поэтому информация о них вычисляется при импорте
+_FUNCTIONS_INFO_CACHE = _build_functions_info()
+
+def get_functions_info() -> Dict[str, Any]:
+    """Получение информации о доступных функциях для бота."""
+    return _FUNCTIONS_INFO_CACHE
+
+def run_batch():
+    """Пакетный режим: запросы читаются построчно из перенаправленного stdin, в вывод идут только ответы."""
+    for line in sys.stdin:
+        user_input = line.strip()
+        if user_input:
+            print(call_agent(user_input, thread_id="batch"), flush=True)
+
 def main():
+    start_warmup()
+    if not sys.stdin.isatty():
+        run_batch()
+        return
     try:
         print("🚀 GigaChat Tool Calling Agent готов к работе!")
         print("Введите 'exit', 'quit' или 'выход' для завершения")
@@ -275,7 +389,7 @@ def main():
                 bot_answer = call_agent(user_input, thread_id="main_thread")
                 end_time = time.time()
                 print(f"\n💬 Bot (за {end_time - start_time:.2f}с):")
-                print(f"\033[93m{bot_answer}\033[0m")
+                print(f"\033[93m{bot_answer}\033[0m" if sys.stdout.isatty() else bot_answer)
             except KeyboardInterrupt:
                 print("\n\nПрограмма завершена пользователем (Ctrl+C)")
                 break
@@ -1,5 +1,8 @@
 import os
+import json
+import asyncio
 import logging
+import tempfile
 from telegram import Update, KeyboardButton, ReplyKeyboardMarkup
 from telegram.ext import (
     Application,
@@ -10,7 +13,11 @@ from telegram.ext import (
     filters
 )
 from dotenv import load_dotenv
-from document_processor import process_document, get_document_info, delete_document
+try:
+    import redis.asyncio as redis
+except ImportError:
+    redis = None
+from document_processor import process_document, get_document_info, delete_document, start_warmup
 from gigachat_tool_calling_agent import call_agent, get_functions_info
 # from manual_chain_agent import call_agent, get_functions_info
 import time
@@ -21,7 +28,7 @@ load_dotenv()
 # Настройка логирования
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
+    level=os.getenv('LOG_LEVEL', 'INFO').upper()
 )
 logger = logging.getLogger(__name__)
 
@@ -44,15 +51,88 @@ COLLECTIONS_CONFIG = {
     }
 }
 
-# Словарь для хранения состояний пользователей
-user_states = {}
+# Состояния пользователей хранятся в Redis (если задан REDIS_URL) с ограниченным временем жизни
+REDIS_URL = os.getenv('REDIS_URL')
+USER_STATE_TTL = 300  # Время жизни состояния пользователя (секунды)
+
+class UserStateStore:
+    """Хранилище состояний пользователей с TTL: Redis или память процесса, если Redis не настроен"""
+
+    def __init__(self, redis_url: str = None, ttl: int = USER_STATE_TTL):
+        self.ttl = ttl
+        self._redis = None
+        self._local = {}  # user_id -> (время истечения, состояние), если Redis не настроен
+        if redis_url:
+            if redis is None:
+                raise ValueError("Задан REDIS_URL, но пакет redis не установлен")
+            self._redis = redis.from_url(redis_url, decode_responses=True)
+            logger.info("Состояния пользователей хранятся в Redis")
+
+    @staticmethod
+    def _key(user_id: int) -> str:
+        return f"state:{user_id}"
+
+    def _get_local(self, user_id: int):
+        entry = self._local.get(user_id)
+        if entry is None:
+            return None
+        expires_at, state = entry
+        if expires_at < time.monotonic():
+            self._local.pop(user_id, None)
+            return None
+        return state
+
+    async def get(self, user_id: int):
+        """Возвращает состояние пользователя или None"""
+        if self._redis is not None:
+            raw = await self._redis.get(self._key(user_id))
+            return json.loads(raw) if raw else None
+        return self._get_local(user_id)
+
+    async def set(self, user_id: int, state: dict):
+        """Сохраняет состояние пользователя на время TTL"""
+        if self._redis is not None:
+            await self._redis.set(self._key(user_id), json.dumps(state, ensure_ascii=False), ex=self.ttl)
+            return
+        now = time.monotonic()
+        # Удаляем просроченные состояния брошенных сценариев
+        for expired_id in [uid for uid, (expires_at, _) in self._local.items() if expires_at < now]:
+            del self._local[expired_id]
+        self._local[user_id] = (now + self.ttl, state)
+
+    async def delete(self, user_id: int):
+        """Сбрасывает состояние пользователя"""
+        if self._redis is not None:
+            await self._redis.delete(self._key(user_id))
+            return
+        self._local.pop(user_id, None)
+
+user_states = UserStateStore(REDIS_URL)
+
+# Каталог для временных файлов загружаемых документов
+UPLOAD_DIR = os.path.join(tempfile.gettempdir(), "bot_uploads")
+
+# Ограничение числа одновременных запросов к агенту (GigaChat)
+AGENT_MAX_CONCURRENCY = 8
+agent_semaphore = asyncio.Semaphore(AGENT_MAX_CONCURRENCY)
+
+# Обратный индекс пользователь -> коллекция, строится один раз при запуске
+USER_TO_COLLECTION = {
+    user_id: collection_id
+    for collection_id, config in COLLECTIONS_CONFIG.items()
+    for user_id in config["users"]
+}
 
 def get_user_collection(user_id: int) -> str:
     """Определяет, к какой коллекции имеет доступ пользователь"""
-    for collection_id, config in COLLECTIONS_CONFIG.items():
-        if user_id in config["users"]:
-            return collection_id
-    return None
+    return USER_TO_COLLECTION.get(user_id)
+
+def remove_file(file_path: str):
+    """Удаляет файл, если он существует"""
+    try:
+        os.remove(file_path)
+    except FileNotFoundError:
+        pass
 
 def get_collection_display_name(collection: str) -> str:
     """Возвращает отображаемое имя коллекции"""
@@ -138,7 +218,7 @@ async def load_doc(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     collection_display_name = get_collection_display_name(collection)
     
-    user_states[user_id] = 'waiting_for_document'
+    await user_states.set(user_id, {'state': 'waiting_for_document'})
     message_text = (
         f"📤 Пожалуйста, отправьте документ для загрузки в коллекцию {collection_display_name}.\n"
         "Поддерживаемые форматы: PDF, DOC, DOCX, TXT"
@@ -157,15 +237,16 @@ async def docs_list(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
     
-    info = get_document_info(collection=collection)
+    info = await asyncio.to_thread(get_document_info, collection=collection)
     if info["total_documents"] == 0:
         message_text = f"📊 В коллекции {collection.upper()} пока нет документов."
     else:
-        response = f"📊 Документы в коллекции {collection.upper()}: {info['total_documents']}\n\n"
-        for doc in info["documents"]:
-            response += f"📄 {os.path.basename(doc['source'])}\n"
-            response += f"   Чанков: {doc['chunks']}\n"
-        message_text = response
+        lines = [f"📊 Документы в коллекции {collection.upper()}: {info['total_documents']}\n\n"]
+        lines.extend(
+            f"📄 {os.path.basename(doc['source'])}\n   Чанков: {doc['chunks']}\n"
+            for doc in info["documents"]
+        )
+        message_text = "".join(lines)
     await update.message.reply_text(message_text)
 
 async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -182,7 +263,8 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     # Проверяем, ожидаем ли мы документ от этого пользователя
-    if user_id not in user_states or user_states[user_id] != 'waiting_for_document':
+    user_data = await user_states.get(user_id)
+    if not user_data or user_data.get('state') != 'waiting_for_document':
         await update.message.reply_text(
             "❌ Пожалуйста, сначала нажмите кнопку '/load_doc' или используйте команду /load_doc"
         )
@@ -204,29 +286,34 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             return
         
-        # Скачиваем файл
-        file_path = f"temp_{file_name}"
-        await file.download_to_drive(file_path)
-        
-        # Обрабатываем документ
-        collection_display_name = get_collection_display_name(collection)
+        # Скачиваем файл в отдельный каталог пользователя, чтобы одинаковые имена файлов
+        # разных пользователей не конфликтовали (имя файла сохраняется для метаданных источника)
+        user_upload_dir = os.path.join(UPLOAD_DIR, str(user_id))
+        await asyncio.to_thread(os.makedirs, user_upload_dir, exist_ok=True)
+        file_path = os.path.join(user_upload_dir, os.path.basename(file_name))
         
-        if process_document(file_path, collection=collection):
-            await update.message.reply_text(f"✅ Документ успешно обработан и добавлен в коллекцию {collection_display_name}: {file_name}")
-        else:
-            await update.message.reply_text("❌ Ошибка при обработке документа")
-        
-        # Удаляем временный файл
-        os.remove(file_path)
+        try:
+            await file.download_to_drive(file_path)
+            
+            # Обрабатываем документ
+            collection_display_name = get_collection_display_name(collection)
+            
+            if await asyncio.to_thread(process_document, file_path, collection=collection):
+                await update.message.reply_text(f"✅ Документ успешно обработан и добавлен в коллекцию {collection_display_name}: {file_name}")
+            else:
+                await update.message.reply_text("❌ Ошибка при обработке документа")
+        finally:
+            # Удаляем временный файл (в том числе при ошибке)
+            await asyncio.to_thread(remove_file, file_path)
         
         # Сбрасываем состояние пользователя
-        user_states.pop(user_id, None)
+        await user_states.delete(user_id)
         
     except Exception as e:
         logger.error(f"Ошибка при обработке документа: {e}")
         await update.message.reply_text("❌ Произошла ошибка при обработке документа")
         # Сбрасываем состояние пользователя в случае ошибки
-        user_states.pop(user_id, None)
+        await user_states.delete(user_id)
 
 async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик текстовых сообщений"""
@@ -234,16 +321,13 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
         text = update.message.text
         
-        # Проверяем, не ожидаем ли мы выбор документа для удаления
-        if await handle_delete_choice(update, context):
-            return
-        
         # Отправляем сообщение о том, что запрос обрабатывается
         processing_message = await update.message.reply_text("🤔 Обрабатываю ваш запрос с помощью GigaChat...")
         
-        # Передаем запрос новому агенту
+        # Передаем запрос агенту в отдельном потоке, чтобы не блокировать цикл событий
         start_time = time.time()
-        response_text = call_agent(text, str(user_id))
+        async with agent_semaphore:
+            response_text = await asyncio.to_thread(call_agent, text, str(user_id))
         end_time = time.time()
         processing_time = end_time - start_time
         
@@ -311,74 +395,77 @@ async def delete_doc(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     # Получаем список документов
-    info = get_document_info(collection=collection)
+    info = await asyncio.to_thread(get_document_info, collection=collection)
     if info["total_documents"] == 0:
         await update.message.reply_text(f"📊 В коллекции {collection.upper()} нет документов для удаления.")
         return
     
     # Формируем список документов с номерами
-    response = f"🗑️ Выберите документ для удаления (напишите номер):\n\n"
+    lines = ["🗑️ Выберите документ для удаления (напишите номер):\n\n"]
     documents_list = []
     
     for i, doc in enumerate(info["documents"], 1):
         filename = os.path.basename(doc['source'])
-        response += f"{i}. 📄 {filename} ({doc['chunks']} чанков)\n"
+        lines.append(f"{i}. 📄 {filename} ({doc['chunks']} чанков)\n")
         documents_list.append(doc['source'])  # Сохраняем полный путь
+    response = "".join(lines)
     
     # Сохраняем список документов в контексте пользователя
-    user_states[user_id] = {
+    await user_states.set(user_id, {
         'state': 'waiting_for_delete_choice',
         'documents': documents_list,
         'collection': collection
-    }
+    })
     
     await update.message.reply_text(response)
 
-async def handle_delete_choice(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик выбора документа для удаления"""
+async def handle_delete_choice(update: Update, context: ContextTypes.DEFAULT_TYPE, user_data: dict):
+    """Обработчик выбора документа для удаления (user_data - состояние пользователя из хранилища)"""
     user_id = update.effective_user.id
     text = update.message.text
     
-    if user_id not in user_states or user_states[user_id].get('state') != 'waiting_for_delete_choice':
-        return False
-    
     try:
         choice = int(text)
-        user_data = user_states[user_id]
         documents = user_data['documents']
         collection = user_data['collection']
         
         if choice < 1 or choice > len(documents):
             await update.message.reply_text(f"❌ Неверный номер. Выберите от 1 до {len(documents)}")
-            return True
+            return
         
         # Получаем document_id (полный путь к файлу)
         document_id = documents[choice - 1]
         filename = os.path.basename(document_id)
         
         # Удаляем документ
-        if delete_document(document_id, collection):
+        if await asyncio.to_thread(delete_document, document_id, collection):
             await update.message.reply_text(f"✅ Документ '{filename}' успешно удалён из коллекции {collection.upper()}")
         else:
             await update.message.reply_text(f"❌ Ошибка при удалении документа '{filename}'")
         
         # Сбрасываем состояние пользователя
-        user_states.pop(user_id, None)
-        return True
+        await user_states.delete(user_id)
         
     except ValueError:
         await update.message.reply_text("❌ Пожалуйста, введите число")
-        return True
     except Exception as e:
         logger.error(f"Ошибка при удалении документа: {e}")
         await update.message.reply_text("❌ Произошла ошибка при удалении документа")
-        user_states.pop(user_id, None)
-        return True
+        await user_states.delete(user_id)
+
+async def route_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Направляет текстовое сообщение по состоянию пользователя из общего хранилища (работает и с несколькими процессами)"""
+    user_data = await user_states.get(update.effective_user.id)
+    if user_data and user_data.get('state') == 'waiting_for_delete_choice':
+        await handle_delete_choice(update, context, user_data)
+    else:
+        await handle_text(update, context)
 
 def main():
     """Основная функция запуска бота"""
     # Создаем приложение
-    application = Application.builder().token(TOKEN).build()
+    # concurrent_updates позволяет обрабатывать запросы разных пользователей параллельно
+    application = Application.builder().token(TOKEN).concurrent_updates(True).build()
     
     # Добавляем обработчики
     application.add_handler(CommandHandler("start", start))
@@ -387,10 +474,14 @@ def main():
     application.add_handler(CommandHandler("docs_list", docs_list))
     application.add_handler(CommandHandler("delete_doc", delete_doc))
     application.add_handler(MessageHandler(filters.Document.ALL, handle_document))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text))
+    # Выбор документа для удаления и обычный запрос различаются по состоянию пользователя
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, route_text))
     application.add_handler(CallbackQueryHandler(button_callback))  # Обработчик кнопок
     application.add_handler(MessageHandler(filters.ALL, handle_other_messages))  # Обработчик для всех остальных типов сообщений
     
+    # Модель эмбеддингов и коллекции прогреваются в фоне, пока бот подключается к Telegram
+    start_warmup()
+    
     # Запускаем бота
     logger.info("Запуск бота с GigaChat Functions Agent...")
     application.run_polling(allowed_updates=Update.ALL_TYPES)
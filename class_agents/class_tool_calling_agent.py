@@ -1,18 +1,19 @@
 #!/usr/bin/env python3
 """
-GigaChat Tool Calling Agent - современный агент с использованием create_tool_calling_agent
-Рекомендуемый подход для работы с function calling от LangChain
+GigaChat Tool Calling Agent - агент с прямым циклом вызова инструментов
+LLM с привязанными функциями (bind_tools) без накладных расходов AgentExecutor
 """
 
 import os
+import asyncio
 import logging
-from typing import List, Dict, Any, Optional
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple, Type
+import numpy as np
 from dotenv import load_dotenv
 from langchain_gigachat import GigaChat
-from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, FunctionMessage
-from langchain.agents import create_tool_calling_agent, AgentExecutor
-from langchain_core.prompts import ChatPromptTemplate
-from langgraph.checkpoint.memory import MemorySaver
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage, ToolMessage
 from pydantic import BaseModel, Field
 from langchain_gigachat.tools.giga_tool import giga_tool
 import time
@@ -27,11 +28,36 @@ load_dotenv()
 
 # Настройка логирования
 logging.basicConfig(
-    level=logging.INFO,
+    level=os.getenv('LOG_LEVEL', 'INFO').upper(),
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
 
+# Конфигурация семантического кэша результатов поиска
+SEARCH_CACHE_SIMILARITY_THRESHOLD = 0.95  # Порог косинусной близости запросов для попадания в кэш
+SEARCH_CACHE_TTL = 3600  # Время жизни результата в кэше (секунды)
+SEARCH_CACHE_MAX_SIZE = 512  # Максимальное число записей кэша одного инструмента (LRU-вытеснение)
+QUERY_VECTORS_MAX_SIZE = 256  # Сколько последних эмбеддингов запросов хранить для повторного использования
+SEARCH_K = 3  # Сколько фрагментов инструмент поиска передаёт в LLM
+SEARCH_FETCH_K = 15  # Сколько кандидатов отбирается для MMR-переранжирования
+SEARCH_MMR_LAMBDA = 0.5  # Баланс релевантности (1) и разнообразия (0) в MMR
+MAX_TOOL_ROUNDS = 3  # Максимальное число раундов вызова инструментов на один запрос
+# Ответ, если модель не сформировала текст даже после исчерпания раундов инструментов
+NO_ANSWER_MESSAGE = "Не удалось сформировать ответ по найденной информации. Попробуйте переформулировать вопрос."
+
+# Системное сообщение агента: собирается один раз при импорте и общее для всех экземпляров и потоков
+SYSTEM_MESSAGE = SystemMessage(content="""Ты - эксперт по управлению данными. У тебя есть доступ к двум источникам информации:
+
+1. **Стандарт DAMA DMBOK** (Data Management Body Of Knowledge) - используй функцию dama_search для поиска информации о методологии управления данными, стандартах DAMA, процессах управления данными, ролях и ответственности в области управления данными согласно стандарту DAMA DMBOK.
+
+2. **Регламенты и методологические материалы ЦТК** - используй функцию ctk_search для поиска информации о регламентах по процессам управления данными, политике данных для ДЗО (дочерних зависимых обществ), презентациях и других методологических документах по управлению данными от Центра технологического консалтинга (ЦТК).
+
+**ВАЖНО**: Если пользователь спрашивает о методологии ЦТК, регламентах ЦТК, политиках данных для ДЗО, информационной архитектуре по методологии ЦТК - ОБЯЗАТЕЛЬНО используй функцию ctk_search.
+
+Если пользователь спрашивает о стандарте DAMA DMBOK, методологии DAMA, областях управления данными по DAMA - ОБЯЗАТЕЛЬНО используй функцию dama_search.
+
+Всегда используй соответствующие функции для поиска актуальной информации из документов. Дай подробный, структурированный ответ на русском языке.""")
+
 # Модели для результатов функций
 class DamaSearchResult(BaseModel):
     """Результат поиска в документах DAMA DMBOK."""
@@ -51,6 +77,56 @@ class AgentResponse(BaseModel):
     processing_time: float = Field(description="Время обработки запроса в секундах")
     thread_id: str = Field(description="ID потока для памяти")
 
+class SearchResultCache:
+    """Семантический кэш результатов одного инструмента поиска: ключ - нормированный эмбеддинг запроса."""
+
+    def __init__(
+        self,
+        similarity_threshold: float = SEARCH_CACHE_SIMILARITY_THRESHOLD,
+        ttl_seconds: float = SEARCH_CACHE_TTL,
+        max_size: int = SEARCH_CACHE_MAX_SIZE
+    ):
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+
+        self._lock = threading.Lock()
+        # Матрица max_size x dim в float16 (вдвое меньше памяти), создаётся при первой записи
+        self._vectors: Optional[np.ndarray] = None
+        self._entries: List[Optional[list]] = [None] * max_size  # [результат, время записи, время последнего обращения]
+        self._size = 0
+
+    def get(self, query_vec: np.ndarray) -> Optional[BaseModel]:
+        """Возвращает результат для ближайшего сохранённого запроса, если близость выше порога и TTL не истёк."""
+        with self._lock:
+            if not self._size:
+                return None
+            # В NumPy нет BLAS для float16: скалярные произведения считаются в float32
+            scores = self._vectors[:self._size].astype(np.float32) @ query_vec
+            best = int(np.argmax(scores))
+            if scores[best] < self.similarity_threshold:
+                return None
+            entry = self._entries[best]
+            now = time.time()
+            if now - entry[1] > self.ttl_seconds:
+                return None
+            entry[2] = now
+            return entry[0]
+
+    def set(self, query_vec: np.ndarray, result: BaseModel):
+        """Сохраняет результат; при заполнении вытесняет запись, к которой дольше всего не обращались."""
+        with self._lock:
+            now = time.time()
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_size, query_vec.shape[0]), dtype=np.float16)
+            if self._size < self.max_size:
+                slot = self._size
+                self._size += 1
+            else:
+                slot = min(range(self.max_size), key=lambda i: self._entries[i][2])
+            self._vectors[slot] = query_vec
+            self._entries[slot] = [result, now, now]
+
 # Глобальная переменная для хранения экземпляра агента
 _agent_instance = None
 
@@ -61,6 +137,20 @@ def get_agent_instance() -> 'GigaChatToolCallingAgent':
         _agent_instance = GigaChatToolCallingAgent()
     return _agent_instance
 
+def warmup() -> 'GigaChatToolCallingAgent':
+    """
+    Предварительная инициализация агента при запуске процесса.
+    
+    Создаёт синглтон и выполняет пробный поиск в обоих хранилищах, чтобы загрузка
+    модели эмбеддингов и индексов не попадала во время ответа первому пользователю.
+    """
+    agent = get_agent_instance()
+    query_vec = agent.embed_query("прогрев").tolist()
+    agent.dama_store.similarity_search_by_vector(query_vec, k=1)
+    agent.ctk_store.similarity_search_by_vector(query_vec, k=1)
+    logger.info("Агент прогрет")
+    return agent
+
 def call_agent(query: str, user_id: str = "default") -> AgentResponse:
     """
     Удобная функция для вызова агента из бота.
@@ -145,11 +235,11 @@ def reset_agent() -> bool:
         logger.info("Агент сброшен")
         return True
     except Exception as e:
-        logger.error(f"Ошибка при сбросе агента: {e}")
+        logger.error("Ошибка при сбросе агента: %s", e)
         return False
 
 class GigaChatToolCallingAgent:
-    """Агент с использованием GigaChat и create_tool_calling_agent."""
+    """Агент с использованием GigaChat и прямого цикла вызова инструментов."""
     
     def __init__(self):
         """Инициализация агента."""
@@ -179,12 +269,75 @@ class GigaChatToolCallingAgent:
             self.dama_store = get_vectorstore("dama_dmbok")
             self.ctk_store = get_vectorstore("ctk_methodology")
             
+            # Запрос эмбеддится один раз: вектор служит и ключом кэша, и входом поиска
+            self.embeddings = self.dama_store.embeddings
+            self.dama_cache = SearchResultCache()
+            self.ctk_cache = SearchResultCache()
+            # Последние эмбеддинги запросов: одинаковый запрос к обоим инструментам эмбеддится один раз
+            self.query_vectors: "OrderedDict[str, np.ndarray]" = OrderedDict()
+            self.query_vectors_lock = threading.Lock()
+            
             logger.info("Векторные хранилища инициализированы из document_processor_langchain")
             
         except Exception as e:
-            logger.error(f"Ошибка инициализации векторных хранилищ: {e}")
+            logger.error("Ошибка инициализации векторных хранилищ: %s", e)
             raise
     
+    def embed_queries(self, queries: List[str]) -> List[np.ndarray]:
+        """
+        Возвращает эмбеддинги запросов (локальная модель уже отдаёт L2-нормированные векторы).
+        Ещё не встречавшиеся запросы эмбеддятся одним батчем, результаты запоминаются.
+        """
+        vectors = {}
+        with self.query_vectors_lock:
+            for query in dict.fromkeys(queries):
+                if query in self.query_vectors:
+                    self.query_vectors.move_to_end(query)
+                    vectors[query] = self.query_vectors[query]
+        missing = [query for query in dict.fromkeys(queries) if query not in vectors]
+        if missing:
+            computed = self.embeddings.embed_documents(missing)
+            with self.query_vectors_lock:
+                for query, vector in zip(missing, computed):
+                    vectors[query] = self.query_vectors[query] = np.asarray(vector, dtype=np.float32)
+                while len(self.query_vectors) > QUERY_VECTORS_MAX_SIZE:
+                    self.query_vectors.popitem(last=False)
+        return [vectors[query] for query in queries]
+    
+    def embed_query(self, query: str) -> np.ndarray:
+        """Возвращает эмбеддинг одного запроса."""
+        return self.embed_queries([query])[0]
+    
+    def search_store(self, store, cache: SearchResultCache, query: str, result_cls: Type[BaseModel], collection_name: str) -> BaseModel:
+        """Поиск в векторном хранилище через семантический кэш инструмента."""
+        query_vec = self.embed_query(query)
+        cached = cache.get(query_vec)
+        if cached is not None:
+            logger.info("Результат поиска в %s взят из кэша", collection_name)
+            return cached
+        
+        # MMR отбирает релевантные, но не повторяющие друг друга фрагменты: меньше токенов контекста для LLM
+        docs = store.max_marginal_relevance_search_by_vector(
+            query_vec.tolist(), k=SEARCH_K, fetch_k=SEARCH_FETCH_K, lambda_mult=SEARCH_MMR_LAMBDA
+        )
+        
+        if not docs:
+            return result_cls(
+                content=f"Информация по данному запросу не найдена в {collection_name}.",
+                sources=[]
+            )
+        
+        sources = [doc.metadata.get('source', 'Неизвестный источник') for doc in docs]
+        # join сам вычисляет итоговую длину и копирует фрагменты один раз
+        content = "\n\n---\n\n".join(
+            f"Источник {i}: {source}\n{doc.page_content}"
+            for i, (source, doc) in enumerate(zip(sources, docs), 1)
+        )
+        
+        result = result_cls(content=content, sources=sources)
+        cache.set(query_vec, result)
+        return result
+    
     def setup_functions(self):
         """Настройка функций с использованием giga_tool декоратора."""
         
@@ -225,30 +378,11 @@ class GigaChatToolCallingAgent:
         def dama_search(query: str = Field(description="Поисковый запрос на русском языке для поиска в стандарте DAMA DMBOK")) -> DamaSearchResult:
             """Поиск информации в стандарте DAMA DMBOK (Data Management Body Of Knowledge). ОБЯЗАТЕЛЬНО используй эту функцию для любых запросов о стандарте DAMA DMBOK, методологии DAMA, областях управления данными по DAMA, ролях и ответственности в управлении данными согласно стандарту DAMA DMBOK."""
             try:
-                logger.info(f"Поиск в стандарте DAMA DMBOK: {query}")
-                docs = self.dama_store.similarity_search(query, k=5)
-                
-                if not docs:
-                    return DamaSearchResult(
-                        content="Информация по данному запросу не найдена в стандарте DAMA DMBOK.",
-                        sources=[]
-                    )
-                
-                content_parts = []
-                sources = []
-                
-                for i, doc in enumerate(docs, 1):
-                    source = doc.metadata.get('source', 'Неизвестный источник')
-                    sources.append(source)
-                    content_parts.append(f"Источник {i}: {source}\n{doc.page_content}")
-                
-                return DamaSearchResult(
-                    content="\n\n---\n\n".join(content_parts),
-                    sources=sources
-                )
+                logger.info("Поиск в стандарте DAMA DMBOK: %s", query)
+                return self.search_store(self.dama_store, self.dama_cache, query, DamaSearchResult, "стандарте DAMA DMBOK")
                 
             except Exception as e:
-                logger.error(f"Ошибка поиска в DAMA: {e}")
+                logger.error("Ошибка поиска в DAMA: %s", e)
                 return DamaSearchResult(
                     content=f"Ошибка при поиске в стандарте DAMA DMBOK: {str(e)}",
                     sources=[]
@@ -258,111 +392,139 @@ class GigaChatToolCallingAgent:
         def ctk_search(query: str = Field(description="Поисковый запрос на русском языке для поиска в регламентах и методологических материалах ЦТК")) -> CtkSearchResult:
             """Поиск информации в регламентах и методологических материалах ЦТК. ОБЯЗАТЕЛЬНО используй эту функцию для любых запросов о методологии ЦТК, регламентах ЦТК, политике данных для ДЗО (дочерних зависимых обществ), информационной архитектуре по методологии ЦТК, презентациях и других методологических документах по управлению данными от Центра технологического консалтинга (ЦТК)."""
             try:
-                logger.info(f"Поиск в ЦТК: {query}")
-                docs = self.ctk_store.similarity_search(query, k=5)
-                
-                if not docs:
-                    return CtkSearchResult(
-                        content="Информация по данному запросу не найдена в регламентах и методологических материалах ЦТК.",
-                        sources=[]
-                    )
-                
-                content_parts = []
-                sources = []
-                
-                for i, doc in enumerate(docs, 1):
-                    source = doc.metadata.get('source', 'Неизвестный источник')
-                    sources.append(source)
-                    content_parts.append(f"Источник {i}: {source}\n{doc.page_content}")
-                
-                return CtkSearchResult(
-                    content="\n\n---\n\n".join(content_parts),
-                    sources=sources
-                )
+                logger.info("Поиск в ЦТК: %s", query)
+                return self.search_store(self.ctk_store, self.ctk_cache, query, CtkSearchResult, "регламентах и методологических материалах ЦТК")
                 
             except Exception as e:
-                logger.error(f"Ошибка поиска в ЦТК: {e}")
+                logger.error("Ошибка поиска в ЦТК: %s", e)
                 return CtkSearchResult(
                     content=f"Ошибка при поиске в материалах ЦТК: {str(e)}",
                     sources=[]
                 )
         
+        # Асинхронные варианты: цикл агента выполняет вызовы инструментов одного шага параллельно,
+        # поэтому поиск в DAMA и ЦТК идёт одновременно в отдельных потоках
+        async def adama_search(query: str) -> DamaSearchResult:
+            return await asyncio.to_thread(dama_search.func, query)
+        
+        async def actk_search(query: str) -> CtkSearchResult:
+            return await asyncio.to_thread(ctk_search.func, query)
+        
+        dama_search.coroutine = adama_search
+        ctk_search.coroutine = actk_search
+        
         # Сохраняем функции
         self.dama_search_func = dama_search
         self.ctk_search_func = ctk_search
         self.functions = [dama_search, ctk_search]
         
+        # Набор функций не меняется после настройки: информация о них (со схемами аргументов) строится один раз
+        self._functions_info = {
+            "total_functions": len(self.functions),
+            "function_names": [func.name for func in self.functions],
+            "functions": [
+                {
+                    "name": func.name,
+                    "description": func.description,
+                    "args_schema": func.args_schema.schema() if hasattr(func, 'args_schema') else None
+                }
+                for func in self.functions
+            ]
+        }
+        
         logger.info("Функции для GigaChat настроены")
     
     def setup_agent(self):
-        """Настройка агента с использованием create_tool_calling_agent."""
+        """Настройка агента: LLM с привязанными инструментами и прямой цикл вызова инструментов."""
         try:
-            # Создаем промпт для агента
-            prompt = ChatPromptTemplate.from_messages([
-                ("system", """Ты - эксперт по управлению данными. У тебя есть доступ к двум источникам информации:
-
-1. **Стандарт DAMA DMBOK** (Data Management Body Of Knowledge) - используй функцию dama_search для поиска информации о методологии управления данными, стандартах DAMA, процессах управления данными, ролях и ответственности в области управления данными согласно стандарту DAMA DMBOK.
-
-2. **Регламенты и методологические материалы ЦТК** - используй функцию ctk_search для поиска информации о регламентах по процессам управления данными, политике данных для ДЗО (дочерних зависимых обществ), презентациях и других методологических документах по управлению данными от Центра технологического консалтинга (ЦТК).
-
-**ВАЖНО**: Если пользователь спрашивает о методологии ЦТК, регламентах ЦТК, политиках данных для ДЗО, информационной архитектуре по методологии ЦТК - ОБЯЗАТЕЛЬНО используй функцию ctk_search.
-
-Если пользователь спрашивает о стандарте DAMA DMBOK, методологии DAMA, областях управления данными по DAMA - ОБЯЗАТЕЛЬНО используй функцию dama_search.
-
-Всегда используй соответствующие функции для поиска актуальной информации из документов. Дай подробный, структурированный ответ на русском языке."""),
-                ("placeholder", "{chat_history}"),
-                ("human", "{input}"),
-                ("placeholder", "{agent_scratchpad}"),
-            ])
+            # LLM с инструментами вызывается напрямую, без AgentExecutor и шаблона промпта.
+            # Схемы инструментов сериализуются здесь один раз и переиспользуются всеми вызовами
+            self.llm_with_tools = self.llm.bind_tools(self.functions)
+            self.tools_by_name = {func.name: func for func in self.functions}
             
-            # Создаем агент с create_tool_calling_agent
-            self.agent = create_tool_calling_agent(self.llm, self.functions, prompt)
-            self.agent_executor = AgentExecutor(agent=self.agent, tools=self.functions)
-            self.memory = MemorySaver()
+            # Постоянный цикл событий, в котором выполняются асинхронные вызовы агента
+            self.loop = asyncio.new_event_loop()
+            threading.Thread(target=self.loop.run_forever, name="agent-loop", daemon=True).start()
             
-            logger.info("Агент с create_tool_calling_agent настроен")
+            logger.info("Агент с прямым циклом вызова инструментов настроен")
         except Exception as e:
-            logger.error(f"Ошибка настройки агента: {e}")
+            logger.error("Ошибка настройки агента: %s", e)
             raise
     
+    async def arun_tools_loop(self, user_query: str) -> Tuple[str, List[str]]:
+        """
+        Прямой цикл вызова инструментов: LLM выбирает инструменты, они выполняются параллельно,
+        результаты возвращаются в LLM. Возвращает ответ и имена вызванных инструментов.
+        """
+        messages: List[BaseMessage] = [SYSTEM_MESSAGE, HumanMessage(content=user_query)]
+        called_tools = []
+        
+        response = await self.llm_with_tools.ainvoke(messages)
+        for tool_round in range(MAX_TOOL_ROUNDS):
+            if not response.tool_calls:
+                break
+            # Запросы всех инструментов шага эмбеддятся одним батчем до их параллельного запуска,
+            # инструменты берут готовые векторы вместо повторного эмбеддинга одной и той же строки
+            await asyncio.to_thread(
+                self.embed_queries,
+                [tool_call["args"]["query"] for tool_call in response.tool_calls if "query" in tool_call["args"]]
+            )
+            # Вызов инструмента с ToolCall возвращает готовое ToolMessage
+            tool_messages = await asyncio.gather(*(self.arun_tool_call(tool_call) for tool_call in response.tool_calls))
+            called_tools.extend(tool_call["name"] for tool_call in response.tool_calls)
+            messages.extend([response, *tool_messages])
+            # После последнего раунда модель вызывается без инструментов и отвечает по уже найденной информации
+            llm = self.llm_with_tools if tool_round < MAX_TOOL_ROUNDS - 1 else self.llm
+            response = await llm.ainvoke(messages)
+        
+        if not response.content:
+            logger.warning("Модель не сформировала ответ за %d раундов инструментов", MAX_TOOL_ROUNDS)
+            return NO_ANSWER_MESSAGE, called_tools
+        return response.content, called_tools
+    
+    async def arun_tool_call(self, tool_call: Dict[str, Any]) -> ToolMessage:
+        """Выполняет один вызов инструмента; о неизвестном инструменте модель узнаёт из сообщения об ошибке."""
+        tool = self.tools_by_name.get(tool_call["name"])
+        if tool is None:
+            logger.warning("Модель вызвала неизвестный инструмент: %s", tool_call["name"])
+            return ToolMessage(
+                content=f"Ошибка: инструмент {tool_call['name']} не существует. Доступные инструменты: {', '.join(self.tools_by_name)}",
+                tool_call_id=tool_call["id"],
+                name=tool_call["name"],
+                status="error"
+            )
+        return await tool.ainvoke(tool_call)
+    
     def process_query(self, user_query: str, thread_id: str = "default") -> str:
         """
         Обработка запроса пользователя с использованием агента.
         """
         try:
-            logger.info(f"Обработка запроса: {user_query}")
+            logger.info("Обработка запроса: %s", user_query)
             
             # Отслеживаем использованные инструменты
             used_tools = []
             tools_were_called = False
             
-            # Выполняем запрос через AgentExecutor
-            result = self.agent_executor.invoke({
-                "input": user_query,
-                "chat_history": []
-            }, config={"configurable": {"thread_id": thread_id}})
-            
-            # Получаем ответ
-            response_text = result.get("output", "Не удалось получить ответ")
+            # Выполняем запрос через прямой цикл вызова инструментов
+            response_text, called_tools = asyncio.run_coroutine_threadsafe(
+                self.arun_tools_loop(user_query),
+                self.loop
+            ).result()
             
             # Проверяем, были ли вызваны инструменты
-            # В create_tool_calling_agent это можно отследить через intermediate_steps
-            if "intermediate_steps" in result:
-                for step in result["intermediate_steps"]:
-                    if len(step) >= 2:
-                        action = step[0]
-                        if hasattr(action, 'tool') and action.tool:
-                            tools_were_called = True
-                            if action.tool == "dama_search":
-                                used_tools.append("Стандарт DAMA DMBOK")
-                            elif action.tool == "ctk_search":
-                                used_tools.append("Регламенты и материалы ЦТК")
+            for tool_name in called_tools:
+                tools_were_called = True
+                if tool_name == "dama_search":
+                    used_tools.append("Стандарт DAMA DMBOK")
+                elif tool_name == "ctk_search":
+                    used_tools.append("Регламенты и материалы ЦТК")
             
             logger.info("Запрос обработан успешно")
             
             # Добавляем информацию об использованных инструментах
             if tools_were_called and used_tools:
-                unique_tools = list(set(used_tools))  # Убираем дубликаты
+                unique_tools = list(dict.fromkeys(used_tools))  # Убираем дубликаты, сохраняя порядок вызова
                 tools_info = f"\n\n🔍 **Источники информации:** {', '.join(unique_tools)}"
                 return response_text + tools_info
             else:
@@ -370,20 +532,19 @@ class GigaChatToolCallingAgent:
                 return response_text + tools_info
             
         except Exception as e:
-            logger.error(f"Ошибка обработки запроса: {e}")
+            logger.error("Ошибка обработки запроса: %s", e)
             
             # Fallback к простому запросу с функциями
             try:
                 logger.info("Используем fallback - запрос к LLM с функциями")
-                llm_with_functions = self.llm.bind_tools(self.functions)
                 messages = [
                     SystemMessage(content="Ты эксперт по управлению данными. Используй доступные функции для поиска информации."),
                     HumanMessage(content=user_query)
                 ]
-                response = llm_with_functions.invoke(messages)
+                response = self.llm_with_tools.invoke(messages)
                 return response.content + "\n\n⚠️ **Использован fallback режим** (возможны ошибки в работе инструментов)"
             except Exception as fallback_error:
-                logger.error(f"Ошибка fallback: {fallback_error}")
+                logger.error("Ошибка fallback: %s", fallback_error)
                 # Последний fallback - простой LLM без функций
                 try:
                     messages = [
@@ -393,7 +554,7 @@ class GigaChatToolCallingAgent:
                     response = self.llm.invoke(messages)
                     return response.content + "\n\n⚠️ **Использован аварийный режим** (инструменты недоступны)"
                 except Exception as final_error:
-                    logger.error(f"Финальная ошибка fallback: {final_error}")
+                    logger.error("Финальная ошибка fallback: %s", final_error)
                     return f"Извините, произошла ошибка при обработке вашего запроса: {str(e)}"
     
     def get_store_info(self) -> Dict[str, Any]:
@@ -416,29 +577,18 @@ class GigaChatToolCallingAgent:
                 }
             }
         except Exception as e:
-            logger.error(f"Ошибка получения информации о хранилищах: {e}")
+            logger.error("Ошибка получения информации о хранилищах: %s", e)
             return {"error": str(e)}
     
     def get_functions_info(self) -> Dict[str, Any]:
         """Получение информации о доступных функциях."""
-        return {
-            "total_functions": len(self.functions),
-            "function_names": [func.name for func in self.functions],
-            "functions": [
-                {
-                    "name": func.name,
-                    "description": func.description,
-                    "args_schema": func.args_schema.schema() if hasattr(func, 'args_schema') else None
-                }
-                for func in self.functions
-            ]
-        }
+        return self._functions_info
 
 def main():
     """Главная функция для запуска GigaChat Tool Calling Agent."""
     try:
         print("🚀 Инициализация GigaChat Tool Calling Agent...")
-        agent = GigaChatToolCallingAgent()
+        agent = warmup()
         
         print("\n✅ GigaChat Tool Calling Agent готов к работе!")
         print("Введите 'exit', 'quit' или 'выход' для завершения")
@@ -1,6 +1,12 @@
 import os
+import time
 import logging
-from typing import List, Dict
+import threading
+from dataclasses import dataclass
+from types import MappingProxyType
+from cachetools import LRUCache
+from typing import List, Dict, Optional, Tuple
+import numpy as np
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_chroma import Chroma
 from langchain_community.document_loaders import (
@@ -10,17 +16,29 @@ from langchain_community.document_loaders import (
 )
 from langchain.schema import Document
 import hashlib
-from embeddings_manager import get_local_huggingface_embeddings
+from embeddings_manager import get_local_huggingface_embeddings, EmbeddingCache, EMBEDDING_MODEL_ID
+from semantic_cache import clear_all_caches
 import chardet
 
 # Конфигурация
 PERSIST_DIR = "chroma_db_huggingface"  # Директория для хранения базы данных Chroma
 CHUNK_SIZE = 1000  # Размер чанка при разбиении текста
 CHUNK_OVERLAP = 200  # Перекрытие между чанками
+INGEST_BATCH_SIZE = 256  # Сколько чанков (из одного или нескольких файлов) записывается за раз при загрузке папки
+SEARCH_CACHE_SIZE = 1024  # Число результатов поиска (коллекция, запрос, n_results), хранимых в LRU-кэше
+MIN_RELEVANCE_SCORE = 0.2  # Фрагменты с меньшей релевантностью (косинусной близостью) не попадают в контекст агентов
+WARMUP_COLLECTIONS = ("dama_dmbok", "ctk_methodology", "sbf_meta")  # Коллекции, открываемые при прогреве
+# Параметры HNSW-индекса для новых коллекций Chroma: больше связей в графе и шире поиск -
+# выше полнота приближённого поиска при росте корпуса
+HNSW_METADATA = {
+    "hnsw:M": 32,
+    "hnsw:construction_ef": 200,
+    "hnsw:search_ef": 64
+}
 
 # Настройка логирования
 logging.basicConfig(
-    level=logging.INFO,
+    level=os.getenv('LOG_LEVEL', 'INFO').upper(),
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
@@ -28,18 +46,95 @@ logger = logging.getLogger(__name__)
 # Получение embeddings из общего менеджера
 embeddings = get_local_huggingface_embeddings()
 
+# Кэш эмбеддингов запросов: повторный поиск по той же строке не пересчитывает эмбеддинг
+embedding_cache = EmbeddingCache()
+
+@dataclass(frozen=True)
+class SearchResults:
+    """
+    Результаты поиска в виде параллельных массивов: i-й фрагмент - texts[i], sources[i], scores[i].
+    scores - косинусная близость к запросу (больше - ближе), фрагменты упорядочены по её убыванию.
+    """
+    texts: Tuple[str, ...]
+    sources: Tuple[str, ...]
+    scores: np.ndarray
+    metadatas: Tuple[MappingProxyType, ...]
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    def above(self, min_score: float = MIN_RELEVANCE_SCORE) -> "SearchResults":
+        """Оставляет фрагменты с релевантностью не ниже порога (одной булевой маской)."""
+        mask = self.scores >= min_score
+        if mask.all():
+            return self
+        indices = np.flatnonzero(mask)
+        return SearchResults(
+            texts=tuple(self.texts[i] for i in indices),
+            sources=tuple(self.sources[i] for i in indices),
+            scores=self.scores[mask],
+            metadatas=tuple(self.metadatas[i] for i in indices)
+        )
+
+EMPTY_RESULTS = SearchResults(texts=(), sources=(), scores=np.empty(0, dtype=np.float32), metadatas=())
+
+# Точный кэш результатов поиска: повторный запрос к той же коллекции не эмбеддится и не идёт в Chroma.
+# Результаты хранятся неизменяемыми, кэш коллекции сбрасывается при добавлении и удалении документов
+search_cache = LRUCache(maxsize=SEARCH_CACHE_SIZE)
+search_cache_lock = threading.Lock()
+
+def clear_search_cache(collection: str = None):
+    """Сбрасывает кэш результатов поиска для коллекции (или целиком)."""
+    with search_cache_lock:
+        if collection is None:
+            search_cache.clear()
+            return
+        for key in [key for key in search_cache if key[0] == collection]:
+            del search_cache[key]
+
 # Создаем словарь для хранения векторных хранилищ для разных коллекций
 vectorstores = {}
+vectorstores_lock = threading.Lock()  # Прогрев в фоне и первый запрос не должны открыть коллекцию дважды
 
 def get_vectorstore(collection: str) -> Chroma:
     """Получает или создает векторное хранилище для указанной коллекции"""
-    if collection not in vectorstores:
-        vectorstores[collection] = Chroma(
-            collection_name=collection,
-            persist_directory=PERSIST_DIR,
-            embedding_function=embeddings
-        )
-    return vectorstores[collection]
+    with vectorstores_lock:
+        if collection not in vectorstores:
+            vectorstores[collection] = Chroma(
+                collection_name=collection,
+                persist_directory=PERSIST_DIR,
+                embedding_function=embeddings,
+                collection_metadata=HNSW_METADATA
+            )
+        return vectorstores[collection]
+
+def distances_to_similarity(distances: np.ndarray, space: str = "l2") -> np.ndarray:
+    """
+    Переводит расстояния Chroma в косинусную близость (эмбеддинги нормированы).
+    Для l2 Chroma возвращает квадрат евклидова расстояния: d = 2 - 2cos, cos = 1 - d/2;
+    для cosine и ip расстояние равно 1 - cos.
+    """
+    if space == "l2":
+        return 1.0 - distances / 2.0
+    return 1.0 - distances
+
+def warmup(collections=WARMUP_COLLECTIONS):
+    """Прогрев: один эмбеддинг и один поиск k=1 по каждой коллекции, чтобы первый запрос не платил за инициализацию."""
+    start_time = time.time()
+    try:
+        vector = embeddings.embed_query("прогрев")
+        for collection in collections:
+            get_vectorstore(collection).similarity_search_by_vector(vector, k=1)
+    except Exception as e:
+        logger.warning(f"Прогрев не завершён: {e}")
+        return
+    logger.info(f"Прогрев завершён за {time.time() - start_time:.2f}с")
+
+def start_warmup() -> threading.Thread:
+    """Запускает прогрев в фоновом потоке, не задерживая старт процесса."""
+    thread = threading.Thread(target=warmup, name="warmup", daemon=True)
+    thread.start()
+    return thread
 
 text_splitter = RecursiveCharacterTextSplitter(
     chunk_size=CHUNK_SIZE,
@@ -48,24 +143,51 @@ text_splitter = RecursiveCharacterTextSplitter(
     separators=["\n\n", "\n", " ", ""]
 )
 
-def filter_duplicates(docs: List[Document], collection: str) -> List[Document]:
-    """Фильтрует документы, уже существующие в базе"""
-    existing_hashes = set()
-    vectorstore = get_vectorstore(collection)
+def content_hash(text: str) -> str:
+    """Хэш текста чанка для поиска дубликатов (BLAKE2b, 128 бит)."""
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+
+# Хэши чанков каждой коллекции: читаются из Chroma один раз и дополняются при добавлении документов,
+# а не загружаются целиком при обработке каждого файла
+collection_hashes: Dict[str, set] = {}
+collection_hashes_lock = threading.Lock()
+
+def get_collection_hashes(collection: str) -> set:
+    """Множество хэшей чанков коллекции (загружается из базы при первом обращении)."""
+    with collection_hashes_lock:
+        hashes = collection_hashes.get(collection)
+        if hashes is None:
+            hashes = set()
+            existing_data = get_vectorstore(collection).get(include=["metadatas", "documents"])
+            for metadata, text in zip(existing_data["metadatas"], existing_data["documents"]):
+                # Чанки, добавленные до перехода на BLAKE2b, хранят только MD5 (doc_hash): хэшируем их текст
+                hashes.add(metadata.get("content_hash") or content_hash(text))
+            collection_hashes[collection] = hashes
+        return hashes
 
-    # Получаем хеши существующих документов
-    if os.path.exists(PERSIST_DIR):
-        existing_data = vectorstore.get()  # Получаем все данные из базы
-        for metadata in existing_data["metadatas"]:
-            if "doc_hash" in metadata:
-                existing_hashes.add(metadata["doc_hash"])
+def remember_hashes(docs: List[Document], collection: str):
+    """Добавляет хэши записанных в коллекцию чанков в кэш."""
+    hashes = get_collection_hashes(collection)
+    with collection_hashes_lock:
+        hashes.update(doc.metadata["content_hash"] for doc in docs)
+
+def forget_collection_hashes(collection: str):
+    """Сбрасывает кэш хэшей коллекции (после удаления документов он перечитывается из базы)."""
+    with collection_hashes_lock:
+        collection_hashes.pop(collection, None)
+
+def filter_duplicates(docs: List[Document], collection: str) -> List[Document]:
+    """Фильтрует документы, уже существующие в базе (и повторы внутри docs)"""
+    existing_hashes = get_collection_hashes(collection)
+    seen_hashes = set()
 
     # Фильтрация новых документов
     unique_docs = []
     for doc in docs:
-        content_hash = hashlib.md5(doc.page_content.encode()).hexdigest()
-        if content_hash not in existing_hashes:
-            doc.metadata["doc_hash"] = content_hash  # Добавляем хеш в метаданные
+        doc_hash = content_hash(doc.page_content)
+        if doc_hash not in existing_hashes and doc_hash not in seen_hashes:
+            seen_hashes.add(doc_hash)
+            doc.metadata["content_hash"] = doc_hash  # Добавляем хеш в метаданные
             unique_docs.append(doc)
 
     return unique_docs
@@ -136,6 +258,13 @@ def load_document(file_path: str) -> List[Dict]:
         logger.error(f"Ошибка при загрузке документа {file_path}: {str(e)}")
         return []
 
+def add_splits(splits: List[Document], collection: str):
+    """Запись чанков в коллекцию (эмбеддинги считаются одним вызовом на все чанки) и обновление кэшей."""
+    get_vectorstore(collection).add_documents(splits)
+    remember_hashes(splits, collection)
+    clear_search_cache(collection)
+    clear_all_caches()
+
 def process_document(file_path: str, collection: str) -> bool:
     """Обработка документа и сохранение в ChromaDB."""
     try:        
@@ -152,8 +281,7 @@ def process_document(file_path: str, collection: str) -> bool:
             return True
         
         # Добавление уникальных документов в векторное хранилище
-        vectorstore = get_vectorstore(collection)
-        vectorstore.add_documents(unique_splits)
+        add_splits(unique_splits, collection)
         
         logger.info(f"✅ Документ успешно обработан и добавлен в коллекцию {collection}: {os.path.basename(file_path)}")
         logger.info(f"   Добавлено {len(unique_splits)} новых чанков")
@@ -163,32 +291,60 @@ def process_document(file_path: str, collection: str) -> bool:
         logger.error(f"Ошибка при обработке документа: {str(e)}")
         return False
 
-def search_documents(query: str, collection: str, n_results: int = 5) -> List[Dict]:
-    """Поиск по документам."""
+def embed_query(query: str) -> List[float]:
+    """Эмбеддинг запроса из кэша (или вычисленный и закэшированный)."""
+    return embedding_cache.get_or_compute(query, EMBEDDING_MODEL_ID, embeddings.embed_query)
+
+def search_results(query: str, collection: str, n_results: int = 5, query_embedding: Optional[List[float]] = None) -> SearchResults:
+    """Поиск по документам. Готовый эмбеддинг запроса можно передать, чтобы не вычислять его повторно."""
+    cache_key = (collection, query, n_results)
+    with search_cache_lock:
+        cached_results = search_cache.get(cache_key)
+    if cached_results is not None:
+        return cached_results
+    
     try:
         # Получаем векторное хранилище для указанной коллекции
         vectorstore = get_vectorstore(collection)
         
-        # Поиск в векторном хранилище
-        results = vectorstore.similarity_search_with_score(
-            query,
+        if query_embedding is None:
+            query_embedding = embed_query(query)
+        
+        # Поиск в векторном хранилище (возвращает расстояния: меньше - ближе)
+        results = vectorstore.similarity_search_by_vector_with_relevance_scores(
+            query_embedding,
             k=n_results
         )
         
-        # Форматирование результатов
-        formatted_results = []
-        for doc, score in results:
-            formatted_results.append({
-                'text': doc.page_content,
-                'metadata': doc.metadata,
-                'score': score
-            })
+        # Раскладка по параллельным массивам (только для чтения: они же сохраняются в кэше).
+        # Расстояния переводятся в косинусную близость, чтобы порог и сортировка работали как "больше - лучше"
+        distances = np.fromiter((distance for _, distance in results), dtype=np.float32, count=len(results))
+        space = (vectorstore._collection.metadata or {}).get("hnsw:space", "l2")
+        scores = distances_to_similarity(distances, space)
+        scores.flags.writeable = False
+        metadatas = tuple(MappingProxyType(doc.metadata) for doc, _ in results)
+        formatted_results = SearchResults(
+            texts=tuple(doc.page_content for doc, _ in results),
+            sources=tuple(metadata.get('source', 'Неизвестный источник') for metadata in metadatas),
+            scores=scores,
+            metadatas=metadatas
+        )
+        with search_cache_lock:
+            search_cache[cache_key] = formatted_results
         
         return formatted_results
         
     except Exception as e:
         logger.error(f"Ошибка при поиске документов: {e}")
-        return []
+        return EMPTY_RESULTS
+
+def search_documents(query: str, collection: str, n_results: int = 5, query_embedding: Optional[List[float]] = None) -> List[Dict]:
+    """Поиск по документам в виде списка словарей {'text', 'metadata', 'score'}."""
+    results = search_results(query, collection, n_results=n_results, query_embedding=query_embedding)
+    return [
+        {'text': text, 'metadata': metadata, 'score': float(score)}
+        for text, metadata, score in zip(results.texts, results.metadatas, results.scores)
+    ]
 
 def delete_document(document_id: str, collection: str) -> bool:
     """Удаление документа из базы данных."""
@@ -214,6 +370,9 @@ def delete_document(document_id: str, collection: str) -> bool:
         
         # Удаляем документы по индексам
         vectorstore._collection.delete(ids=[collection_data['ids'][i] for i in indices_to_delete])
+        forget_collection_hashes(collection)
+        clear_search_cache(collection)
+        clear_all_caches()
         
         logger.info(f"Документ успешно удален: {document_id} (удалено {len(indices_to_delete)} чанков)")
         return True
@@ -289,6 +448,26 @@ def process_documents_from_folder(folder_path: str, collection: str, file_extens
     processed_files = []
     failed_files = []
     
+    # Чанки нескольких файлов копятся и записываются пачками: модель эмбеддингов получает
+    # крупные батчи вместо отдельного вызова на каждый небольшой файл
+    pending_splits = []
+    pending_files = []
+    pending_hashes = set()
+    
+    def flush():
+        """Записывает накопленные чанки; файлы пачки считаются обработанными после успешной записи."""
+        try:
+            if pending_splits:
+                add_splits(pending_splits, collection)
+                logger.info(f"Записано {len(pending_splits)} чанков из {len(pending_files)} файлов в коллекцию {collection}")
+            processed_files.extend(pending_files)
+        except Exception as e:
+            failed_files.extend(pending_files)
+            logger.error(f"❌ Ошибка записи чанков в коллекцию {collection}: {e}")
+        pending_splits.clear()
+        pending_files.clear()
+        pending_hashes.clear()
+    
     try:
         # Получаем список всех файлов в папке
         files = []
@@ -305,17 +484,30 @@ def process_documents_from_folder(folder_path: str, collection: str, file_extens
         for file_path in files:
             try:
                 logger.info(f"Обрабатываю файл: {file_path}")
-                success = process_document(file_path, collection)
-                if success:
-                    processed_files.append(file_path)
-                    logger.info(f"✅ Файл успешно обработан: {file_path}")
-                else:
+                splits = load_document(file_path)
+                if not splits:
                     failed_files.append(file_path)
                     logger.error(f"❌ Ошибка при обработке файла: {file_path}")
+                    continue
+                
+                # Дубликаты отсеиваются и среди чанков, ещё не записанных в базу
+                unique_splits = [
+                    split for split in filter_duplicates(splits, collection)
+                    if split.metadata["content_hash"] not in pending_hashes
+                ]
+                pending_splits.extend(unique_splits)
+                pending_hashes.update(split.metadata["content_hash"] for split in unique_splits)
+                pending_files.append(file_path)
+                logger.info(f"✅ Файл загружен: {file_path} ({len(unique_splits)} новых чанков)")
+                
+                if len(pending_splits) >= INGEST_BATCH_SIZE:
+                    flush()
             except Exception as e:
                 failed_files.append(file_path)
                 logger.error(f"❌ Исключение при обработке файла {file_path}: {e}")
         
+        flush()
+        
         result = {
             "success": True,
             "total_files": len(files),
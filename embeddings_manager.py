@@ -1,5 +1,12 @@
 import os
+import time
 import logging
+import sqlite3
+import hashlib
+import threading
+from array import array
+from typing import Callable, List
+import torch
 from dotenv import load_dotenv
 from langchain_huggingface import HuggingFaceEndpointEmbeddings
 from langchain_huggingface import HuggingFaceEmbeddings
@@ -13,6 +20,12 @@ logger = logging.getLogger(__name__)
 
 # Конфигурация
 EMBEDDING_MODEL = "cointegrated/rubert-tiny2"  # Модель для HuggingFace embeddings
+EMBEDDING_BATCH_SIZE = 64  # Размер пакета прямого прохода модели при эмбеддинге нескольких текстов
+EMBEDDING_INT8 = os.getenv('EMBEDDING_INT8', '1') == '1'  # Динамическое int8-квантование линейных слоёв локальной модели
+# Идентификатор модели для кэша эмбеддингов: векторы fp32 и int8 модели не смешиваются
+EMBEDDING_MODEL_ID = f"{EMBEDDING_MODEL}-int8" if EMBEDDING_INT8 else EMBEDDING_MODEL
+EMBEDDING_CACHE_PATH = ".embedcache.sqlite"  # Файл кэша эмбеддингов запросов
+EMBEDDING_CACHE_TTL = 30 * 86400  # Время жизни записи кэша эмбеддингов (секунды)
 
 # Глобальные переменные для хранения экземпляров embeddings
 _huggingface_embeddings = None
@@ -44,11 +57,61 @@ def get_local_huggingface_embeddings():
         logger.info("Инициализация локальных HuggingFaceEmbeddings...")
         _local_huggingface_embeddings = HuggingFaceEmbeddings(
             model_name=EMBEDDING_MODEL,
-            model_kwargs={'device': 'cpu'}
+            model_kwargs={'device': 'cpu'},
+            # Векторы нормируются один раз при вычислении: косинусная близость сводится к скалярному произведению
+            encode_kwargs={'normalize_embeddings': True, 'batch_size': EMBEDDING_BATCH_SIZE}
         )
+        if EMBEDDING_INT8:
+            # Веса Linear переводятся в int8, матричные умножения идут через int8-ядра (VNNI на современных CPU)
+            torch.quantization.quantize_dynamic(
+                _local_huggingface_embeddings._client, {torch.nn.Linear}, dtype=torch.qint8, inplace=True
+            )
+            logger.info("Локальная модель эмбеддингов квантована в int8")
         logger.info("Локальные HuggingFaceEmbeddings инициализированы")
     return _local_huggingface_embeddings
 
+class EmbeddingCache:
+    """Дисковый кэш эмбеддингов, адресуемый по содержимому: ключ - (blake2b(текст), модель)."""
+
+    def __init__(self, db_path: str = EMBEDDING_CACHE_PATH, ttl_seconds: int = EMBEDDING_CACHE_TTL):
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key BLOB NOT NULL, "
+            "model TEXT NOT NULL, "
+            "vector BLOB NOT NULL, "
+            "created_at REAL NOT NULL, "
+            "PRIMARY KEY (key, model))"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def _key(text: str) -> bytes:
+        return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+    def get_or_compute(self, text: str, model_name: str, compute: Callable[[str], List[float]]) -> List[float]:
+        """Возвращает эмбеддинг из кэша или вычисляет и сохраняет его."""
+        key = self._key(text)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT vector, created_at FROM embeddings WHERE key = ? AND model = ?",
+                (key, model_name)
+            ).fetchone()
+        if row and now - row[1] < self.ttl_seconds:
+            return array("f", row[0]).tolist()
+
+        vector = compute(text)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO embeddings (key, model, vector, created_at) VALUES (?, ?, ?, ?)",
+                (key, model_name, array("f", vector).tobytes(), now)
+            )
+            self._conn.commit()
+        return vector
+
 def get_gigachat_embeddings():
     """Получение экземпляра GigaChat embeddings (singleton)."""
     global _gigachat_embeddings
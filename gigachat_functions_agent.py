@@ -5,33 +5,51 @@ GigaChat Functions Agent (максимально упрощённая верси
 """
 
 import os
+import re
 import time
 import sys
-from typing import Dict, Any
+import logging
+import functools
+from collections import Counter
+from typing import Dict, Any, List, Optional, Tuple
 from dotenv import load_dotenv
-from langchain_gigachat import GigaChat
-from langchain_core.messages import HumanMessage, SystemMessage, FunctionMessage
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage, FunctionMessage, ToolMessage
 from langgraph.prebuilt import create_react_agent
 from pydantic import Field
 from langchain_gigachat.tools.giga_tool import giga_tool
 
-from document_processor import search_documents
+from document_processor import search_results, embeddings, start_warmup, MIN_RELEVANCE_SCORE
+from semantic_cache import SemanticCache, semantic_cached
+from llm_client import get_llm
 
 # Загрузка переменных окружения
 load_dotenv()
 
-# Инициализация компонентов один раз при запуске
-gc_auth = os.getenv('GIGACHAT_TOKEN')
-if not gc_auth:
-    raise ValueError("Не найден токен GigaChat в переменных окружения")
+logger = logging.getLogger(__name__)
 
-llm = GigaChat(
-    credentials=gc_auth,
-    model='GigaChat:latest',
-    verify_ssl_certs=False,
-    profanity_check=False
+# Отладочный вывод сообщений агента: LOG_LEVEL=DEBUG для всего процесса или AGENT_DEBUG=1 только для этого модуля
+if os.getenv("AGENT_DEBUG") == "1":
+    logger.setLevel(logging.DEBUG)
+
+# Реплики вне тематики документов (приветствия, благодарности, прощания), которые отправляются в LLM напрямую,
+# минуя агента. Любой другой запрос без ключевых слов остаётся агенту: он сам решает, нужен ли поиск
+SMALL_TALK_PHRASES = [
+    "привет", "приветствую", "здравствуй", "здравствуйте", "добрый день", "добрый вечер", "доброе утро",
+    "hi", "hello", "как дела", "как ты", "кто ты", "что ты умеешь",
+    "спасибо", "спасибо большое", "благодарю", "отлично", "понятно", "хорошо", "ок", "ok",
+    "пока", "до свидания", "до встречи"
+]
+SMALL_TALK_RE = re.compile(
+    r"(?:\b(?:" + "|".join(map(re.escape, sorted(SMALL_TALK_PHRASES, key=len, reverse=True))) + r")\b\s*)+"
 )
 
+# Названия коллекций для сообщений поиска
+COLLECTION_NAMES = {
+    "dama_dmbok": "стандарте DAMA DMBOK",
+    "ctk_methodology": "регламентах и методологических материалах ЦТК",
+    "sbf_meta": "синтезированных метаданных компании СберФакторинг (СБФ)"
+}
+
 # Создание функций с декоратором giga_tool
 dama_few_shot_examples = [
     {"request": "Найди информацию о методологии управления данными в стандарте DAMA DMBOK", "params": {"query": "методология управления данными стандарт DAMA DMBOK", "collection": "dama_dmbok"}},
@@ -54,42 +72,127 @@ sbf_few_shot_examples = [
 @giga_tool(few_shot_examples=dama_few_shot_examples)
 def dama_search(query: str = Field(description="Поисковый запрос на русском языке для поиска в стандарте DAMA DMBOK")) -> str:
     """ВСЕГДА используй эту функцию, если в запросе упоминаются: DAMA, DMBOK, dmbok, Data Management Body Of Knowledge, области управления данными, роли управления данными, стандарт DAMA. НЕ ОТВЕЧАЙ на основе общих знаний - ВСЕГДА ищи в документах."""
-    return search_documents_tool(query, "dama_dmbok", "стандарте DAMA DMBOK")
+    return search_documents_tool(query, "dama_dmbok", COLLECTION_NAMES["dama_dmbok"])
 
 @giga_tool(few_shot_examples=ctk_few_shot_examples)
 def ctk_search(query: str = Field(description="Поисковый запрос на русском языке для поиска в регламентах и методологических материалах ЦТК")) -> str:
     """ВСЕГДА используй эту функцию, если в запросе упоминаются: ЦТК, центральный технологический консалтинг, методология ЦТК, слои информационной архитектуры, регламенты ЦТК, политика данных ДЗО. НЕ ОТВЕЧАЙ на основе общих знаний - ВСЕГДА ищи в документах."""
-    return search_documents_tool(query, "ctk_methodology", "регламентах и методологических материалах ЦТК")
+    return search_documents_tool(query, "ctk_methodology", COLLECTION_NAMES["ctk_methodology"])
 
 @giga_tool(few_shot_examples=sbf_few_shot_examples)
 def sbf_search(query: str = Field(description="Поисковый запрос на русском языке для поиска в синтезированных метаданных компании СберФакторинг (СБФ)")) -> str:
     """ВСЕГДА используй эту функцию, если в запросе упоминаются: СберФакторинг, СБФ, метаданные СБФ, структура данных СберФакторинг. НЕ ОТВЕЧАЙ на основе общих знаний - ВСЕГДА ищи в документах."""
-    return search_documents_tool(query, "sbf_meta", "синтезированных метаданных компании СберФакторинг (СБФ)")
+    return search_documents_tool(query, "sbf_meta", COLLECTION_NAMES["sbf_meta"])
 
-def search_documents_tool(query: str, collection: str, collection_name: str) -> str:
-    """Универсальная функция поиска документов."""
+def search_documents_tool(query: str, collection: str, collection_name: str, query_embedding: Optional[List[float]] = None) -> str:
+    """Универсальная функция поиска документов (с готовым эмбеддингом запроса, если он уже вычислен)."""
     try:
-        results = search_documents(query, collection, n_results=5)
+        results = search_results(query, collection, n_results=5, query_embedding=query_embedding).above(MIN_RELEVANCE_SCORE)
         if not results:
             return f"Информация по данному запросу не найдена в {collection_name}."
-        content_parts = []
-        for i, result in enumerate(results, 1):
-            source = result['metadata'].get('source', 'Неизвестный источник')
-            score = result['score']
-            content_parts.append(f"Источник {i}: {source} (релевантность: {score:.3f})\n{result['text']}")
-        return "\n\n---\n\n".join(content_parts)
+        return "\n\n---\n\n".join(
+            f"Источник {i}: {source} (релевантность: {score:.3f})\n{text}"
+            for i, (source, score, text) in enumerate(zip(results.sources, results.scores, results.texts), 1)
+        )
     except Exception as e:
         return f"Ошибка при поиске в {collection_name}: {str(e)}"
 
 functions = [dama_search, ctk_search, sbf_search]
 
-agent = create_react_agent(
-    model=llm,
-    tools=functions
+# Ключевые слова коллекций (те же, что в правилах системного промпта)
+COLLECTION_KEYWORDS = {
+    "dama_dmbok": ["DAMA", "DMBOK", "Data Management Body of Knowledge", "области управления данными", "роли управления данными", "стандарт DAMA"],
+    "ctk_methodology": ["ЦТК", "центральный технологический консалтинг", "методология ЦТК", "слои информационной архитектуры", "регламенты ЦТК", "политика данных ДЗО"],
+    "sbf_meta": ["СберФакторинг", "СБФ", "метаданные СБФ", "структура данных СберФакторинг"]
+}
+
+# Обратный индекс и одно регулярное выражение по всем ключевым словам строятся при импорте
+KEYWORD_TO_COLLECTION = {
+    keyword.lower(): collection
+    for collection, keywords in COLLECTION_KEYWORDS.items()
+    for keyword in keywords
+}
+KEYWORDS_RE = re.compile("|".join(map(re.escape, sorted(KEYWORD_TO_COLLECTION, key=len, reverse=True))))
+
+# Счётчик решений маршрутизатора
+routing_stats = Counter()
+
+DIRECT_SYSTEM_PROMPT = "Ты - эксперт по управлению данными. Коротко и дружелюбно ответь пользователю на русском языке."
+TOOL_SYSTEM_PROMPT = (
+    "Ты - эксперт по управлению данными. Ответь на вопрос пользователя на русском языке, "
+    "используя найденные фрагменты документов. Если в них нет ответа, честно скажи об этом."
 )
 
+def scan_collections(query: str) -> set:
+    """Возвращает коллекции, ключевые слова которых встречаются в запросе."""
+    return {KEYWORD_TO_COLLECTION[keyword] for keyword in KEYWORDS_RE.findall(query.lower())}
+
+def is_small_talk(query: str) -> bool:
+    """Состоит ли запрос только из фраз SMALL_TALK_PHRASES (регистр и знаки препинания не учитываются)."""
+    normalized = re.sub(r"[^\w\s]", " ", query.lower()).strip()
+    return bool(normalized) and SMALL_TALK_RE.fullmatch(normalized) is not None
+
+def choose_route(query: str) -> Tuple[str, Optional[str]]:
+    """
+    Выбирает маршрут запроса:
+    - "tool": ключевые слова ровно одной коллекции - поиск по ней и один вызов LLM без агента;
+    - "direct": приветствие, благодарность или прощание без ключевых слов - LLM напрямую;
+    - "agent": всё остальное - агент с инструментами.
+    """
+    collections = scan_collections(query)
+    if len(collections) == 1:
+        return "tool", next(iter(collections))
+    if not collections and is_small_talk(query):
+        return "direct", None
+    return "agent", None
+
+@functools.lru_cache(maxsize=1)
+def _get_agent():
+    """Граф агента строится при первом запросе: get_functions_info() обходится без него."""
+    return create_react_agent(
+        model=get_llm(),
+        tools=functions
+    )
+
+# Семантический кэш ответов агента (отдельно для каждого пользователя).
+# Агент не хранит историю диалога, поэтому ответ из кэша никуда не записывается
+response_cache = SemanticCache(embeddings, db_path="semantic_cache_functions.sqlite")
+
+def _dump_message(message: BaseMessage):
+    """Отладочный вывод сообщения агента одной записью лога."""
+    details = []
+    if message.content:
+        details.append(f"Content: {message.content}")
+    if isinstance(message, AIMessage) and message.tool_calls:
+        details.append(f"Tool calls: {message.tool_calls}")
+    if isinstance(message, ToolMessage):
+        details.append(f"Tool call ID: {message.tool_call_id}")
+    if message.name:
+        details.append(f"Name: {message.name}")
+    if message.additional_kwargs:
+        details.append(f"Additional kwargs: {message.additional_kwargs}")
+    logger.debug("=== %s ===\n%s", message.__class__.__name__, "\n".join(details))
+
+@semantic_cached(response_cache, scope_arg="user_id")
 def call_agent(query: str, user_id: str = "default") -> str:
     try:
+        # Приветствия и вопросы вне тематики документов не требуют планирования и инструментов
+        route, collection = choose_route(query)
+        routing_stats[route] += 1
+        logger.info(
+            "Маршрут запроса: %s (агент: %d, инструмент: %d, напрямую: %d)",
+            route, routing_stats["agent"], routing_stats["tool"], routing_stats["direct"]
+        )
+        if route == "direct":
+            return get_llm().invoke([SystemMessage(content=DIRECT_SYSTEM_PROMPT), HumanMessage(content=query)]).content
+        if route == "tool":
+            # Инструмент известен по ключевым словам: планирование ReAct-агентом не нужно
+            context = search_documents_tool(query, collection, COLLECTION_NAMES[collection])
+            return get_llm().invoke([
+                SystemMessage(content=TOOL_SYSTEM_PROMPT),
+                HumanMessage(content=f"Контекст:\n{context}\n\nВопрос: {query}")
+            ]).content
+        
         config = {"configurable": {"thread_id": user_id}}
         final_response = ""
         
@@ -112,7 +215,7 @@ def call_agent(query: str, user_id: str = "default") -> str:
 
 Если ключевых слов нет, можешь отвечать на основе своих знаний."""
         
-        for event in agent.stream(
+        for event in _get_agent().stream(
             {
                 "messages": [
                     {"role": "system", "content": system_message},
@@ -122,33 +225,19 @@ def call_agent(query: str, user_id: str = "default") -> str:
             stream_mode="values",
             config=config,
         ):
-            if "messages" in event and event["messages"]:
-                for message in event["messages"]:
-                    if hasattr(message, '__class__'):
-                        message_type = message.__class__.__name__
-                        print(f"\n=== {message_type} ===")
-                        if hasattr(message, 'content') and message.content:
-                            print(f"Content: {message.content}")
-                        if hasattr(message, 'tool_calls') and message.tool_calls:
-                            print(f"Tool calls: {message.tool_calls}")
-                        if hasattr(message, 'tool_call_id') and message.tool_call_id:
-                            print(f"Tool call ID: {message.tool_call_id}")
-                        if hasattr(message, 'name') and message.name:
-                            print(f"Name: {message.name}")
-                        if hasattr(message, 'additional_kwargs') and message.additional_kwargs:
-                            print(f"Additional kwargs: {message.additional_kwargs}")
-            
-            if "messages" in event and event["messages"]:
-                last_message = event["messages"][-1]
-                if hasattr(last_message, 'content'):
-                    final_response = last_message.content
+            messages = event.get("messages")
+            if messages:
+                if logger.isEnabledFor(logging.DEBUG):
+                    for message in messages:
+                        _dump_message(message)
+                final_response = messages[-1].content
         
         return final_response
     except Exception as e:
         return f"Извините, произошла ошибка при обработке вашего запроса: {str(e)}"
 
-def get_functions_info() -> Dict[str, Any]:
-    """Получение информации о доступных функциях для бота."""
+def _build_functions_info() -> Dict[str, Any]:
+    """Собирает информацию о доступных функциях (схемы аргументов строятся один раз)."""
     return {
         "total_functions": len(functions),
         "function_names": [func.name for func in functions],
@@ -162,7 +251,15 @@ def get_functions_info() -> Dict[str, Any]:
         ]
     }
 
+# Набор функций не меняется после запуска, поэтому информация о них вычисляется при импорте
+_FUNCTIONS_INFO_CACHE = _build_functions_info()
+
+def get_functions_info() -> Dict[str, Any]:
+    """Получение информации о доступных функциях для бота."""
+    return _FUNCTIONS_INFO_CACHE
+
 def main():
+    start_warmup()
     try:
         while True:
             try:
@@ -4,34 +4,31 @@ GigaChat Tool Calling Agent (максимально упрощённая вер
 Рекомендуемый подход от Сбера для работы с инструментами
 """
 
-import os
+import functools
 import time
 import sys
-from typing import Dict, Any
+from collections import deque
+from typing import Dict, Any, List, Optional
 from dotenv import load_dotenv
-from langchain_gigachat import GigaChat
-from langchain_core.messages import HumanMessage, SystemMessage, FunctionMessage
+from langchain_core.messages import AIMessage, HumanMessage
 from langchain.agents import create_tool_calling_agent, AgentExecutor
 from langchain_core.prompts import ChatPromptTemplate
 from pydantic import Field
 from langchain_gigachat.tools.giga_tool import giga_tool
 
-from document_processor import search_documents
+from document_processor import search_results, embeddings, start_warmup, MIN_RELEVANCE_SCORE
+from semantic_cache import SemanticCache, semantic_cached
+from llm_client import get_llm
 
 # Загрузка переменных окружения
 load_dotenv()
 
-# Инициализация компонентов один раз при запуске
-gc_auth = os.getenv('GIGACHAT_TOKEN')
-if not gc_auth:
-    raise ValueError("Не найден токен GigaChat в переменных окружения")
+# Нормализация пробелов в тексте фрагментов за один проход и шаблон вывода результата поиска
+RESULT_TEMPLATE = "\nИсточник {i}: {source} (релевантность: {score:.3f})\n{text}"
 
-llm = GigaChat(
-    credentials=gc_auth,
-    model='GigaChat:latest',
-    verify_ssl_certs=False,
-    profanity_check=False
-)
+def _clean(text: str) -> str:
+    """Схлопывает переносы строк и повторяющиеся пробелы в один пробел."""
+    return ' '.join(text.split())
 
 # Few-shot examples для функций
 few_shot_dama = [
@@ -86,24 +83,19 @@ def sbf_search(query: str = Field(description="Поисковый запрос 
     result = search_documents_tool(query, "sbf_meta", "синтезированных метаданных компании СберФакторинг (СБФ)")
     return result
 
-def search_documents_tool(query: str, collection: str, collection_name: str) -> str:
-    """Универсальная функция поиска документов."""
+def search_documents_tool(query: str, collection: str, collection_name: str, query_embedding: Optional[List[float]] = None) -> str:
+    """Универсальная функция поиска документов (с готовым эмбеддингом запроса, если он уже вычислен)."""
     try:
-        results = search_documents(query, collection, n_results=5)
+        results = search_results(query, collection, n_results=5, query_embedding=query_embedding).above(MIN_RELEVANCE_SCORE)
         
         if not results:
             return f"Информация по данному запросу не найдена в {collection_name}."
         
-        content_parts = []
-        for i, result in enumerate(results, 1):
-            source = result['metadata'].get('source', 'Неизвестный источник')
-            score = result['score']
-            # Убираем лишние переносы строк из текста
-            clean_text = result['text'].replace('\n', ' ').replace('  ', ' ').strip()
-            content_parts.append(f"\nИсточник {i}: {source} (релевантность: {score:.3f})\n{clean_text}")
-        
-        final_result = "\n\n---\n".join(content_parts)
-        return final_result
+        # Убираем лишние переносы строк из текста
+        return "\n\n---\n".join(
+            RESULT_TEMPLATE.format(i=i, source=source, score=score, text=_clean(text))
+            for i, (source, score, text) in enumerate(zip(results.sources, results.scores, results.texts), 1)
+        )
     except Exception as e:
         return f"Ошибка при поиске в {collection_name}: {str(e)}"
 
@@ -135,23 +127,51 @@ prompt = ChatPromptTemplate.from_messages([
     ("placeholder", "{agent_scratchpad}"),
 ])
 
-# Создание агента с create_tool_calling_agent
-agent = create_tool_calling_agent(llm, functions, prompt)
-agent_executor = AgentExecutor(
-    agent=agent, 
-    tools=functions,
-    return_intermediate_steps=True,
-    verbose=True
-)
-
+@functools.lru_cache(maxsize=1)
+def _get_agent() -> AgentExecutor:
+    """
+    Клиент GigaChat и агент создаются при первом запросе, а не при импорте:
+    get_functions_info() и регистрация бота не платят за их построение.
+    """
+    # Создание агента с create_tool_calling_agent
+    agent = create_tool_calling_agent(get_llm(), functions, prompt)
+    return AgentExecutor(
+        agent=agent, 
+        tools=functions,
+        return_intermediate_steps=True,
+        verbose=True
+    )
+
+# История диалога по thread_id: последние HISTORY_MAX_MESSAGES сообщений передаются агенту в chat_history
+HISTORY_MAX_MESSAGES = 8
+_history: Dict[str, deque] = {}
+
+def _get_history(thread_id: str) -> deque:
+    """История диалога потока (создаётся при первом обращении)."""
+    return _history.setdefault(thread_id, deque(maxlen=HISTORY_MAX_MESSAGES))
+
+def remember_turn(user_query: str, response: str, thread_id: str = "default"):
+    """Добавляет пару вопрос-ответ в историю потока."""
+    _get_history(thread_id).extend([HumanMessage(content=user_query), AIMessage(content=response)])
+
+def has_history(user_query: str, thread_id: str = "default") -> bool:
+    """Есть ли в потоке предыдущие реплики (тогда ответ зависит от контекста и не кэшируется)."""
+    return bool(_history.get(thread_id))
+
+# Семантический кэш ответов агента (отдельно для каждого потока, только для первого вопроса диалога)
+response_cache = SemanticCache(embeddings, db_path="semantic_cache_tool_calling.sqlite")
+
+@semantic_cached(response_cache, remember=remember_turn, has_history=has_history)
 def call_agent(user_query: str, thread_id: str = "default") -> str:
     try:
-        result = agent_executor.invoke({
+        history = _get_history(thread_id)
+        result = _get_agent().invoke({
             "input": user_query,
-            "chat_history": []
+            "chat_history": list(history)
         })
         
         response = result.get("output", "Не удалось получить ответ")
+        remember_turn(user_query, response, thread_id)
         
         # Проверяем, были ли вызваны инструменты
         if "intermediate_steps" in result and result["intermediate_steps"]:
@@ -174,8 +194,8 @@ def call_agent(user_query: str, thread_id: str = "default") -> str:
     except Exception as e:
         return f"Извините, произошла ошибка при обработке вашего запроса: {str(e)}"
 
-def get_functions_info() -> Dict[str, Any]:
-    """Получение информации о доступных функциях для бота."""
+def _build_functions_info() -> Dict[str, Any]:
+    """Собирает информацию о доступных функциях (схемы аргументов строятся один раз)."""
     return {
         "total_functions": len(functions),
         "function_names": [func.name for func in functions],
@@ -189,7 +209,15 @@ def get_functions_info() -> Dict[str, Any]:
         ]
     }
 
+# Набор функций не меняется после запуска, поэтому информация о них вычисляется при импорте
+_FUNCTIONS_INFO_CACHE = _build_functions_info()
+
+def get_functions_info() -> Dict[str, Any]:
+    """Получение информации о доступных функциях для бота."""
+    return _FUNCTIONS_INFO_CACHE
+
 def main():
+    start_warmup()
     try:
         while True:
             try:
@@ -0,0 +1,34 @@
+"""
+Общий клиент GigaChat для агентов.
+Один экземпляр (и одно HTTPS-соединение с пулом) на процесс, создаётся при первом обращении.
+"""
+
+import os
+import logging
+import functools
+from dotenv import load_dotenv
+from langchain_gigachat import GigaChat
+
+# Загрузка переменных окружения
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Токен проверяется при импорте: без него агенты не запускаются
+GC_AUTH = os.getenv('GIGACHAT_TOKEN')
+if not GC_AUTH:
+    raise ValueError("Не найден токен GigaChat в переменных окружения")
+
+LLM_TIMEOUT = 60  # Ограничение времени запроса к GigaChat (секунды)
+
+@functools.lru_cache(maxsize=1)
+def get_llm() -> GigaChat:
+    """Получение общего экземпляра GigaChat (singleton)."""
+    logger.info("Инициализация GigaChat...")
+    return GigaChat(
+        credentials=GC_AUTH,
+        model='GigaChat:latest',
+        verify_ssl_certs=False,
+        profanity_check=False,
+        timeout=LLM_TIMEOUT
+    )
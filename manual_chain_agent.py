@@ -4,139 +4,277 @@
 """
 
 import os
+import re
+import json
+import sqlite3
+import hashlib
 import logging
-from typing import List
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from cachetools import LRUCache
 from dotenv import load_dotenv
-from langchain_gigachat import GigaChat
 from langchain.agents import tool
 from langchain.memory import (
     ConversationBufferMemory,
     ConversationSummaryMemory,
+    ConversationSummaryBufferMemory,
     ConversationTokenBufferMemory,
     ConversationBufferWindowMemory
 )
-from langchain_core.messages import HumanMessage, AIMessage
-from document_processor import search_documents
+from langchain.memory.chat_memory import BaseChatMemory
+from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, SystemMessage, messages_from_dict, messages_to_dict
+from document_processor import search_results, embed_query, embeddings, start_warmup, SearchResults, MIN_RELEVANCE_SCORE
+from semantic_cache import SemanticCache, semantic_cached
+from llm_client import get_llm
 import time
 import sys
-import inspect
 
 # Загрузка переменных окружения
 load_dotenv()
 
 # Настройка логирования
 logging.basicConfig(
-    level=logging.INFO,
+    level=os.getenv('LOG_LEVEL', 'INFO').upper(),
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
 
-# Получение токенов из переменных окружения
-GC_AUTH = os.getenv('GIGACHAT_TOKEN')
-if not GC_AUTH:
-    raise ValueError("Не найден токен GigaChat в переменных окружения")
-
-# Инициализация GigaChat
-llm = GigaChat(
-    credentials=GC_AUTH,
-    model='GigaChat:latest',
-    verify_ssl_certs=False,
-    profanity_check=False
-)
+# Памяти пользователей: в RAM хранятся недавно активные, остальные выгружаются на диск
+MEMORY_CACHE_SIZE = 1024  # Число памятей (пользователь × тип памяти) в RAM
+MEMORY_DB_PATH = "user_memories.sqlite"  # Файл для выгруженных памятей
 
-# Словарь для хранения памяти пользователей
-user_memories = {}
+# Тип памяти по умолчанию: старые сообщения пересказываются, последние хранятся дословно
+DEFAULT_MEMORY_TYPE = "summary_buffer"  # summary_buffer, buffer, summary, token_buffer, window
+SUMMARY_BUFFER_TOKEN_LIMIT = 1500  # Сколько токенов последних сообщений хранится дословно
+SUMMARY_MAX_CHARS = 3000  # Предел длины пересказа (~800 токенов): при превышении отбрасывается его начало
+HISTORY_TAIL_MESSAGES = 6  # Сколько последних сообщений попадает в промпт (3 пары вопрос-ответ)
+TOKEN_BUFFER_LIMIT = 2000  # Лимит токенов памяти token_buffer
+CHARS_PER_TOKEN = 3  # Оценка длины токена для русского текста
+TOKENS_PER_MESSAGE = 3  # Служебные токены на сообщение
+TOKEN_ESTIMATE_MARGIN = 0.25  # Если оценка ближе этой доли к лимиту, токены считает токенизатор GigaChat
 
-# Тип памяти по умолчанию
-DEFAULT_MEMORY_TYPE = "buffer"  # buffer, summary, token_buffer, window
+# Подписи сообщений истории в промпте
+HISTORY_ROLE_LABELS = {
+    "system": "Краткое содержание предыдущего диалога",
+    "human": "Пользователь",
+    "ai": "Ассистент"
+}
 
-@tool
-def dama_retrieve_tool(query: str):
-    """Используй этот инструмент для поиска информации о методологии управления данными, 
-    стандартах DAMA, процессах управления данными, ролях и ответственности в области управления данными.
-    Этот инструмент содержит информацию из Data Management Body Of Knowledge (DMBOK)."""
-    results = search_documents(query, "dama_dmbok", n_results=5)
-    if not results:
-        return "Информация не найдена в стандарте DAMA DMBOK."
+def estimate_tokens(messages: List[BaseMessage]) -> int:
+    """Оценка числа токенов в сообщениях по длине текста, без обращения к токенизатору."""
+    return sum(len(message.content) for message in messages) // CHARS_PER_TOKEN + len(messages) * TOKENS_PER_MESSAGE
+
+class FastTokenCountMixin:
+    """
+    Подсчёт токенов истории для памяти с max_token_limit.
+    Токенизатор GigaChat - запрос к API, а обрезка истории считает токены после каждого удалённого сообщения.
+    Поэтому сначала используется оценка по длине, и только вблизи лимита - точный подсчёт.
+    """
     
-    content_parts = []
-    for i, result in enumerate(results, 1):
-        source = result['metadata'].get('source', 'Неизвестный источник')
-        score = result['score']
-        clean_text = result['text'].replace('\n', ' ').replace('  ', ' ').strip()
-        content_parts.append(f"\nИсточник {i}: {source} (релевантность: {score:.3f})\n{clean_text}")
+    def count_tokens(self, messages: List[BaseMessage]) -> int:
+        estimate = estimate_tokens(messages)
+        if abs(estimate - self.max_token_limit) <= self.max_token_limit * TOKEN_ESTIMATE_MARGIN:
+            return self.llm.get_num_tokens_from_messages(messages)
+        return estimate
     
-    return "\n\n---\n".join(content_parts)
+    def pop_over_limit(self) -> List[BaseMessage]:
+        """Удаляет самые старые сообщения, пока история превышает лимит, и возвращает их."""
+        buffer = self.chat_memory.messages
+        pruned = []
+        while buffer and self.count_tokens(buffer) > self.max_token_limit:
+            pruned.append(buffer.pop(0))
+        return pruned
 
-@tool
-def ctk_retrieve_tool(query: str):
-    """Используй этот инструмент для поиска информации о технологических решениях, 
-    архитектуре систем, методологиях разработки, стандартах и практиках ЦТК.
-    Этот инструмент содержит документацию Центра Технологического Консалтинга."""
-    results = search_documents(query, "ctk_methodology", n_results=5)
-    if not results:
-        return "Информация не найдена в регламентах и методологических материалах ЦТК."
+class FastTokenBufferMemory(FastTokenCountMixin, ConversationTokenBufferMemory):
+    """Память с ограничением по токенам и быстрым подсчётом токенов."""
     
-    content_parts = []
-    for i, result in enumerate(results, 1):
-        source = result['metadata'].get('source', 'Неизвестный источник')
-        score = result['score']
-        clean_text = result['text'].replace('\n', ' ').replace('  ', ' ').strip()
-        content_parts.append(f"\nИсточник {i}: {source} (релевантность: {score:.3f})\n{clean_text}")
-    
-    return "\n\n---\n".join(content_parts)
+    def save_context(self, inputs: Dict[str, Any], outputs: Dict[str, str]) -> None:
+        BaseChatMemory.save_context(self, inputs, outputs)
+        self.pop_over_limit()
 
-@tool
-def sbf_retrieve_tool(query: str):
-    """Используй этот инструмент для поиска информации в искусственных данных и метаданных, 
-    созданных для демонстрационных целей СБФ. Эти данные не имеют отношения к реальной деятельности компании.
-    Этот инструмент содержит синтезированные метаданные для СБФ."""
-    results = search_documents(query, "sbf_meta", n_results=5)
-    if not results:
-        return "Информация не найдена в синтезированных метаданных компании СберФакторинг (СБФ)."
+class BoundedSummaryBufferMemory(FastTokenCountMixin, ConversationSummaryBufferMemory):
+    """Память с пересказом старых сообщений, в которой сам пересказ не растёт с каждым сжатием."""
     
-    content_parts = []
-    for i, result in enumerate(results, 1):
-        source = result['metadata'].get('source', 'Неизвестный источник')
-        score = result['score']
-        clean_text = result['text'].replace('\n', ' ').replace('  ', ' ').strip()
-        content_parts.append(f"\nИсточник {i}: {source} (релевантность: {score:.3f})\n{clean_text}")
+    def prune(self) -> None:
+        pruned = self.pop_over_limit()
+        if pruned:
+            self.moving_summary_buffer = self.predict_new_summary(pruned, self.moving_summary_buffer)
     
-    return "\n\n---\n".join(content_parts)
+    def predict_new_summary(self, messages: List[BaseMessage], existing_summary: str) -> str:
+        summary = super().predict_new_summary(messages, existing_summary)
+        if len(summary) > SUMMARY_MAX_CHARS:
+            # Оставляем самую свежую часть пересказа, начиная с целого слова
+            tail = summary[-SUMMARY_MAX_CHARS:]
+            summary = tail[tail.find(' ') + 1:]
+        return summary
 
-def get_functions_info():
-    """Получение информации о доступных инструментах для бота."""
-    # Собираем все функции с декоратором @tool
-    tool_functions = []
+# Нормализация пробелов в тексте фрагментов за один проход и шаблон вывода результата поиска
+RESULT_TEMPLATE = "\nИсточник {i}: {source} (релевантность: {score:.3f})\n{text}"
+
+def _clean(text: str) -> str:
+    """Схлопывает переносы строк и повторяющиеся пробелы в один пробел."""
+    return ' '.join(text.split())
+
+MAX_CONTEXT_TOKENS = 3000  # Бюджет (оценка в токенах) найденных фрагментов в промпте
+
+# Пул потоков для параллельного поиска по коллекциям (по потоку на инструмент)
+tool_executor = ThreadPoolExecutor(max_workers=3, thread_name_prefix="retrieve")
+
+def _search(collection: str, query: str, query_embedding: Optional[List[float]] = None) -> SearchResults:
+    """Поиск по коллекции: фрагменты с релевантностью не ниже MIN_RELEVANCE_SCORE."""
+    return search_results(query, collection, n_results=5, query_embedding=query_embedding).above(MIN_RELEVANCE_SCORE)
+
+def _format_chunks(chunks: List[Tuple[str, float, str]]) -> str:
+    """Форматирует фрагменты (источник, релевантность, очищенный текст) для промпта."""
+    return "\n\n---\n".join(
+        RESULT_TEMPLATE.format(i=i, source=source, score=score, text=text)
+        for i, (source, score, text) in enumerate(chunks, 1)
+    )
+
+def _retrieve(collection: str, not_found_message: str, query: str) -> str:
+    """Поиск по коллекции с форматированием результатов."""
+    results = _search(collection, query)
+    if not results:
+        return not_found_message
+    return _format_chunks([
+        (source, score, _clean(text))
+        for source, score, text in zip(results.sources, results.scores, results.texts)
+    ])
+
+def _make_retrieve_tool(tool_name: str, collection: str, not_found_message: str, description: str):
+    """
+    Создаёт инструмент поиска по коллекции; форматирование результатов общее для всех коллекций.
+    Схема аргументов инструмента - только query: готовый эмбеддинг запроса передаётся в поиск
+    через _invoke_tool, минуя инструмент.
+    """
+    def retrieve(query: str):
+        return _retrieve(collection, not_found_message, query)
     
-    # Получаем все функции из текущего модуля
-    current_module = inspect.currentframe().f_globals
+    retrieve.__doc__ = description
+    retrieve_tool = tool(tool_name)(retrieve)
+    retrieve_tool.metadata = {"collection": collection, "not_found_message": not_found_message}
+    return retrieve_tool
+
+# Инструменты поиска по коллекциям в порядке формирования контекста
+RETRIEVE_TOOLS = {
+    "dama_retrieve_tool": _make_retrieve_tool(
+        "dama_retrieve_tool",
+        "dama_dmbok",
+        "Информация не найдена в стандарте DAMA DMBOK.",
+        """Используй этот инструмент для поиска информации о методологии управления данными, 
+    стандартах DAMA, процессах управления данными, ролях и ответственности в области управления данными.
+    Этот инструмент содержит информацию из Data Management Body Of Knowledge (DMBOK)."""
+    ),
+    "ctk_retrieve_tool": _make_retrieve_tool(
+        "ctk_retrieve_tool",
+        "ctk_methodology",
+        "Информация не найдена в регламентах и методологических материалах ЦТК.",
+        """Используй этот инструмент для поиска информации о технологических решениях, 
+    архитектуре систем, методологиях разработки, стандартах и практиках ЦТК.
+    Этот инструмент содержит документацию Центра Технологического Консалтинга."""
+    ),
+    "sbf_retrieve_tool": _make_retrieve_tool(
+        "sbf_retrieve_tool",
+        "sbf_meta",
+        "Информация не найдена в синтезированных метаданных компании СберФакторинг (СБФ).",
+        """Используй этот инструмент для поиска информации в искусственных данных и метаданных, 
+    созданных для демонстрационных целей СБФ. Эти данные не имеют отношения к реальной деятельности компании.
+    Этот инструмент содержит синтезированные метаданные для СБФ."""
+    )
+}
+dama_retrieve_tool = RETRIEVE_TOOLS["dama_retrieve_tool"]
+ctk_retrieve_tool = RETRIEVE_TOOLS["ctk_retrieve_tool"]
+sbf_retrieve_tool = RETRIEVE_TOOLS["sbf_retrieve_tool"]
+
+# Ключевые слова для выбора инструментов
+TOOL_KEYWORDS = {
+    "dama_retrieve_tool": ['dama', 'управление данными', 'методология', 'стандарты', 'dmbok'],
+    "ctk_retrieve_tool": ['ctk', 'регламенты', 'архитектура', 'ролевая модель', 'характеристики качества', 'ЦТК'],
+    "sbf_retrieve_tool": ['sbf', 'сберфакторинг', 'сбербанк факторинг', 'метаданные сбф', 'СБФ', 'искусственные данные']
+}
+
+# Все ключевые слова собираются при импорте в одно регулярное выражение: запрос сканируется за один проход.
+# Ключевые слова приводятся к нижнему регистру, как и запрос
+KEYWORD_TO_TOOL = {
+    keyword.lower(): tool_name
+    for tool_name, keywords in TOOL_KEYWORDS.items()
+    for keyword in keywords
+}
+KEYWORDS_RE = re.compile("|".join(map(re.escape, sorted(KEYWORD_TO_TOOL, key=len, reverse=True))))
+
+def match_tools(user_input: str) -> set:
+    """Возвращает имена инструментов, ключевые слова которых встречаются в запросе."""
+    return {KEYWORD_TO_TOOL[keyword] for keyword in KEYWORDS_RE.findall(user_input.lower())}
+
+def _invoke_tool(tool_name: str, tool_func, query: str, query_embedding: Optional[List[float]] = None):
+    """Выполняет поиск инструмента и возвращает (имя инструмента, найденные фрагменты)."""
+    return tool_name, _search(tool_func.metadata["collection"], query, query_embedding)
+
+def select_context(results_by_tool: Dict[str, SearchResults]) -> Dict[str, List[Tuple[str, float, str]]]:
+    """
+    Отбор фрагментов для промпта из результатов всех инструментов.
+    Повторы (совпадающее начало очищенного текста) отбрасываются, остальные фрагменты берутся
+    по убыванию релевантности, пока их оценка в токенах укладывается в MAX_CONTEXT_TOKENS.
+    Возвращает выбранные фрагменты по инструментам, внутри инструмента - в порядке поиска.
+    """
+    candidates = [
+        (float(score), tool_name, position, source, _clean(text))
+        for tool_name, results in results_by_tool.items()
+        for position, (source, score, text) in enumerate(zip(results.sources, results.scores, results.texts))
+    ]
+    # Сначала самые релевантные: scores - косинусная близость (больше - ближе)
+    candidates.sort(key=lambda candidate: candidate[0], reverse=True)
     
-    for name, obj in current_module.items():
-        if inspect.isfunction(obj) and hasattr(obj, '__wrapped__') and hasattr(obj, 'name'):
-            # Это функция с декоратором @tool
-            tool_functions.append({
-                "name": obj.name,
-                "description": obj.__doc__ or "Описание отсутствует",
-                "function": obj
-            })
+    seen = set()
+    budget = MAX_CONTEXT_TOKENS
+    selected = []
+    for score, tool_name, position, source, text in candidates:
+        digest = hashlib.blake2b(text[:256].encode('utf-8'), digest_size=8).digest()
+        tokens = len(text) // CHARS_PER_TOKEN
+        if digest in seen or tokens > budget:
+            continue
+        seen.add(digest)
+        budget -= tokens
+        selected.append((position, tool_name, source, score, text))
     
+    chunks_by_tool = {}
+    for position, tool_name, source, score, text in sorted(selected, key=lambda chunk: chunk[0]):
+        chunks_by_tool.setdefault(tool_name, []).append((source, score, text))
+    return chunks_by_tool
+
+def _build_functions_info():
+    """Собирает информацию о доступных инструментах (схемы аргументов строятся один раз)."""
     return {
-        "total_functions": len(tool_functions),
-        "function_names": [func["name"] for func in tool_functions],
+        "total_functions": len(RETRIEVE_TOOLS),
+        "function_names": list(RETRIEVE_TOOLS),
         "functions": [
             {
-                "name": func["name"],
-                "description": func["description"],
-                "args_schema": getattr(func["function"], 'args_schema', None)
+                "name": tool_func.name,
+                "description": tool_func.description,
+                "args_schema": tool_func.args_schema.schema() if tool_func.args_schema else None
             }
-            for func in tool_functions
+            for tool_func in RETRIEVE_TOOLS.values()
         ]
     }
 
+# Набор инструментов не меняется после запуска, поэтому информация о них вычисляется при импорте
+_FUNCTIONS_INFO_CACHE = _build_functions_info()
+
+def get_functions_info():
+    """Получение информации о доступных инструментах для бота."""
+    return _FUNCTIONS_INFO_CACHE
+
 def create_memory(memory_type: str = DEFAULT_MEMORY_TYPE, thread_id: str = "default"):
     """Создает память указанного типа."""
-    if memory_type == "buffer":
+    if memory_type == "summary_buffer":
+        return BoundedSummaryBufferMemory(
+            llm=get_llm(),
+            memory_key="chat_history",
+            return_messages=True,
+            max_token_limit=SUMMARY_BUFFER_TOKEN_LIMIT
+        )
+    elif memory_type == "buffer":
         return ConversationBufferMemory(
             memory_key="chat_history",
             return_messages=True,
@@ -144,16 +282,16 @@ def create_memory(memory_type: str = DEFAULT_MEMORY_TYPE, thread_id: str = "defa
         )
     elif memory_type == "summary":
         return ConversationSummaryMemory(
-            llm=llm,
+            llm=get_llm(),
             memory_key="chat_history",
             return_messages=True
         )
     elif memory_type == "token_buffer":
-        return ConversationTokenBufferMemory(
-            llm=llm,
+        return FastTokenBufferMemory(
+            llm=get_llm(),
             memory_key="chat_history",
             return_messages=True,
-            max_token_limit=2000
+            max_token_limit=TOKEN_BUFFER_LIMIT
         )
     elif memory_type == "window":
         return ConversationBufferWindowMemory(
@@ -169,90 +307,202 @@ def create_memory(memory_type: str = DEFAULT_MEMORY_TYPE, thread_id: str = "defa
             max_token_limit=2000
         )
 
+def load_history(memory) -> List[BaseMessage]:
+    """
+    История для промпта: пересказ (если память его ведёт) и последние HISTORY_TAIL_MESSAGES сообщений.
+    Берётся из load_memory_variables, поэтому пересказывающие типы памяти отдают пересказ, а не всю переписку.
+    """
+    messages = memory.load_memory_variables({})["chat_history"]
+    summary = [message for message in messages if isinstance(message, SystemMessage)]
+    recent = [message for message in messages if not isinstance(message, SystemMessage)]
+    return summary + recent[-HISTORY_TAIL_MESSAGES:]
+
+def _get_summary(memory) -> str:
+    """Текущий пересказ памяти (пустая строка для памяти без пересказа)."""
+    if isinstance(memory, ConversationSummaryBufferMemory):
+        return memory.moving_summary_buffer
+    if isinstance(memory, ConversationSummaryMemory):
+        return memory.buffer
+    return ""
+
+def _set_summary(memory, summary: str):
+    """Восстанавливает пересказ памяти."""
+    if isinstance(memory, ConversationSummaryBufferMemory):
+        memory.moving_summary_buffer = summary
+    elif isinstance(memory, ConversationSummaryMemory):
+        memory.buffer = summary
+
+class UserMemoryStore(LRUCache):
+    """
+    LRU-кэш памятей пользователей с выгрузкой на диск.
+    Вытесненная память сохраняется в SQLite (сообщения и пересказ) и восстанавливается при следующем обращении.
+    """
+    
+    def __init__(self, maxsize: int = MEMORY_CACHE_SIZE, db_path: str = MEMORY_DB_PATH):
+        super().__init__(maxsize=maxsize)
+        self.lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS memories ("
+            "key TEXT PRIMARY KEY, "
+            "messages TEXT NOT NULL, "
+            "summary TEXT NOT NULL)"
+        )
+        self._conn.commit()
+    
+    def popitem(self):
+        """Вытеснение из RAM: память записывается на диск."""
+        key, memory = super().popitem()
+        self._conn.execute(
+            "INSERT OR REPLACE INTO memories (key, messages, summary) VALUES (?, ?, ?)",
+            (key, json.dumps(messages_to_dict(memory.chat_memory.messages), ensure_ascii=False), _get_summary(memory))
+        )
+        self._conn.commit()
+        return key, memory
+    
+    def restore(self, key: str, memory) -> bool:
+        """Загружает выгруженную память в новый объект памяти; запись на диске удаляется."""
+        row = self._conn.execute("SELECT messages, summary FROM memories WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return False
+        memory.chat_memory.messages = messages_from_dict(json.loads(row[0]))
+        _set_summary(memory, row[1])
+        self.discard(key)
+        return True
+    
+    def discard(self, key: str):
+        """Удаляет выгруженную память с диска."""
+        self._conn.execute("DELETE FROM memories WHERE key = ?", (key,))
+        self._conn.commit()
+
+user_memories = UserMemoryStore()
+
 def get_user_memory(thread_id: str, memory_type: str = DEFAULT_MEMORY_TYPE):
-    """Получает или создает память для пользователя."""
+    """Получает память пользователя из RAM, с диска или создает новую."""
     memory_key = f"{thread_id}_{memory_type}"
-    if memory_key not in user_memories:
-        user_memories[memory_key] = create_memory(memory_type, thread_id)
-    return user_memories[memory_key]
+    with user_memories.lock:
+        memory = user_memories.get(memory_key)
+        if memory is None:
+            memory = create_memory(memory_type, thread_id)
+            if user_memories.restore(memory_key, memory):
+                logger.debug("Память %s загружена с диска", memory_key)
+            user_memories[memory_key] = memory
+        return memory
+
+# Семантический кэш ответов агента (отдельно для каждого потока, только для первого вопроса диалога)
+response_cache = SemanticCache(embeddings, db_path="semantic_cache_manual_chain.sqlite")
+
+def _generate(prompt, on_token: Optional[Callable[[str], None]] = None) -> str:
+    """Запрос к LLM; если задан on_token, части ответа передаются в него по мере генерации."""
+    if on_token is None:
+        return get_llm().invoke(prompt).content
+    
+    parts = []
+    for chunk in get_llm().stream(prompt):
+        if chunk.content:
+            on_token(chunk.content)
+            parts.append(chunk.content)
+    return "".join(parts)
+
+def remember_turn(
+    user_input: str,
+    response: str,
+    thread_id: str = "default",
+    memory_type: str = DEFAULT_MEMORY_TYPE,
+    on_token: Optional[Callable[[str], None]] = None
+):
+    """Сохраняет ответ из кэша в память пользователя, как и ответ, сгенерированный LLM."""
+    get_user_memory(thread_id, memory_type).save_context({"input": user_input}, {"output": response})
+
+def has_history(
+    user_input: str,
+    thread_id: str = "default",
+    memory_type: str = DEFAULT_MEMORY_TYPE,
+    on_token: Optional[Callable[[str], None]] = None
+) -> bool:
+    """Есть ли в памяти пользователя предыдущие реплики (тогда ответ зависит от контекста и не кэшируется)."""
+    return bool(load_history(get_user_memory(thread_id, memory_type)))
 
-def call_agent(user_input: str, thread_id: str = "default", memory_type: str = DEFAULT_MEMORY_TYPE) -> str:
-    """Упрощенная функция агента с прямым использованием инструментов и встроенной памятью LangChain."""
+@semantic_cached(response_cache, remember=remember_turn, has_history=has_history)
+def call_agent(
+    user_input: str,
+    thread_id: str = "default",
+    memory_type: str = DEFAULT_MEMORY_TYPE,
+    on_token: Optional[Callable[[str], None]] = None
+) -> str:
+    """
+    Упрощенная функция агента с прямым использованием инструментов и встроенной памятью LangChain.
+    on_token получает части ответа LLM по мере генерации (ответ из кэша в него не передаётся).
+    """
     try:
-        print(f"\n🔍 Обработка запроса: '{user_input}'")
-        print(f"🧠 Тип памяти: {memory_type}")
-        print("=" * 50)
+        logger.debug("🔍 Обработка запроса: '%s' (тип памяти: %s)", user_input, memory_type)
         
         # Получаем память пользователя
         memory = get_user_memory(thread_id, memory_type)
         
         # Определяем, какой инструмент использовать на основе ключевых слов
-        tools_to_use = []
-        
-        # Проверяем ключевые слова для каждого инструмента
-        dama_keywords = ['dama', 'управление данными', 'методология', 'стандарты', 'dmbok']
-        ctk_keywords = ['ctk', 'регламенты', 'архитектура', 'ролевая модель', 'характеристики качества', 'ЦТК']
-        sbf_keywords = ['sbf', 'сберфакторинг', 'сбербанк факторинг', 'метаданные сбф', 'СБФ', 'искусственные данные']
-        
-        user_input_lower = user_input.lower()
-        
-        if any(keyword in user_input_lower for keyword in dama_keywords):
-            tools_to_use.append(("dama_retrieve_tool", dama_retrieve_tool))
-        
-        if any(keyword in user_input_lower for keyword in ctk_keywords):
-            tools_to_use.append(("ctk_retrieve_tool", ctk_retrieve_tool))
-        
-        if any(keyword in user_input_lower for keyword in sbf_keywords):
-            tools_to_use.append(("sbf_retrieve_tool", sbf_retrieve_tool))
+        matched_tools = match_tools(user_input)
+        tools_to_use = [(tool_name, tool_func) for tool_name, tool_func in RETRIEVE_TOOLS.items() if tool_name in matched_tools]
         
         # Если не найдены ключевые слова, используем все инструменты
         if not tools_to_use:
-            tools_to_use = [
-                ("dama_retrieve_tool", dama_retrieve_tool),
-                ("ctk_retrieve_tool", ctk_retrieve_tool),
-                ("sbf_retrieve_tool", sbf_retrieve_tool)
-            ]
-        
-        # Собираем информацию из всех подходящих инструментов
-        collected_info = []
+            tools_to_use = list(RETRIEVE_TOOLS.items())
         
+        # Собираем информацию из всех подходящих инструментов.
+        # Поиски по разным коллекциям независимы и выполняются параллельно
+        # Запрос эмбеддится один раз, вектор получают все инструменты
+        query_embedding = embed_query(user_input)
+        futures = {}
         for tool_name, tool_func in tools_to_use:
-            print(f"\n🔧 Используем {tool_name}...")
+            logger.debug("🔧 Используем %s...", tool_name)
+            futures[tool_executor.submit(_invoke_tool, tool_name, tool_func, user_input, query_embedding)] = tool_name
+        
+        results_by_tool = {}
+        for future in as_completed(futures):
+            tool_name = futures[future]
             try:
-                result = tool_func.invoke(user_input)
-                if result and len(result.strip()) > 0:
-                    collected_info.append(f"=== Информация из {tool_name} ===\n{result}")
-                    print(f"✅ Получено {len(result)} символов")
-                else:
-                    print(f"⚠️  Пустой результат от {tool_name}")
+                _, results = future.result()
             except Exception as e:
-                print(f"❌ Ошибка {tool_name}: {e}")
+                logger.error("❌ Ошибка %s: %s", tool_name, e)
+                continue
+            
+            results_by_tool[tool_name] = results
+            if not results:
+                logger.warning("⚠️ Пустой результат от %s", tool_name)
+                continue
+            logger.debug("✅ %s: найдено %d фрагментов", tool_name, len(results))
+        
+        # Повторяющиеся фрагменты отбрасываются, общий объём ограничен бюджетом токенов.
+        # Порядок блоков контекста совпадает с порядком инструментов, а не с порядком завершения
+        chunks_by_tool = select_context(results_by_tool)
+        collected_info = [
+            f"=== Информация из {tool_name} ===\n"
+            + (_format_chunks(chunks_by_tool[tool_name]) if tool_name in chunks_by_tool else tool_func.metadata["not_found_message"])
+            for tool_name, tool_func in tools_to_use
+            if tool_name in results_by_tool
+        ]
         
         if not collected_info:
-            print("⚠️  Не удалось получить информацию из инструментов")
+            logger.warning("⚠️ Не удалось получить информацию из инструментов")
             # Пробуем простой запрос к LLM с памятью
-            messages = memory.chat_memory.messages + [HumanMessage(content=user_input)]
-            response = llm.invoke(messages)
-            bot_response = response.content
+            messages = load_history(memory) + [HumanMessage(content=user_input)]
+            bot_response = _generate(messages, on_token)
         else:
             # Формируем контекст для LLM с памятью
             context = "\n\n".join(collected_info)
             
-            # Получаем историю из памяти
-            chat_history = memory.chat_memory.messages
+            # Получаем историю из памяти: пересказ и последние сообщения
+            chat_history = load_history(memory)
             
             # Создаем промпт с контекстом и историей
             history_context = ""
-            if chat_history:
-                # Добавляем последние 3 пары вопрос-ответ для контекста
-                recent_history = chat_history[-6:]  # Последние 6 сообщений (3 пары)
-                history_parts = []
-                for i in range(0, len(recent_history), 2):
-                    if i + 1 < len(recent_history):
-                        history_parts.append(f"Пользователь: {recent_history[i].content}")
-                        history_parts.append(f"Ассистент: {recent_history[i+1].content}")
-                if history_parts:
-                    history_context = "\n\nИстория диалога:\n" + "\n".join(history_parts) + "\n\n"
+            history_parts = [
+                f"{HISTORY_ROLE_LABELS.get(message.type, message.type)}: {message.content}"
+                for message in chat_history
+                if message.content
+            ]
+            if history_parts:
+                history_context = "\n\nИстория диалога:\n" + "\n".join(history_parts) + "\n\n"
             
             prompt = f"""На основе предоставленной информации и истории диалога ответь на вопрос пользователя.
 
@@ -263,49 +513,36 @@ def call_agent(user_input: str, thread_id: str = "default", memory_type: str = D
 
 Ответь подробно и структурированно, используя информацию из контекста. Если в контексте нет информации для ответа, скажи об этом честно. Учитывай историю диалога для более точного ответа."""
             
-            print(f"\n🤖 Отправляем запрос к LLM...")
-            response = llm.invoke(prompt)
-            bot_response = response.content
+            logger.debug("🤖 Отправляем запрос к LLM...")
+            bot_response = _generate(prompt, on_token)
         
-        # Сохраняем сообщения в память
-        memory.chat_memory.add_user_message(user_input)
-        memory.chat_memory.add_ai_message(bot_response)
+        # Сохраняем сообщения в память (save_context пересказывает и обрезает историю по правилам её типа)
+        memory.save_context({"input": user_input}, {"output": bot_response})
         
         return bot_response
         
     except Exception as e:
-        logger.error(f"Ошибка в call_agent: {e}")
-        
-        # Fallback к простому запросу с памятью
-        try:
-            print("🔄 Попытка простого запроса...")
-            memory = get_user_memory(thread_id, memory_type)
-            messages = memory.chat_memory.messages + [HumanMessage(content=user_input)]
-            response = llm.invoke(messages)
-            bot_response = response.content
-            
-            # Сохраняем в память
-            memory.chat_memory.add_user_message(user_input)
-            memory.chat_memory.add_ai_message(bot_response)
-            
-            return bot_response
-        except Exception as fallback_error:
-            logger.error(f"Ошибка fallback: {fallback_error}")
-            return f"Извините, произошла ошибка при обработке вашего запроса: {str(e)}"
+        # Повторный запрос к LLM удвоил бы ожидание пользователя (время запроса ограничено llm_client.LLM_TIMEOUT):
+        # сразу возвращаем сообщение об ошибке, такие ответы не кэшируются и не сохраняются в память
+        logger.error("Ошибка в call_agent: %s", e)
+        return f"Извините, произошла ошибка при обработке вашего запроса: {str(e)}"
 
 def clear_conversation_history(thread_id: str = "default", memory_type: str = DEFAULT_MEMORY_TYPE):
     """Очищает историю диалога для указанного пользователя."""
     memory_key = f"{thread_id}_{memory_type}"
-    if memory_key in user_memories:
-        user_memories[memory_key].clear()
+    with user_memories.lock:
+        user_memories.discard(memory_key)
+        memory = user_memories.get(memory_key)
+    if memory is not None:
+        memory.clear()
         print(f"🗑️ История диалога для {thread_id} (тип: {memory_type}) очищена")
 
 def get_conversation_history(thread_id: str = "default", memory_type: str = DEFAULT_MEMORY_TYPE):
     """Возвращает историю диалога для указанного пользователя."""
     memory_key = f"{thread_id}_{memory_type}"
-    if memory_key in user_memories:
-        return user_memories[memory_key].chat_memory.messages
-    return []
+    with user_memories.lock:
+        memory = user_memories.get(memory_key)
+    return memory.chat_memory.messages if memory is not None else []
 
 def test_memory_types():
     """Тестирование различных типов памяти."""
@@ -313,7 +550,7 @@ def test_memory_types():
     print("=" * 50)
     
     test_query = "Привет! Как дела?"
-    memory_types = ["buffer", "window", "token_buffer", "summary"]
+    memory_types = ["summary_buffer", "buffer", "window", "token_buffer", "summary"]
     
     for memory_type in memory_types:
         print(f"\n🔍 Тест памяти типа: {memory_type}")
@@ -379,9 +616,12 @@ if __name__ == '__main__':
         test_simple_agent()
         exit(0)
     
+    start_warmup()
+    
     print("🚀 Упрощенный агент запущен!")
     print("Доступные типы памяти:")
-    print("  - buffer: полная история (по умолчанию)")
+    print("  - summary_buffer: пересказ старых и последние сообщения (по умолчанию)")
+    print("  - buffer: полная история")
     print("  - window: последние N сообщений")
     print("  - token_buffer: ограничение по токенам")
     print("  - summary: сжатая история")
@@ -398,8 +638,20 @@ if __name__ == '__main__':
                 print("Выход по команде пользователя")
                 break
             
-            result = call_agent(user_input, thread_id="main_thread")
-            print(f"\n💬 Ответ:\n{result}")
+            # Ответ печатается по мере генерации; ответ из кэша - целиком
+            print("\n💬 Ответ:")
+            streamed = []
+            
+            def print_token(token: str):
+                streamed.append(token)
+                sys.stdout.write(token)
+                sys.stdout.flush()
+            
+            result = call_agent(user_input, thread_id="main_thread", on_token=print_token)
+            if streamed:
+                print()
+            else:
+                print(result)
             
     except KeyboardInterrupt:
         print("\n\nПрограмма завершена пользователем (Ctrl+C)")
@@ -4,15 +4,20 @@
 """
 
 import os
+import re
+import hashlib
 import logging
-from typing import List, Dict, Any
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Dict, Any, Optional
+import numpy as np
 from dotenv import load_dotenv
-from langchain_gigachat import GigaChat
 from langchain_chroma import Chroma
 from langchain.agents import tool
 from langchain.schema import Document
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.embeddings import HuggingFaceEmbeddings
+from embeddings import get_embeddings, embed_query, HNSW_METADATA
+from llm_client import get_llm
 import time
 import sys
 
@@ -26,6 +31,103 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Конфигурация семантического кэша результатов поиска
+SEARCH_CACHE_SIZE = 512  # Число запросов, хранимых для каждого хранилища
+SEARCH_CACHE_THRESHOLD = 0.95  # Порог косинусной близости запросов для попадания в кэш
+SEARCH_CACHE_TTL = 3600  # Время жизни записи (секунды): после загрузки документов результаты устаревают
+
+# Ключевые слова для выбора инструментов (одно слово может относиться к нескольким инструментам)
+TOOL_KEYWORDS = {
+    "dama_search_tool": [
+        'dama', 'dmbok', 'управление данными', 'методология',
+        'стандарты', 'процессы', 'роли', 'ответственность',
+        'data governance', 'data management'
+    ],
+    "ctk_search_tool": [
+        'цтк', 'технологии', 'архитектура', 'разработка',
+        'системы', 'методология', 'практики', 'решения',
+        'технологический консалтинг'
+    ]
+}
+
+# Обратный индекс и одно регулярное выражение по всем ключевым словам строятся при импорте:
+# запрос сканируется за один проход вместо отдельного any(...) по каждому списку
+KEYWORD_TO_TOOLS: Dict[str, set] = {}
+for _tool_name, _keywords in TOOL_KEYWORDS.items():
+    for _keyword in _keywords:
+        KEYWORD_TO_TOOLS.setdefault(_keyword.lower(), set()).add(_tool_name)
+KEYWORDS_RE = re.compile("|".join(map(re.escape, sorted(KEYWORD_TO_TOOLS, key=len, reverse=True))))
+
+def match_tools(user_query: str) -> set:
+    """Возвращает имена инструментов, ключевые слова которых встречаются в запросе."""
+    return {
+        tool_name
+        for keyword in KEYWORDS_RE.findall(user_query.lower())
+        for tool_name in KEYWORD_TO_TOOLS[keyword]
+    }
+
+class SearchCache:
+    """
+    Семантический кэш результатов поиска одного хранилища.
+    Сначала ищется точное совпадение запроса (SHA-256), затем ближайший сохранённый запрос
+    по косинусной близости эмбеддингов. Записи хранятся в кольцевом буфере фиксированного размера.
+    """
+    
+    def __init__(self, embed: Callable[[str], np.ndarray], max_size: int = SEARCH_CACHE_SIZE,
+                 similarity_threshold: float = SEARCH_CACHE_THRESHOLD, ttl: float = SEARCH_CACHE_TTL):
+        self.embed = embed
+        self.max_size = max_size
+        self.similarity_threshold = similarity_threshold
+        self.ttl = ttl
+        
+        self._lock = threading.Lock()
+        self._vectors: Optional[np.ndarray] = None  # (max_size, dim), создаётся при первой записи
+        self._timestamps = np.full(max_size, -np.inf)  # Время записи слота; -inf - слот пуст
+        self._results: List[Optional[str]] = [None] * max_size
+        self._keys: List[Optional[str]] = [None] * max_size
+        self._slots: Dict[str, int] = {}  # SHA-256 запроса -> слот
+        self._next_slot = 0
+    
+    def get_or_compute(self, query: str, compute: Callable[[List[float]], str]) -> str:
+        """Возвращает закэшированный результат или вычисляет его по эмбеддингу запроса и сохраняет."""
+        key = hashlib.sha256(query.encode('utf-8')).hexdigest()
+        now = time.time()
+        with self._lock:
+            slot = self._slots.get(key)
+            if slot is not None and now - self._timestamps[slot] < self.ttl:
+                return self._results[slot]
+        
+        vector = self.embed(query)
+        with self._lock:
+            if self._vectors is not None:
+                # Эмбеддинги нормированы: скалярное произведение равно косинусной близости
+                scores = self._vectors @ vector
+                scores[self._timestamps <= now - self.ttl] = -np.inf
+                best = int(np.argmax(scores))
+                if scores[best] >= self.similarity_threshold:
+                    logger.info(f"Попадание в кэш поиска (близость: {scores[best]:.3f})")
+                    return self._results[best]
+        
+        result = compute(vector.tolist())
+        self._store(key, vector, result, now)
+        return result
+    
+    def _store(self, key: str, vector: np.ndarray, result: str, timestamp: float):
+        """Записывает результат в следующий слот кольцевого буфера, вытесняя самую старую запись."""
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_size, vector.shape[0]), dtype=np.float32)
+            slot = self._next_slot
+            self._next_slot = (slot + 1) % self.max_size
+            old_key = self._keys[slot]
+            if old_key is not None and self._slots.get(old_key) == slot:
+                del self._slots[old_key]
+            self._vectors[slot] = vector
+            self._timestamps[slot] = timestamp
+            self._results[slot] = result
+            self._keys[slot] = key
+            self._slots[key] = slot
+
 class DataManagementAgent:
     """Агент для работы с документами по управлению данными."""
     
@@ -38,26 +140,11 @@ class DataManagementAgent:
         
     def setup_llm(self):
         """Настройка GigaChat LLM."""
-        gc_auth = os.getenv('GIGACHAT_TOKEN')
-        if not gc_auth:
-            raise ValueError("Не найден токен GigaChat в переменных окружения")
-        
-        self.llm = GigaChat(
-            credentials=gc_auth,
-            model='GigaChat:latest',
-            verify_ssl_certs=False,
-            profanity_check=False
-        )
-        logger.info("GigaChat LLM инициализирован")
+        self.llm = get_llm()
         
     def setup_embeddings(self):
         """Настройка embeddings для векторного поиска."""
-        self.embeddings = HuggingFaceEmbeddings(
-            model_name="cointegrated/rubert-tiny2",
-            model_kwargs={'device': 'cpu'},
-            encode_kwargs={'normalize_embeddings': True}
-        )
-        logger.info("Embeddings инициализированы")
+        self.embeddings = get_embeddings()
         
     def setup_vector_stores(self):
         """Настройка векторных хранилищ."""
@@ -68,16 +155,22 @@ class DataManagementAgent:
         self.dama_store = Chroma(
             collection_name="dama_dmbok",
             persist_directory=persist_dir,
-            embedding_function=self.embeddings
+            embedding_function=self.embeddings,
+            collection_metadata=HNSW_METADATA
         )
         
         # Хранилище для методологических материалов ЦТК
         self.ctk_store = Chroma(
             collection_name="ctk_methodology",
             persist_directory=persist_dir,
-            embedding_function=self.embeddings
+            embedding_function=self.embeddings,
+            collection_metadata=HNSW_METADATA
         )
         
+        # Семантический кэш поиска для каждого хранилища; эмбеддинг запроса у них общий
+        self.dama_cache = SearchCache(embed_query)
+        self.ctk_cache = SearchCache(embed_query)
+        
         logger.info("Векторные хранилища инициализированы")
         
     def setup_tools(self):
@@ -86,7 +179,52 @@ class DataManagementAgent:
             self.dama_search_tool,
             self.ctk_search_tool
         ]
+        # Поиски по хранилищам независимы: выполняются параллельно, по потоку на инструмент
+        self.tool_executor = ThreadPoolExecutor(max_workers=len(self.tools), thread_name_prefix="search")
+        
+    def run_tool(self, tool_name: str, tool_func, user_query: str) -> Optional[str]:
+        """Вызов инструмента поиска; ошибки и пустые результаты логируются, возвращается None."""
+        logger.info(f"Используем инструмент: {tool_name}")
+        try:
+            result = tool_func.invoke(user_query)
+            if result and len(result.strip()) > 0:
+                return result
+            logger.warning(f"Пустой результат от {tool_name}")
+        except Exception as e:
+            logger.error(f"Ошибка инструмента {tool_name}: {e}")
+        return None
+        
+    def search_store(self, store: Chroma, cache: SearchCache, query: str, store_title: str) -> str:
+        """
+        Общий поиск для инструментов: семантический кэш, поиск по вектору запроса и форматирование результатов.
+        
+        Args:
+            store: Векторное хранилище
+            cache: Кэш поиска этого хранилища
+            query: Поисковый запрос
+            store_title: Название хранилища для сообщений ("документах DAMA DMBOK")
+            
+        Returns:
+            Найденные фрагменты с источниками или сообщение об их отсутствии
+        """
+        def search(query_embedding: List[float]) -> str:
+            docs = store.similarity_search_by_vector(query_embedding, k=5)
+            
+            if not docs:
+                return f"Информация по данному запросу не найдена в {store_title}."
+            
+            return "\n\n---\n\n".join(
+                f"Источник {i}: {doc.metadata.get('source', 'Неизвестный источник')}\n{doc.page_content}"
+                for i, doc in enumerate(docs, 1)
+            )
         
+        try:
+            logger.info(f"Поиск в {store_title}: {query}")
+            return cache.get_or_compute(query, search)
+        except Exception as e:
+            logger.error(f"Ошибка поиска в {store_title}: {e}")
+            return f"Ошибка при поиске в {store_title}: {str(e)}"
+    
     @tool
     def dama_search_tool(self, query: str) -> str:
         """
@@ -105,23 +243,7 @@ class DataManagementAgent:
         Returns:
             Релевантная информация из документов DAMA DMBOK
         """
-        try:
-            logger.info(f"Поиск в DAMA DMBOK: {query}")
-            docs = self.dama_store.similarity_search(query, k=5)
-            
-            if not docs:
-                return "Информация по данному запросу не найдена в документах DAMA DMBOK."
-            
-            result = []
-            for i, doc in enumerate(docs, 1):
-                source = doc.metadata.get('source', 'Неизвестный источник')
-                result.append(f"Источник {i}: {source}\n{doc.page_content}")
-            
-            return "\n\n---\n\n".join(result)
-            
-        except Exception as e:
-            logger.error(f"Ошибка поиска в DAMA: {e}")
-            return f"Ошибка при поиске в документах DAMA DMBOK: {str(e)}"
+        return self.search_store(self.dama_store, self.dama_cache, query, "документах DAMA DMBOK")
     
     @tool
     def ctk_search_tool(self, query: str) -> str:
@@ -141,30 +263,27 @@ class DataManagementAgent:
         Returns:
             Релевантная информация из методологических материалов ЦТК
         """
-        try:
-            logger.info(f"Поиск в ЦТК: {query}")
-            docs = self.ctk_store.similarity_search(query, k=5)
-            
-            if not docs:
-                return "Информация по данному запросу не найдена в методологических материалах ЦТК."
-            
-            result = []
-            for i, doc in enumerate(docs, 1):
-                source = doc.metadata.get('source', 'Неизвестный источник')
-                result.append(f"Источник {i}: {source}\n{doc.page_content}")
-            
-            return "\n\n---\n\n".join(result)
-            
-        except Exception as e:
-            logger.error(f"Ошибка поиска в ЦТК: {e}")
-            return f"Ошибка при поиске в материалах ЦТК: {str(e)}"
+        return self.search_store(self.ctk_store, self.ctk_cache, query, "методологических материалах ЦТК")
     
-    def process_query(self, user_query: str) -> str:
+    def generate(self, prompt: str, on_token: Optional[Callable[[str], None]] = None) -> str:
+        """Запрос к LLM; если задан on_token, части ответа передаются в него по мере генерации."""
+        if on_token is None:
+            return self.llm.invoke(prompt).content
+        
+        parts = []
+        for chunk in self.llm.stream(prompt):
+            if chunk.content:
+                on_token(chunk.content)
+                parts.append(chunk.content)
+        return "".join(parts)
+        
+    def process_query(self, user_query: str, on_token: Optional[Callable[[str], None]] = None) -> str:
         """
         Обработка запроса пользователя с использованием инструментов.
         
         Args:
             user_query: Запрос пользователя
+            on_token: Получатель частей ответа по мере генерации (необязательно)
             
         Returns:
             Ответ агента
@@ -172,32 +291,14 @@ class DataManagementAgent:
         try:
             logger.info(f"Обработка запроса: {user_query}")
             
-            # Определяем, какие инструменты использовать
-            tools_to_use = []
-            
-            # Ключевые слова для DAMA
-            dama_keywords = [
-                'dama', 'dmbok', 'управление данными', 'методология', 
-                'стандарты', 'процессы', 'роли', 'ответственность',
-                'data governance', 'data management'
-            ]
-            
-            # Ключевые слова для ЦТК
-            ctk_keywords = [
-                'цтк', 'технологии', 'архитектура', 'разработка', 
-                'системы', 'методология', 'практики', 'решения',
-                'технологический консалтинг'
+            # Выбираем инструменты на основе ключевых слов (порядок - как в TOOL_KEYWORDS)
+            matched_tools = match_tools(user_query)
+            tools_to_use = [
+                (tool_name, getattr(self, tool_name))
+                for tool_name in TOOL_KEYWORDS
+                if tool_name in matched_tools
             ]
             
-            user_query_lower = user_query.lower()
-            
-            # Выбираем инструменты на основе ключевых слов
-            if any(keyword in user_query_lower for keyword in dama_keywords):
-                tools_to_use.append(("dama_search_tool", self.dama_search_tool))
-                
-            if any(keyword in user_query_lower for keyword in ctk_keywords):
-                tools_to_use.append(("ctk_search_tool", self.ctk_search_tool))
-            
             # Если ключевые слова не найдены, используем оба инструмента
             if not tools_to_use:
                 tools_to_use = [
@@ -205,19 +306,21 @@ class DataManagementAgent:
                     ("ctk_search_tool", self.ctk_search_tool)
                 ]
             
-            # Собираем информацию из инструментов
-            collected_info = []
+            # Эмбеддинг запроса считается один раз до параллельных поисков: оба хранилища
+            # ищут по одному вектору, а не кодируют запрос каждое в своём потоке
+            embed_query(user_query)
             
-            for tool_name, tool_func in tools_to_use:
-                logger.info(f"Используем инструмент: {tool_name}")
-                try:
-                    result = tool_func.invoke(user_query)
-                    if result and len(result.strip()) > 0:
-                        collected_info.append(f"=== Информация из {tool_name} ===\n{result}")
-                    else:
-                        logger.warning(f"Пустой результат от {tool_name}")
-                except Exception as e:
-                    logger.error(f"Ошибка инструмента {tool_name}: {e}")
+            # Собираем информацию из инструментов: поиски выполняются параллельно,
+            # время ожидания - самый медленный поиск, а не их сумма. map сохраняет порядок инструментов
+            results = self.tool_executor.map(
+                lambda item: self.run_tool(item[0], item[1], user_query),
+                tools_to_use
+            )
+            collected_info = [
+                f"=== Информация из {tool_name} ===\n{result}"
+                for (tool_name, _), result in zip(tools_to_use, results)
+                if result is not None
+            ]
             
             # Формируем ответ
             if collected_info:
@@ -240,13 +343,11 @@ class DataManagementAgent:
 Ответ:"""
                 
                 logger.info("Отправляем запрос к LLM")
-                response = self.llm.invoke(prompt)
-                return response.content
+                return self.generate(prompt, on_token)
             else:
                 # Fallback к простому запросу
                 logger.info("Используем fallback - простой запрос к LLM")
-                response = self.llm.invoke(user_query)
-                return response.content
+                return self.generate(user_query, on_token)
                 
         except Exception as e:
             logger.error(f"Ошибка обработки запроса: {e}")
@@ -306,13 +407,22 @@ def main():
                 if not user_input.strip():
                     continue
                 
-                # Обработка запроса
+                # Обработка запроса: ответ печатается по мере генерации
+                print("\n💬 Ответ:")
                 start_time = time.time()
-                response = agent.process_query(user_input)
+                streamed = []
+                
+                def print_token(token: str):
+                    streamed.append(token)
+                    sys.stdout.write(token)
+                    sys.stdout.flush()
+                
+                response = agent.process_query(user_input, on_token=print_token)
                 end_time = time.time()
                 
-                print(f"\n💬 Ответ (за {end_time - start_time:.2f}с):")
-                print(f"{response}")
+                if not streamed:
+                    print(response)
+                print(f"\n⏱ За {end_time - start_time:.2f}с")
                 
             except KeyboardInterrupt:
                 print("\n\nПрограмма завершена пользователем (Ctrl+C)")
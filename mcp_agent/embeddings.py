@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Общая модель эмбеддингов для агентов и загрузчика документов.
+Модель загружается и прогревается один раз на процесс.
+"""
+
+import os
+import logging
+import functools
+import numpy as np
+import torch
+from langchain_huggingface import HuggingFaceEmbeddings
+
+logger = logging.getLogger(__name__)
+
+# Конфигурация модели эмбеддингов
+EMBEDDING_MODEL = "cointegrated/rubert-tiny2"
+EMBEDDING_DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+EMBEDDING_BATCH_SIZE = 128 if EMBEDDING_DEVICE == "cuda" else 64  # Размер пакета при эмбеддинге нескольких текстов
+# Динамическое int8-квантование линейных слоёв модели (только на CPU)
+EMBEDDING_INT8 = os.getenv('EMBEDDING_INT8', '1') == '1' and EMBEDDING_DEVICE == "cpu"
+# Точность модели: векторы разной точности немного различаются (учитывается в ключах кэшей)
+EMBEDDING_PRECISION = "int8" if EMBEDDING_INT8 else "fp16" if EMBEDDING_DEVICE == "cuda" else "fp32"
+# Компиляция трансформера через torch.compile (по умолчанию выключена: первый проход компилируется долго).
+# С int8-квантованием не используется
+EMBEDDING_COMPILE = (
+    os.getenv('EMBEDDING_COMPILE', '0') == '1' and hasattr(torch, "compile") and not EMBEDDING_INT8
+)
+COMPILE_CACHE_DIR = "./torch_compile_cache"  # Скомпилированные ядра сохраняются между перезапусками
+QUERY_EMBEDDING_CACHE_SIZE = 1024  # Число запросов, эмбеддинги которых хранятся в памяти
+
+# Параметры HNSW-индекса Chroma для новых коллекций: косинусная метрика для нормированных эмбеддингов,
+# больше связей в графе и шире поиск - выше полнота приближённого поиска при росте коллекций
+HNSW_METADATA = {
+    "hnsw:space": "cosine",
+    "hnsw:M": 32,
+    "hnsw:construction_ef": 200,
+    "hnsw:search_ef": 64
+}
+
+@functools.lru_cache(maxsize=1)
+def get_embeddings() -> HuggingFaceEmbeddings:
+    """Получение общего экземпляра HuggingFaceEmbeddings (singleton, прогревается при создании)."""
+    embeddings = HuggingFaceEmbeddings(
+        model_name=EMBEDDING_MODEL,
+        model_kwargs={'device': EMBEDDING_DEVICE},
+        encode_kwargs={'normalize_embeddings': True, 'batch_size': EMBEDDING_BATCH_SIZE}
+    )
+    if EMBEDDING_INT8:
+        # Веса Linear переводятся в int8, матричные умножения идут через int8-ядра (VNNI на современных CPU)
+        torch.quantization.quantize_dynamic(
+            embeddings._client, {torch.nn.Linear}, dtype=torch.qint8, inplace=True
+        )
+        logger.info("Модель эмбеддингов квантована в int8")
+    elif EMBEDDING_DEVICE == "cuda":
+        # Половинная точность: матричные умножения трансформера идут на тензорных ядрах
+        embeddings._client.half()
+    if EMBEDDING_COMPILE:
+        # Inductor сливает layernorm/gelu/matmul в общие ядра; длина входа меняется от запроса к запросу
+        os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", os.path.abspath(COMPILE_CACHE_DIR))
+        transformer = embeddings._client._first_module()
+        transformer.auto_model = torch.compile(transformer.auto_model, dynamic=True)
+        logger.info("Модель эмбеддингов скомпилирована (torch.compile)")
+    # Первый проход модели (выделение памяти, инициализация CUDA) выполняется здесь, а не в первом запросе
+    embeddings.embed_query("прогрев")
+    logger.info(f"Embeddings инициализированы ({EMBEDDING_DEVICE}, {EMBEDDING_PRECISION})")
+    return embeddings
+
+@functools.lru_cache(maxsize=QUERY_EMBEDDING_CACHE_SIZE)
+def embed_query(query: str) -> np.ndarray:
+    """Эмбеддинг запроса (только для чтения): считается один раз для всех хранилищ и повторных запросов."""
+    vector = np.asarray(get_embeddings().embed_query(query), dtype=np.float32)
+    vector.setflags(write=False)
+    return vector
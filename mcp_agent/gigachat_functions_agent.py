@@ -6,15 +6,18 @@ GigaChat Functions Agent - агент с использованием function c
 
 import os
 import logging
-from typing import List, Dict, Any, Optional
+import functools
+import threading
+from typing import List, Dict, Any, Optional, Tuple
 from dotenv import load_dotenv
-from langchain_gigachat import GigaChat
 from langchain_chroma import Chroma
 from langchain.schema import Document
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.embeddings import HuggingFaceEmbeddings
+from embeddings import get_embeddings, embed_query, HNSW_METADATA
+from llm_client import get_llm
 from langchain_gigachat.tools.giga_tool import giga_tool
-from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, RemoveMessage, trim_messages
+from langgraph.graph.message import REMOVE_ALL_MESSAGES
 from langgraph.prebuilt import create_react_agent
 from langgraph.checkpoint.memory import MemorySaver
 from pydantic import BaseModel, Field
@@ -32,6 +35,43 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+SEARCH_CACHE_SIZE = 1024  # Число запросов, результаты поиска по которым хранятся в памяти
+# Результат функции поиска остаётся в истории диалога и повторно отправляется в GigaChat на каждом шаге:
+# его объём ограничивается
+MAX_CHUNK_CHARS = 500  # Символов из одного фрагмента
+MAX_RESULT_CHARS = 3000  # Символов во всём результате
+TRUNCATED_MARK = "…"
+
+# В состоянии агента (чекпоинтере) хранятся и в GigaChat отправляются только последние сообщения диалога
+# (история начинается с вопроса пользователя, вызов функции не отделяется от её результата)
+MAX_HISTORY_MESSAGES = 20
+
+SYSTEM_PROMPT = """Ты - эксперт по управлению данными. У тебя есть доступ к двум источникам информации:
+1. Документы DAMA DMBOK - для информации о методологии управления данными
+2. Методологические материалы ЦТК - для информации о технологических решениях
+
+Используй соответствующие функции для поиска информации и дай подробный, структурированный ответ на русском языке."""
+
+def prune_history(state: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    pre_model_hook агента: перед вызовом модели в состоянии остаются последние MAX_HISTORY_MESSAGES сообщений.
+    Старые сообщения удаляются из чекпоинтера, а не только из промпта, поэтому память потока не растёт.
+    """
+    messages = state["messages"]
+    if len(messages) <= MAX_HISTORY_MESSAGES:
+        return {}
+    trimmed = trim_messages(
+        messages,
+        max_tokens=MAX_HISTORY_MESSAGES,
+        token_counter=len,
+        strategy="last",
+        start_on="human"
+    )
+    if not trimmed:
+        # Текущий вопрос со всеми вызовами функций не помещается в окно: состояние не обрезается
+        return {}
+    return {"messages": [RemoveMessage(id=REMOVE_ALL_MESSAGES)] + trimmed}
+
 # Модели для результатов функций
 class DamaSearchResult(BaseModel):
     """Результат поиска в документах DAMA DMBOK."""
@@ -49,54 +89,48 @@ class GigaChatFunctionsAgent:
     def __init__(self):
         """Инициализация агента."""
         self.setup_llm()
-        self.setup_embeddings()
         self.setup_vector_stores()
         self.setup_functions()
         self.setup_agent()
         
     def setup_llm(self):
-        """Настройка GigaChat LLM."""
-        gc_auth = os.getenv('GIGACHAT_TOKEN')
-        if not gc_auth:
-            raise ValueError("Не найден токен GigaChat в переменных окружения")
-        
-        self.llm = GigaChat(
-            credentials=gc_auth,
-            model='GigaChat:latest',
-            verify_ssl_certs=False,
-            profanity_check=False
-        )
-        logger.info("GigaChat LLM инициализирован")
-        
-    def setup_embeddings(self):
-        """Настройка embeddings для векторного поиска."""
-        self.embeddings = HuggingFaceEmbeddings(
-            model_name="cointegrated/rubert-tiny2",
-            model_kwargs={'device': 'cpu'},
-            encode_kwargs={'normalize_embeddings': True}
-        )
-        logger.info("Embeddings инициализированы")
+        """Настройка GigaChat LLM (общий экземпляр процесса)."""
+        self.llm = get_llm()
         
     def setup_vector_stores(self):
-        """Настройка векторных хранилищ."""
-        persist_dir = "./vector_stores"
-        os.makedirs(persist_dir, exist_ok=True)
-        
-        # Хранилище для документов DAMA DMBOK
-        self.dama_store = Chroma(
-            collection_name="dama_dmbok",
-            persist_directory=persist_dir,
-            embedding_function=self.embeddings
-        )
-        
-        # Хранилище для методологических материалов ЦТК
-        self.ctk_store = Chroma(
-            collection_name="ctk_methodology",
-            persist_directory=persist_dir,
-            embedding_function=self.embeddings
-        )
-        
-        logger.info("Векторные хранилища инициализированы")
+        """
+        Настройка векторных хранилищ. Хранилища и модель эмбеддингов загружаются при первом
+        обращении (первом поиске): диалоги без поиска по документам их не загружают.
+        """
+        self.persist_dir = "./vector_stores"
+        os.makedirs(self.persist_dir, exist_ok=True)
+        self._stores: Dict[str, Chroma] = {}
+        self._stores_lock = threading.Lock()
+    
+    def get_store(self, collection_name: str) -> Chroma:
+        """Векторное хранилище коллекции; открывается при первом обращении."""
+        with self._stores_lock:
+            store = self._stores.get(collection_name)
+            if store is None:
+                store = Chroma(
+                    collection_name=collection_name,
+                    persist_directory=self.persist_dir,
+                    embedding_function=get_embeddings(),
+                    collection_metadata=HNSW_METADATA
+                )
+                self._stores[collection_name] = store
+                logger.info(f"Векторное хранилище {collection_name} открыто")
+            return store
+    
+    @property
+    def dama_store(self) -> Chroma:
+        """Хранилище для документов DAMA DMBOK."""
+        return self.get_store("dama_dmbok")
+    
+    @property
+    def ctk_store(self) -> Chroma:
+        """Хранилище для методологических материалов ЦТК."""
+        return self.get_store("ctk_methodology")
     
     def setup_functions(self):
         """Настройка функций с использованием giga_tool декоратора."""
@@ -133,32 +167,45 @@ class GigaChatFunctionsAgent:
             }
         ]
         
+        # Агент часто повторяет один и тот же поисковый запрос между ходами диалога:
+        # результаты кэшируются по (коллекция, нормализованный запрос, k) без эмбеддинга и обхода индекса.
+        # Эмбеддинг запроса общий для обоих хранилищ: поиск одного запроса в DAMA и ЦТК кодирует его один раз
+        @functools.lru_cache(maxsize=SEARCH_CACHE_SIZE)
+        def cached_search(collection: str, query: str, k: int = 5) -> Tuple[Tuple[str, str], ...]:
+            docs = self.get_store(collection).similarity_search_by_vector(embed_query(query).tolist(), k=k)
+            return tuple(
+                (doc.metadata.get('source', 'Неизвестный источник'), doc.page_content)
+                for doc in docs
+            )
+        
+        def truncate(text: str, limit: int) -> str:
+            return text if len(text) <= limit else text[:limit].rstrip() + TRUNCATED_MARK
+        
+        def search(collection: str, query: str) -> Tuple[str, List[str]]:
+            """Поиск с кэшем: возвращает сокращённые фрагменты и список источников без повторов."""
+            results = cached_search(collection, " ".join(query.lower().split()))
+            content = "\n\n---\n\n".join(
+                f"Источник {i}: {source}\n{truncate(text, MAX_CHUNK_CHARS)}"
+                for i, (source, text) in enumerate(results, 1)
+            )
+            sources = list(dict.fromkeys(source for source, _ in results))
+            return truncate(content, MAX_RESULT_CHARS), sources
+        
         # Создаем функции с декоратором giga_tool
         @giga_tool(few_shot_examples=dama_few_shot_examples)
         def dama_search(query: str = Field(description="Поисковый запрос на русском языке для поиска в документах DAMA DMBOK")) -> DamaSearchResult:
             """Поиск информации в документах DAMA DMBOK. Используй для поиска информации о методологии управления данными, стандартах DAMA, процессах управления данными, ролях и ответственности в области управления данными, Data Management Body Of Knowledge (DMBOK)."""
             try:
                 logger.info(f"Поиск в DAMA DMBOK: {query}")
-                docs = self.dama_store.similarity_search(query, k=5)
+                content, sources = search("dama_dmbok", query)
                 
-                if not docs:
+                if not sources:
                     return DamaSearchResult(
                         content="Информация по данному запросу не найдена в документах DAMA DMBOK.",
                         sources=[]
                     )
                 
-                content_parts = []
-                sources = []
-                
-                for i, doc in enumerate(docs, 1):
-                    source = doc.metadata.get('source', 'Неизвестный источник')
-                    sources.append(source)
-                    content_parts.append(f"Источник {i}: {source}\n{doc.page_content}")
-                
-                return DamaSearchResult(
-                    content="\n\n---\n\n".join(content_parts),
-                    sources=sources
-                )
+                return DamaSearchResult(content=content, sources=sources)
                 
             except Exception as e:
                 logger.error(f"Ошибка поиска в DAMA: {e}")
@@ -172,26 +219,15 @@ class GigaChatFunctionsAgent:
             """Поиск информации в методологических материалах ЦТК. Используй для поиска информации о технологических решениях, архитектуре систем, методологиях разработки, стандартах и практиках ЦТК, методологических материалах и презентациях."""
             try:
                 logger.info(f"Поиск в ЦТК: {query}")
-                docs = self.ctk_store.similarity_search(query, k=5)
+                content, sources = search("ctk_methodology", query)
                 
-                if not docs:
+                if not sources:
                     return CtkSearchResult(
                         content="Информация по данному запросу не найдена в методологических материалах ЦТК.",
                         sources=[]
                     )
                 
-                content_parts = []
-                sources = []
-                
-                for i, doc in enumerate(docs, 1):
-                    source = doc.metadata.get('source', 'Неизвестный источник')
-                    sources.append(source)
-                    content_parts.append(f"Источник {i}: {source}\n{doc.page_content}")
-                
-                return CtkSearchResult(
-                    content="\n\n---\n\n".join(content_parts),
-                    sources=sources
-                )
+                return CtkSearchResult(content=content, sources=sources)
                 
             except Exception as e:
                 logger.error(f"Ошибка поиска в ЦТК: {e}")
@@ -217,12 +253,9 @@ class GigaChatFunctionsAgent:
             self.agent_executor = create_react_agent(
                 self.llm_with_functions, 
                 self.functions, 
+                prompt=SystemMessage(content=SYSTEM_PROMPT),
                 checkpointer=MemorySaver(),
-                state_modifier="""Ты - эксперт по управлению данными. У тебя есть доступ к двум источникам информации:
-1. Документы DAMA DMBOK - для информации о методологии управления данными
-2. Методологические материалы ЦТК - для информации о технологических решениях
-
-Используй соответствующие функции для поиска информации и дай подробный, структурированный ответ на русском языке."""
+                pre_model_hook=prune_history
             )
             
             logger.info("Агент с функциями создан")
@@ -272,6 +305,43 @@ class GigaChatFunctionsAgent:
                 logger.error(f"Ошибка fallback: {fallback_error}")
                 return f"Извините, произошла ошибка при обработке вашего запроса: {str(e)}"
     
+    async def aprocess_query(self, user_query: str, thread_id: str = "default") -> str:
+        """
+        Асинхронная обработка запроса: не блокирует цикл событий вызывающего кода.
+        Синхронные функции поиска выполняются в пуле потоков, несколько вызовов функций
+        из одного ответа модели - параллельно.
+        
+        Args:
+            user_query: Запрос пользователя
+            thread_id: ID потока для памяти
+            
+        Returns:
+            Ответ агента
+        """
+        try:
+            logger.info(f"Обработка запроса: {user_query}")
+            
+            config = {"configurable": {"thread_id": thread_id}}
+            response = await self.agent_executor.ainvoke(
+                {"messages": [HumanMessage(content=user_query)]}, 
+                config=config
+            )
+            
+            logger.info("Запрос обработан успешно")
+            return response['messages'][-1].content
+            
+        except Exception as e:
+            logger.error(f"Ошибка обработки запроса: {e}")
+            
+            # Fallback к простому запросу
+            try:
+                logger.info("Используем fallback - простой запрос к LLM")
+                response = await self.llm.ainvoke(user_query)
+                return response.content
+            except Exception as fallback_error:
+                logger.error(f"Ошибка fallback: {fallback_error}")
+                return f"Извините, произошла ошибка при обработке вашего запроса: {str(e)}"
+    
     def get_store_info(self) -> Dict[str, Any]:
         """Получение информации о векторных хранилищах."""
         try:
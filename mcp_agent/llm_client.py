@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+"""
+Общий клиент GigaChat для агентов mcp_agent.
+Один экземпляр (и один пул HTTPS-соединений) на процесс, создаётся при первом обращении.
+"""
+
+import os
+import logging
+import functools
+from dotenv import load_dotenv
+from langchain_gigachat import GigaChat
+
+# Загрузка переменных окружения
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+@functools.lru_cache(maxsize=1)
+def get_llm() -> GigaChat:
+    """Получение общего экземпляра GigaChat (singleton)."""
+    gc_auth = os.getenv('GIGACHAT_TOKEN')
+    if not gc_auth:
+        raise ValueError("Не найден токен GigaChat в переменных окружения")
+    
+    llm = GigaChat(
+        credentials=gc_auth,
+        model='GigaChat:latest',
+        verify_ssl_certs=False,
+        profanity_check=False
+    )
+    logger.info("GigaChat LLM инициализирован")
+    return llm
@@ -4,14 +4,20 @@
 """
 
 import os
+import glob
+import hashlib
 import logging
+from concurrent.futures import ProcessPoolExecutor
 from typing import List, Dict, Any
 from dotenv import load_dotenv
 from langchain_chroma import Chroma
 from langchain.schema import Document
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.embeddings import HuggingFaceEmbeddings
-from langchain_community.document_loaders import PyPDFLoader, DirectoryLoader
+from langchain.embeddings import CacheBackedEmbeddings
+from langchain.storage import LocalFileStore
+from langchain_community.document_loaders import PyPDFLoader
+from transformers import AutoTokenizer
+from embeddings import get_embeddings, EMBEDDING_MODEL, EMBEDDING_PRECISION, HNSW_METADATA
 import time
 import sys
 
@@ -25,6 +31,18 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Настройки расчёта эмбеддингов при загрузке
+INGEST_BATCH_SIZE = 512  # Число чанков, эмбеддинги которых считаются за раз (шаг отчёта о прогрессе)
+# Размер чанков в токенах модели эмбеддингов: текст сверх её контекста (512 токенов) отбрасывается
+CHUNK_SIZE_TOKENS = 384
+CHUNK_OVERLAP_TOKENS = 48
+CHROMA_ADD_BATCH_SIZE = 5000  # Число чанков в одной записи в Chroma (не больше лимита батча клиента, ~5461)
+EMBEDDING_CACHE_DIR = "./emb_cache"  # Кэш эмбеддингов чанков на диске: повторная загрузка не пересчитывает их
+
+def _load_one_pdf(path: str) -> List[Document]:
+    """Разбор одного PDF-файла (функция модульного уровня: вызывается в дочерних процессах пула)."""
+    return PyPDFLoader(path).load()
+
 class DocumentLoader:
     """Класс для загрузки документов в векторные хранилища."""
     
@@ -35,13 +53,13 @@ class DocumentLoader:
         self.setup_text_splitter()
         
     def setup_embeddings(self):
-        """Настройка embeddings."""
-        self.embeddings = HuggingFaceEmbeddings(
-            model_name="cointegrated/rubert-tiny2",
-            model_kwargs={'device': 'cpu'},
-            encode_kwargs={'normalize_embeddings': True}
+        """Настройка embeddings с дисковым кэшем (ключ - хэш текста чанка)."""
+        # Эмбеддинги разной точности немного различаются: кэш для каждой точности свой
+        self.embeddings = CacheBackedEmbeddings.from_bytes_store(
+            get_embeddings(),
+            LocalFileStore(EMBEDDING_CACHE_DIR),
+            namespace=f"{EMBEDDING_MODEL}-{EMBEDDING_PRECISION}"
         )
-        logger.info("Embeddings инициализированы")
         
     def setup_vector_stores(self):
         """Настройка векторных хранилищ."""
@@ -49,27 +67,48 @@ class DocumentLoader:
         os.makedirs(persist_dir, exist_ok=True)
         
         # Хранилище для документов DAMA DMBOK
-        self.dama_store = Chroma(
-            collection_name="dama_dmbok",
-            persist_directory=persist_dir,
-            embedding_function=self.embeddings
-        )
+        self.dama_store = self.open_store("dama_dmbok", persist_dir)
         
         # Хранилище для методологических материалов ЦТК
-        self.ctk_store = Chroma(
-            collection_name="ctk_methodology",
-            persist_directory=persist_dir,
-            embedding_function=self.embeddings
-        )
+        self.ctk_store = self.open_store("ctk_methodology", persist_dir)
         
         logger.info("Векторные хранилища инициализированы")
+    
+    def open_store(self, collection_name: str, persist_dir: str) -> Chroma:
+        """
+        Открытие коллекции с параметрами HNSW_METADATA.
+        Chroma не меняет метрику существующей коллекции (collection_metadata действует только при создании),
+        поэтому коллекция, созданная с другой метрикой (например, l2 по умолчанию), удаляется и создаётся заново.
+        Чанки затем загружаются полностью; их эмбеддинги берутся из дискового кэша.
+        """
+        store = Chroma(
+            collection_name=collection_name,
+            persist_directory=persist_dir,
+            embedding_function=self.embeddings,
+            collection_metadata=HNSW_METADATA
+        )
+        space = (store._collection.metadata or {}).get("hnsw:space", "l2")
+        if space != HNSW_METADATA["hnsw:space"]:
+            logger.warning(
+                f"Коллекция {collection_name} создана с метрикой {space} вместо {HNSW_METADATA['hnsw:space']}: "
+                f"коллекция пересоздаётся, документы будут загружены заново"
+            )
+            store.delete_collection()
+            store = Chroma(
+                collection_name=collection_name,
+                persist_directory=persist_dir,
+                embedding_function=self.embeddings,
+                collection_metadata=HNSW_METADATA
+            )
+        return store
         
     def setup_text_splitter(self):
-        """Настройка разделителя текста."""
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,
-            length_function=len,
+        """Настройка разделителя текста: длина чанков считается быстрым (Rust) токенизатором модели эмбеддингов."""
+        tokenizer = AutoTokenizer.from_pretrained(EMBEDDING_MODEL, use_fast=True)
+        self.text_splitter = RecursiveCharacterTextSplitter.from_huggingface_tokenizer(
+            tokenizer,
+            chunk_size=CHUNK_SIZE_TOKENS,
+            chunk_overlap=CHUNK_OVERLAP_TOKENS,
             separators=["\n\n", "\n", " ", ""]
         )
         logger.info("Разделитель текста настроен")
@@ -92,14 +131,13 @@ class DocumentLoader:
             return documents
         
         try:
-            # Загружаем все PDF файлы из директории
-            loader = DirectoryLoader(
-                directory,
-                glob="**/*.pdf",
-                loader_cls=PyPDFLoader
-            )
-            
-            loaded_docs = loader.load()
+            # Загружаем все PDF файлы из директории: разбор PDF нагружает CPU,
+            # поэтому файлы разбираются параллельно, по процессу на ядро
+            paths = sorted(glob.glob(os.path.join(directory, "**", "*.pdf"), recursive=True))
+            loaded_docs = []
+            with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+                for docs in executor.map(_load_one_pdf, paths):
+                    loaded_docs.extend(docs)
             logger.info(f"Загружено {len(loaded_docs)} документов из {directory}")
             
             # Добавляем метаданные
@@ -132,9 +170,35 @@ class DocumentLoader:
             logger.error(f"Ошибка разделения документов: {e}")
             return documents
     
+    def deduplicate_documents(self, documents: List[Document]) -> List[Document]:
+        """
+        Удаление повторяющихся чанков (колонтитулы, шаблонный текст).
+        SHA-256 текста чанка сохраняется в metadata["hash"] и служит его id в хранилище.
+        
+        Args:
+            documents: Список чанков
+            
+        Returns:
+            Список уникальных чанков
+        """
+        seen = set()
+        unique_docs = []
+        for doc in documents:
+            content_hash = hashlib.sha256(doc.page_content.encode('utf-8')).hexdigest()
+            if content_hash in seen:
+                continue
+            seen.add(content_hash)
+            doc.metadata["hash"] = content_hash
+            unique_docs.append(doc)
+        
+        if len(unique_docs) < len(documents):
+            logger.info(f"Отброшено {len(documents) - len(unique_docs)} повторяющихся чанков")
+        return unique_docs
+    
     def add_documents_to_store(self, documents: List[Document], store: Chroma, store_name: str):
         """
-        Добавление документов в векторное хранилище.
+        Синхронизация векторного хранилища с документами: удаляются только исчезнувшие чанки,
+        эмбеддинги считаются и записываются только для новых.
         
         Args:
             documents: Список документов
@@ -146,13 +210,44 @@ class DocumentLoader:
                 logger.warning(f"Нет документов для добавления в {store_name}")
                 return
             
-            # Очищаем существующие документы
-            store._collection.delete(where={})
-            logger.info(f"Очищено хранилище {store_name}")
+            # Повторяющиеся чанки не индексируются; id чанка - хэш его текста
+            documents = self.deduplicate_documents(documents)
+            
+            # Сравниваем с содержимым хранилища: неизменённые чанки не пересчитываются
+            existing_ids = set(store._collection.get(include=[])["ids"])
+            new_ids = {doc.metadata["hash"] for doc in documents}
+            
+            stale_ids = list(existing_ids - new_ids)
+            for start in range(0, len(stale_ids), CHROMA_ADD_BATCH_SIZE):
+                store._collection.delete(ids=stale_ids[start:start + CHROMA_ADD_BATCH_SIZE])
+            
+            documents = [doc for doc in documents if doc.metadata["hash"] not in existing_ids]
+            logger.info(
+                f"{store_name}: удалено {len(stale_ids)}, без изменений {len(new_ids) - len(documents)}, "
+                f"новых {len(documents)} чанков"
+            )
+            if not documents:
+                return
+            
+            # Эмбеддинги считаются батчами заранее (уже посчитанные берутся из кэша)
+            texts = [doc.page_content for doc in documents]
+            metadatas = [doc.metadata for doc in documents]
+            ids = [doc.metadata["hash"] for doc in documents]
+            vectors = []
+            for start in range(0, len(texts), INGEST_BATCH_SIZE):
+                vectors.extend(self.embeddings.embed_documents(texts[start:start + INGEST_BATCH_SIZE]))
+                logger.info(f"{store_name}: эмбеддинги {len(vectors)} из {len(texts)} чанков")
             
-            # Добавляем новые документы
-            store.add_documents(documents)
-            store.persist()
+            # Запись крупными пачками: меньше транзакций SQLite и перестроений HNSW-индекса.
+            # Новый клиент Chroma сохраняет данные на диск сам, persist() не нужен
+            for start in range(0, len(texts), CHROMA_ADD_BATCH_SIZE):
+                end = start + CHROMA_ADD_BATCH_SIZE
+                store._collection.add(
+                    ids=ids[start:end],
+                    embeddings=vectors[start:end],
+                    documents=texts[start:end],
+                    metadatas=metadatas[start:end]
+                )
             
             logger.info(f"Добавлено {len(documents)} документов в {store_name}")
             
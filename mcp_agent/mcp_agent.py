@@ -7,12 +7,12 @@ import os
 import logging
 from typing import List, Dict, Any, Callable, Optional
 from dotenv import load_dotenv
-from langchain_gigachat import GigaChat
 from langchain_chroma import Chroma
 from langchain.agents import tool
 from langchain.schema import Document
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.embeddings import HuggingFaceEmbeddings
+from embeddings import get_embeddings, HNSW_METADATA
+from llm_client import get_llm
 import time
 import sys
 import json
@@ -95,27 +95,12 @@ class MCPDataManagementAgent:
         self.register_local_tools()
         
     def setup_llm(self):
-        """Настройка GigaChat LLM."""
-        gc_auth = os.getenv('GIGACHAT_TOKEN')
-        if not gc_auth:
-            raise ValueError("Не найден токен GigaChat в переменных окружения")
-        
-        self.llm = GigaChat(
-            credentials=gc_auth,
-            model='GigaChat:latest',
-            verify_ssl_certs=False,
-            profanity_check=False
-        )
-        logger.info("GigaChat LLM инициализирован")
+        """Настройка GigaChat LLM (общий экземпляр процесса)."""
+        self.llm = get_llm()
         
     def setup_embeddings(self):
         """Настройка embeddings для векторного поиска."""
-        self.embeddings = HuggingFaceEmbeddings(
-            model_name="cointegrated/rubert-tiny2",
-            model_kwargs={'device': 'cpu'},
-            encode_kwargs={'normalize_embeddings': True}
-        )
-        logger.info("Embeddings инициализированы")
+        self.embeddings = get_embeddings()
         
     def setup_vector_stores(self):
         """Настройка векторных хранилищ."""
@@ -126,14 +111,16 @@ class MCPDataManagementAgent:
         self.dama_store = Chroma(
             collection_name="dama_dmbok",
             persist_directory=persist_dir,
-            embedding_function=self.embeddings
+            embedding_function=self.embeddings,
+            collection_metadata=HNSW_METADATA
         )
         
         # Хранилище для методологических материалов ЦТК
         self.ctk_store = Chroma(
             collection_name="ctk_methodology",
             persist_directory=persist_dir,
-            embedding_function=self.embeddings
+            embedding_function=self.embeddings,
+            collection_metadata=HNSW_METADATA
         )
         
         logger.info("Векторные хранилища инициализированы")
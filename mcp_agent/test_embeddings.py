@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Смоук-тесты общей модели эмбеддингов: модель строится один раз в каждой конфигурации
+(int8 на CPU, fp16 на CUDA, torch.compile) и считает нормированный вектор запроса
+"""
+
+import pytest
+
+pytest.importorskip("langchain_huggingface")
+torch = pytest.importorskip("torch")
+
+import numpy as np
+import embeddings
+
+@pytest.fixture
+def fresh_embeddings():
+    """Сбрасывает singleton модели и кэш эмбеддингов запросов до и после теста."""
+    embeddings.get_embeddings.cache_clear()
+    embeddings.embed_query.cache_clear()
+    yield
+    embeddings.get_embeddings.cache_clear()
+    embeddings.embed_query.cache_clear()
+
+def assert_normalized_query_vector():
+    vector = embeddings.embed_query("Что такое качество данных?")
+    assert vector.dtype == np.float32
+    assert vector.ndim == 1
+    assert np.isclose(np.linalg.norm(vector), 1.0, atol=1e-2)
+    assert not vector.flags.writeable
+
+def test_get_embeddings_int8_cpu(fresh_embeddings, monkeypatch):
+    """Конфигурация по умолчанию на CPU: int8-квантование линейных слоёв модели."""
+    monkeypatch.setattr(embeddings, "EMBEDDING_DEVICE", "cpu")
+    monkeypatch.setattr(embeddings, "EMBEDDING_INT8", True)
+    monkeypatch.setattr(embeddings, "EMBEDDING_COMPILE", False)
+    assert_normalized_query_vector()
+
+@pytest.mark.skipif(not torch.cuda.is_available(), reason="нет CUDA")
+def test_get_embeddings_fp16_cuda(fresh_embeddings, monkeypatch):
+    """На CUDA модель переводится в половинную точность."""
+    monkeypatch.setattr(embeddings, "EMBEDDING_DEVICE", "cuda")
+    monkeypatch.setattr(embeddings, "EMBEDDING_INT8", False)
+    monkeypatch.setattr(embeddings, "EMBEDDING_COMPILE", False)
+    assert_normalized_query_vector()
+    assert next(embeddings.get_embeddings()._client.parameters()).dtype == torch.float16
+
+@pytest.mark.skipif(not hasattr(torch, "compile"), reason="нет torch.compile")
+def test_get_embeddings_compiled(fresh_embeddings, monkeypatch, tmp_path):
+    """С EMBEDDING_COMPILE трансформер компилируется через torch.compile и считает тот же вектор."""
+    monkeypatch.setattr(embeddings, "EMBEDDING_DEVICE", "cpu")
+    monkeypatch.setattr(embeddings, "EMBEDDING_INT8", False)
+    monkeypatch.setattr(embeddings, "EMBEDDING_COMPILE", True)
+    monkeypatch.setattr(embeddings, "COMPILE_CACHE_DIR", str(tmp_path))
+    monkeypatch.delenv("TORCHINDUCTOR_CACHE_DIR", raising=False)
+    assert_normalized_query_vector()
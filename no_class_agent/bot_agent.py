@@ -43,12 +43,16 @@ COLLECTIONS = {
 # Словарь для хранения состояний пользователей
 user_states = {}
 
+# Обратный индекс пользователь -> коллекция, строится один раз при запуске
+USER_TO_COLLECTION = {
+    user_id: collection
+    for collection, users in COLLECTIONS.items()
+    for user_id in users
+}
+
 def get_user_collection(user_id: int) -> str:
     """Определяет, к какой коллекции имеет доступ пользователь"""
-    for collection, users in COLLECTIONS.items():
-        if user_id in users:
-            return collection
-    return None
+    return USER_TO_COLLECTION.get(user_id)
 
 def get_main_keyboard(user_id: int = None):
     """Создает основную клавиатуру только для пользователей с правами"""
@@ -159,11 +163,12 @@ async def docs_list(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if info["total_documents"] == 0:
         message_text = f"📊 В коллекции {collection.upper()} пока нет документов."
     else:
-        response = f"📊 Документы в коллекции {collection.upper()}: {info['total_documents']}\n\n"
-        for doc in info["documents"]:
-            response += f"📄 {os.path.basename(doc['source'])}\n"
-            response += f"   Чанков: {doc['chunks']}\n"
-        message_text = response
+        lines = [f"📊 Документы в коллекции {collection.upper()}: {info['total_documents']}\n\n"]
+        lines.extend(
+            f"📄 {os.path.basename(doc['source'])}\n   Чанков: {doc['chunks']}\n"
+            for doc in info["documents"]
+        )
+        message_text = "".join(lines)
     await update.message.reply_text(message_text)
 
 async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -324,13 +329,14 @@ async def delete_doc(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     # Формируем список документов с номерами
-    response = f"🗑️ Выберите документ для удаления (напишите номер):\n\n"
+    lines = ["🗑️ Выберите документ для удаления (напишите номер):\n\n"]
     documents_list = []
     
     for i, doc in enumerate(info["documents"], 1):
         filename = os.path.basename(doc['source'])
-        response += f"{i}. 📄 {filename} ({doc['chunks']} чанков)\n"
+        lines.append(f"{i}. 📄 {filename} ({doc['chunks']} чанков)\n")
         documents_list.append(doc['source'])  # Сохраняем полный путь
+    response = "".join(lines)
     
     # Сохраняем список документов в контексте пользователя
     user_states[user_id] = {
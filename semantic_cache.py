@@ -0,0 +1,239 @@
+"""
+Семантический кэш ответов агента.
+Похожие запросы (по косинусной близости эмбеддингов) получают сохранённый ответ без вызова LLM.
+"""
+
+import functools
+import inspect
+import logging
+import os
+import sqlite3
+import threading
+import time
+import weakref
+from collections import deque
+from typing import Callable, Dict, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Конфигурация
+CACHE_DB_PATH = "semantic_cache.sqlite"  # Файл для сохранения кэша между перезапусками
+INITIAL_SIMILARITY_THRESHOLD = 0.95  # Порог косинусной близости (без адаптации - постоянный)
+# Адаптация порога под долю попаданий включается явно: при пороге ниже ~0.9 разные короткие вопросы
+# получают близкие эмбеддинги и ответ на чужой вопрос
+ADAPTIVE_THRESHOLD = os.getenv('SEMANTIC_CACHE_ADAPTIVE', '0') == '1'
+MIN_SIMILARITY_THRESHOLD = 0.92  # Нижняя граница адаптивного порога
+MAX_SIMILARITY_THRESHOLD = 0.99  # Верхняя граница адаптивного порога
+TARGET_HIT_RATE = 0.8  # Целевая доля попаданий в кэш
+THRESHOLD_STEP = 0.01  # Шаг изменения порога
+ADAPT_INTERVAL = 20  # Через сколько обращений пересчитывать порог
+ADAPT_WINDOW = 200  # По скольким последним обращениям считается доля попаданий
+CACHED_RESPONSE_MARK = "\n\n⚡ *(cached)*"  # Пометка ответа, взятого из кэша
+ERROR_RESPONSE_PREFIX = "Извините, произошла ошибка"  # Ответы агентов об ошибке не кэшируются
+MAX_CACHE_ENTRIES = 4096  # Максимум записей: самые старые вытесняются новыми
+CACHE_TTL_SECONDS = 7 * 24 * 3600  # Время жизни записи (секунды)
+
+# Все созданные кэши: сбрасываются при изменении базы документов
+_caches = weakref.WeakSet()
+
+
+class SemanticCache:
+    """
+    Кэш ответов, ключом которого является эмбеддинг запроса.
+    Записи разделены по области (поток или пользователь): ответ одного диалога не выдаётся другому.
+    """
+
+    def __init__(
+        self,
+        embeddings,
+        db_path: str = CACHE_DB_PATH,
+        initial_similarity_threshold: float = INITIAL_SIMILARITY_THRESHOLD,
+        min_similarity_threshold: float = MIN_SIMILARITY_THRESHOLD,
+        max_similarity_threshold: float = MAX_SIMILARITY_THRESHOLD,
+        target_hit_rate: float = TARGET_HIT_RATE,
+        adaptive: bool = ADAPTIVE_THRESHOLD,
+        max_entries: int = MAX_CACHE_ENTRIES,
+        ttl_seconds: float = CACHE_TTL_SECONDS
+    ):
+        self.embeddings = embeddings
+        self.similarity_threshold = initial_similarity_threshold
+        self.min_similarity_threshold = min_similarity_threshold
+        self.max_similarity_threshold = max_similarity_threshold
+        self.target_hit_rate = target_hit_rate
+        self.adaptive = adaptive
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+
+        self._lock = threading.Lock()
+        # Кольцевой буфер: матрица выделяется один раз на max_entries строк, новая запись занимает слот самой старой
+        self._vectors: Optional[np.ndarray] = None  # Нормированные эмбеддинги (float32)
+        self._created = np.zeros(max_entries, dtype=np.float64)  # Время создания записей
+        self._responses = [None] * max_entries  # Ответы, параллельные строкам матрицы
+        self._scope_codes = np.full(max_entries, -1, dtype=np.int32)  # Коды областей записей
+        self._scope_ids: Dict[str, int] = {}  # Область -> код
+        self._size = 0
+        self._next = 0
+        self._lookups = 0
+        self._recent_hits = deque(maxlen=ADAPT_WINDOW)  # Попадания последних обращений (скользящее окно)
+
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "query TEXT NOT NULL, "
+            "embedding BLOB NOT NULL, "
+            "response TEXT NOT NULL, "
+            "created_at REAL NOT NULL DEFAULT 0, "
+            "scope TEXT NOT NULL DEFAULT '')"
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(cache)")}
+        if "created_at" not in columns:
+            # Кэш старого формата: записи без времени создания считаются устаревшими
+            self._conn.execute("ALTER TABLE cache ADD COLUMN created_at REAL NOT NULL DEFAULT 0")
+        if "scope" not in columns:
+            # Записи без области не выдаются ни одному диалогу и вытесняются новыми
+            self._conn.execute("ALTER TABLE cache ADD COLUMN scope TEXT NOT NULL DEFAULT ''")
+        self._conn.commit()
+        self._load()
+        _caches.add(self)
+
+    def _load(self):
+        """Загружает с диска не более max_entries последних неустаревших записей."""
+        expire_before = time.time() - self.ttl_seconds
+        self._conn.execute("DELETE FROM cache WHERE created_at < ?", (expire_before,))
+        self._prune_db()
+        self._conn.commit()
+        rows = self._conn.execute(
+            "SELECT embedding, response, created_at, scope FROM cache ORDER BY id DESC LIMIT ?",
+            (self.max_entries,)
+        ).fetchall()
+        for blob, response, created_at, scope in reversed(rows):
+            self._put(np.frombuffer(blob, dtype=np.float32), response, created_at, scope)
+        logger.info(f"Семантический кэш загружен: {self._size} записей")
+
+    def _prune_db(self):
+        """Удаляет с диска записи, вытесненные из кольцевого буфера."""
+        self._conn.execute(
+            "DELETE FROM cache WHERE id <= (SELECT MAX(id) FROM cache) - ?", (self.max_entries,)
+        )
+
+    def _put(self, vector: np.ndarray, response: str, created_at: float, scope: str):
+        """Записывает вектор в следующий слот кольцевого буфера (вызывается под блокировкой)."""
+        if self._vectors is None:
+            self._vectors = np.zeros((self.max_entries, vector.shape[-1]), dtype=np.float32)
+        self._vectors[self._next] = vector
+        self._responses[self._next] = response
+        self._created[self._next] = created_at
+        self._scope_codes[self._next] = self._scope_ids.setdefault(scope, len(self._scope_ids))
+        self._next = (self._next + 1) % self.max_entries
+        self._size = min(self._size + 1, self.max_entries)
+
+    def embed(self, query: str) -> np.ndarray:
+        """Возвращает L2-нормированный эмбеддинг запроса."""
+        vector = np.asarray(self.embeddings.embed_query(query), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def get(self, query_embedding: np.ndarray, scope: str = "") -> Optional[str]:
+        """Ищет ближайший сохранённый запрос области; возвращает ответ, если близость выше порога."""
+        with self._lock:
+            response = None
+            scope_code = self._scope_ids.get(scope)
+            if self._size and scope_code is not None:
+                scores = self._vectors[:self._size] @ query_embedding
+                # Устаревшие записи и записи других областей не участвуют в поиске
+                scores[self._created[:self._size] < time.time() - self.ttl_seconds] = -np.inf
+                scores[self._scope_codes[:self._size] != scope_code] = -np.inf
+                best = int(np.argmax(scores))
+                if scores[best] >= self.similarity_threshold:
+                    response = self._responses[best]
+                    logger.info(f"Попадание в семантический кэш (близость: {scores[best]:.3f})")
+
+            self._lookups += 1
+            self._recent_hits.append(response is not None)
+            if self.adaptive and self._lookups % ADAPT_INTERVAL == 0 and len(self._recent_hits) == ADAPT_WINDOW:
+                self._adapt_threshold()
+            return response
+
+    def set(self, query: str, query_embedding: np.ndarray, response: str, scope: str = ""):
+        """Сохраняет ответ для запроса области в памяти и на диске."""
+        vector = np.asarray(query_embedding, dtype=np.float32).ravel()
+        created_at = time.time()
+        with self._lock:
+            self._put(vector, response, created_at, scope)
+            self._conn.execute(
+                "INSERT INTO cache (query, embedding, response, created_at, scope) VALUES (?, ?, ?, ?, ?)",
+                (query, vector.tobytes(), response, created_at, scope)
+            )
+            self._prune_db()
+            self._conn.commit()
+
+    def clear(self):
+        """Удаляет все записи кэша из памяти и с диска."""
+        with self._lock:
+            self._responses = [None] * self.max_entries
+            self._scope_codes.fill(-1)
+            self._scope_ids.clear()
+            self._size = 0
+            self._next = 0
+            self._conn.execute("DELETE FROM cache")
+            self._conn.commit()
+        logger.info("Семантический кэш очищен")
+
+    def _adapt_threshold(self):
+        """Сдвигает порог близости так, чтобы доля попаданий в последних ADAPT_WINDOW обращениях стремилась к целевой."""
+        hit_rate = sum(self._recent_hits) / len(self._recent_hits)
+        if hit_rate < self.target_hit_rate:
+            self.similarity_threshold = max(self.min_similarity_threshold, self.similarity_threshold - THRESHOLD_STEP)
+        else:
+            self.similarity_threshold = min(self.max_similarity_threshold, self.similarity_threshold + THRESHOLD_STEP)
+        logger.info(f"Порог семантического кэша: {self.similarity_threshold:.2f} (доля попаданий: {hit_rate:.2f})")
+
+
+def clear_all_caches():
+    """Очищает все семантические кэши процесса: ответы могли опираться на изменённые документы."""
+    for cache in list(_caches):
+        cache.clear()
+
+
+def semantic_cached(
+    cache: SemanticCache,
+    scope_arg: str = "thread_id",
+    remember: Optional[Callable[..., None]] = None,
+    has_history: Optional[Callable[..., bool]] = None
+) -> Callable:
+    """
+    Декоратор call_agent: похожий запрос (первый аргумент) получает сохранённый ответ без вызова агента.
+    Поиск ограничен областью - значением аргумента scope_arg (поток или пользователь).
+    При попадании вызывается remember(query, response, *args, **kwargs) с аргументами call_agent,
+    чтобы пара вопрос-ответ попала в историю диалога, как и при обычном ответе агента.
+    Если has_history(query, *args, **kwargs) истинно, ответ зависит от предыдущих реплик
+    (уточнение вроде "а подробнее?"): кэш не читается и не пополняется.
+    Остальные аргументы (поток, пользователь, тип памяти) передаются агенту без изменений.
+    """
+    def decorator(call_agent: Callable[..., str]) -> Callable[..., str]:
+        signature = inspect.signature(call_agent)
+
+        @functools.wraps(call_agent)
+        def wrapper(query: str, *args, **kwargs) -> str:
+            bound = signature.bind(query, *args, **kwargs)
+            bound.apply_defaults()
+            scope = str(bound.arguments[scope_arg])
+            if has_history is not None and has_history(query, *args, **kwargs):
+                return call_agent(query, *args, **kwargs)
+
+            query_embedding = cache.embed(query)
+            cached_response = cache.get(query_embedding, scope)
+            if cached_response is not None:
+                if remember is not None:
+                    remember(query, cached_response, *args, **kwargs)
+                return cached_response + CACHED_RESPONSE_MARK
+
+            response = call_agent(query, *args, **kwargs)
+            if response and not response.startswith(ERROR_RESPONSE_PREFIX):
+                cache.set(query, query_embedding, response, scope)
+            return response
+        return wrapper
+    return decorator
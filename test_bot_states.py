@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Тесты хранилища состояний пользователей бота без Redis (состояния в памяти процесса с TTL)
+"""
+
+import os
+import asyncio
+import pytest
+
+pytest.importorskip("telegram")
+pytest.importorskip("langchain_gigachat")
+pytest.importorskip("langchain_chroma")
+pytest.importorskip("langchain_huggingface")
+
+# Токены проверяются при импорте бота и агента; к Telegram и GigaChat тесты не обращаются
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "test-token")
+os.environ.setdefault("GIGACHAT_TOKEN", "test-token")
+
+import bot_agent
+from bot_agent import UserStateStore
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Управляемое время time.monotonic бота."""
+    now = [1000.0]
+    monkeypatch.setattr(bot_agent.time, "monotonic", lambda: now[0])
+    return now
+
+def test_set_get_delete():
+    store = UserStateStore(ttl=60)
+    state = {'state': 'waiting_for_delete_choice', 'documents': ["a.pdf"], 'collection': "ctk_methodology"}
+
+    async def scenario():
+        assert await store.get(1) is None
+        await store.set(1, state)
+        assert await store.get(1) == state
+        assert await store.get(2) is None
+        await store.delete(1)
+        assert await store.get(1) is None
+
+    asyncio.run(scenario())
+
+def test_state_expires_after_ttl(clock):
+    store = UserStateStore(ttl=60)
+
+    async def scenario():
+        await store.set(1, {'state': 'waiting_for_document'})
+        clock[0] += 59
+        assert await store.get(1) == {'state': 'waiting_for_document'}
+        clock[0] += 2
+        assert await store.get(1) is None
+
+    asyncio.run(scenario())
+
+def test_expired_states_are_dropped_on_set(clock):
+    store = UserStateStore(ttl=60)
+
+    async def scenario():
+        await store.set(1, {'state': 'waiting_for_document'})
+        clock[0] += 61
+        await store.set(2, {'state': 'waiting_for_document'})
+        assert 1 not in store._local
+        assert 2 in store._local
+
+    asyncio.run(scenario())
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+Тесты поиска document_processor на настоящей модели эмбеддингов и временной коллекции Chroma
+"""
+
+import pytest
+
+pytest.importorskip("langchain_chroma")
+pytest.importorskip("langchain_huggingface")
+
+import numpy as np
+import document_processor
+
+TEST_COLLECTION = "test_relevance"
+TEST_TEXTS = {
+    "quality.txt": "Управление качеством данных: профилирование, очистка и мониторинг качества данных.",
+    "architecture.txt": "Архитектура данных описывает модели, потоки и хранилища данных предприятия.",
+    "recipe.txt": "Рецепт борща: свёкла, капуста, картофель, морковь и лук варятся в бульоне.",
+}
+
+@pytest.fixture
+def collection(tmp_path, monkeypatch):
+    """Временная коллекция с тремя документами разной близости к запросу."""
+    monkeypatch.setattr(document_processor, "PERSIST_DIR", str(tmp_path))
+    monkeypatch.setattr(document_processor, "vectorstores", {})
+    document_processor.clear_search_cache()
+    vectorstore = document_processor.get_vectorstore(TEST_COLLECTION)
+    vectorstore.add_texts(
+        list(TEST_TEXTS.values()),
+        metadatas=[{"source": source} for source in TEST_TEXTS]
+    )
+    yield TEST_COLLECTION
+    document_processor.clear_search_cache()
+
+def test_distances_to_similarity():
+    """Квадрат l2-расстояния нормированных векторов и косинусное расстояние переводятся в косинусную близость."""
+    distances = np.array([0.0, 0.2, 2.0], dtype=np.float32)
+    assert np.allclose(document_processor.distances_to_similarity(distances, "l2"), [1.0, 0.9, 0.0])
+    assert np.allclose(document_processor.distances_to_similarity(distances, "cosine"), [1.0, 0.8, -1.0])
+
+def test_ranked_query_keeps_best_match(collection):
+    """Лучший фрагмент идёт первым, имеет наибольшую близость и проходит порог релевантности."""
+    results = document_processor.search_results("Как управлять качеством данных?", collection, n_results=3)
+
+    assert len(results) == 3
+    assert results.sources[0] == "quality.txt"
+    assert list(results.scores) == sorted(results.scores, reverse=True)
+
+    relevant = results.above()
+    assert relevant.sources[0] == "quality.txt"
+    assert relevant.scores[0] == results.scores.max()
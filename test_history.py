@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""
+Тесты истории диалога агентов: хранятся только последние HISTORY_MAX_MESSAGES сообщений потока
+"""
+
+import os
+import pytest
+
+pytest.importorskip("langchain_gigachat")
+pytest.importorskip("langchain_chroma")
+pytest.importorskip("langchain_huggingface")
+
+# Клиент GigaChat создаётся при импорте агентов, но к API в этих тестах не обращается
+os.environ.setdefault("GIGACHAT_TOKEN", "test-token")
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+def turns(count):
+    return [(f"вопрос {i}", f"ответ {i}") for i in range(count)]
+
+def test_autofunc_history_keeps_last_messages():
+    import autoFunc_tool_calling_agent as agent
+
+    for question, answer in turns(5):
+        agent.remember_turn("history-test", question, answer)
+
+    history = list(agent.HISTORY["history-test"])
+    assert len(history) == agent.HISTORY_MAX_MESSAGES
+    assert isinstance(history[0], HumanMessage) and history[0].content == "вопрос 1"
+    assert isinstance(history[-1], AIMessage) and history[-1].content == "ответ 4"
+    assert "history-other" not in agent.HISTORY
+
+def test_tool_calling_history_keeps_last_messages():
+    import gigachat_tool_calling_agent as agent
+
+    for question, answer in turns(5):
+        agent.remember_turn(question, answer, "history-test")
+
+    history = list(agent._get_history("history-test"))
+    assert len(history) == agent.HISTORY_MAX_MESSAGES
+    assert isinstance(history[0], HumanMessage) and history[0].content == "вопрос 1"
+    assert isinstance(history[-1], AIMessage) and history[-1].content == "ответ 4"
+    assert not agent.has_history("вопрос", "history-other")
+    assert agent.has_history("вопрос", "history-test")
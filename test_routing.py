@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""
+Тесты маршрутизатора запросов gigachat_functions_agent
+"""
+
+import os
+import pytest
+
+pytest.importorskip("langgraph")
+pytest.importorskip("langchain_gigachat")
+pytest.importorskip("langchain_chroma")
+pytest.importorskip("langchain_huggingface")
+
+# Клиент GigaChat создаётся при первом запросе; маршрутизатор к API не обращается
+os.environ.setdefault("GIGACHAT_TOKEN", "test-token")
+
+from gigachat_functions_agent import choose_route
+
+@pytest.mark.parametrize("query", ["Привет!", "привет, как дела?", "Спасибо большое!", "Добрый день. Кто ты?", "пока"])
+def test_small_talk_goes_direct(query):
+    assert choose_route(query) == ("direct", None)
+
+@pytest.mark.parametrize("query", [
+    "что такое качество данных?",
+    "Какие бывают роли владельцев данных?",
+    "приветствие в регламенте",
+    "спасибо, а как вести каталог данных?",
+])
+def test_questions_without_keywords_go_to_agent(query):
+    assert choose_route(query) == ("agent", None)
+
+@pytest.mark.parametrize("query, collection", [
+    ("Что такое DMBOK?", "dama_dmbok"),
+    ("Расскажи про регламенты ЦТК", "ctk_methodology"),
+    ("Привет! Какие метаданные СБФ есть?", "sbf_meta"),
+])
+def test_keywords_of_one_collection_go_to_tool(query, collection):
+    assert choose_route(query) == ("tool", collection)
+
+def test_keywords_of_several_collections_go_to_agent():
+    assert choose_route("Сравни подходы DAMA и ЦТК") == ("agent", None)
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Тесты семантического кэша ответов: попадание по близости, области, время жизни, вытеснение и декоратор
+"""
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+import semantic_cache
+from semantic_cache import SemanticCache, semantic_cached, CACHED_RESPONSE_MARK
+
+class FixedEmbeddings:
+    """Эмбеддинги с заранее заданными векторами запросов (близость между ними известна)."""
+
+    VECTORS = {
+        "что такое dmbok": [1.0, 0.0, 0.0],
+        "что такое dmbok?": [0.99, 0.14, 0.0],  # Косинусная близость с первым ~0.99
+        "роли в управлении данными": [0.0, 1.0, 0.0],
+        "рецепт борща": [0.0, 0.0, 1.0],
+    }
+
+    def embed_query(self, query: str):
+        return self.VECTORS[query]
+
+@pytest.fixture
+def cache(tmp_path):
+    return SemanticCache(FixedEmbeddings(), db_path=str(tmp_path / "cache.sqlite"))
+
+def put(cache, query, response, scope="user"):
+    cache.set(query, cache.embed(query), response, scope)
+
+def test_similar_query_hits_and_different_misses(cache):
+    put(cache, "что такое dmbok", "DMBOK - свод знаний")
+    assert cache.get(cache.embed("что такое dmbok?"), "user") == "DMBOK - свод знаний"
+    assert cache.get(cache.embed("роли в управлении данными"), "user") is None
+
+def test_scope_isolates_users(cache):
+    put(cache, "что такое dmbok", "ответ первому", scope="first")
+    assert cache.get(cache.embed("что такое dmbok"), "second") is None
+    put(cache, "что такое dmbok", "ответ второму", scope="second")
+    assert cache.get(cache.embed("что такое dmbok"), "first") == "ответ первому"
+    assert cache.get(cache.embed("что такое dmbok"), "second") == "ответ второму"
+
+def test_expired_entries_are_skipped(tmp_path, monkeypatch):
+    cache = SemanticCache(FixedEmbeddings(), db_path=str(tmp_path / "cache.sqlite"), ttl_seconds=60)
+    now = 1_000_000.0
+    monkeypatch.setattr(semantic_cache.time, "time", lambda: now)
+    put(cache, "что такое dmbok", "ответ")
+    now += 61
+    assert cache.get(cache.embed("что такое dmbok"), "user") is None
+
+def test_oldest_entry_is_evicted(tmp_path):
+    cache = SemanticCache(FixedEmbeddings(), db_path=str(tmp_path / "cache.sqlite"), max_entries=2)
+    put(cache, "что такое dmbok", "первый")
+    put(cache, "роли в управлении данными", "второй")
+    put(cache, "рецепт борща", "третий")
+    assert cache.get(cache.embed("что такое dmbok"), "user") is None
+    assert cache.get(cache.embed("рецепт борща"), "user") == "третий"
+
+def test_entries_survive_restart_and_clear(tmp_path):
+    db_path = str(tmp_path / "cache.sqlite")
+    put(SemanticCache(FixedEmbeddings(), db_path=db_path), "что такое dmbok", "ответ")
+    restored = SemanticCache(FixedEmbeddings(), db_path=db_path)
+    assert restored.get(restored.embed("что такое dmbok"), "user") == "ответ"
+    semantic_cache.clear_all_caches()
+    assert restored.get(restored.embed("что такое dmbok"), "user") is None
+    assert SemanticCache(FixedEmbeddings(), db_path=db_path).get(restored.embed("что такое dmbok"), "user") is None
+
+def test_threshold_is_fixed_by_default(cache):
+    for _ in range(semantic_cache.ADAPT_WINDOW + semantic_cache.ADAPT_INTERVAL):
+        cache.get(cache.embed("рецепт борща"), "user")
+    assert cache.similarity_threshold == semantic_cache.INITIAL_SIMILARITY_THRESHOLD
+
+def test_decorator_caches_per_thread_and_remembers_hits(cache):
+    calls, remembered, history = [], [], {}
+
+    def remember(query, response, thread_id="default"):
+        remembered.append((thread_id, query, response))
+
+    @semantic_cached(cache, remember=remember, has_history=lambda query, thread_id="default": bool(history.get(thread_id)))
+    def call_agent(query, thread_id="default"):
+        calls.append((thread_id, query))
+        return f"ответ на {query}"
+
+    assert call_agent("что такое dmbok", "a") == "ответ на что такое dmbok"
+    assert call_agent("что такое dmbok?", thread_id="a") == "ответ на что такое dmbok" + CACHED_RESPONSE_MARK
+    assert remembered == [("a", "что такое dmbok?", "ответ на что такое dmbok")]
+    # Другой поток кэшем первого не пользуется
+    call_agent("что такое dmbok", "b")
+    # В идущем диалоге кэш не читается
+    history["a"] = ["предыдущая реплика"]
+    call_agent("что такое dmbok", "a")
+    assert calls == [("a", "что такое dmbok"), ("b", "что такое dmbok"), ("a", "что такое dmbok")]
+
+def test_error_responses_are_not_cached(cache):
+    @semantic_cached(cache)
+    def call_agent(query, thread_id="default"):
+        return semantic_cache.ERROR_RESPONSE_PREFIX + " при обработке"
+
+    call_agent("что такое dmbok")
+    assert cache.get(cache.embed("что такое dmbok"), "default") is None